@@ -1,8 +1,14 @@
 """
 Модуль аутентификации и авторизации пользователей
+bcrypt (~0.25 с CPU на вызов) выполняется в отдельном ограниченном пуле — event loop воркера
+не блокируется, а шторм логинов занимает не больше PASSWORD_HASH_WORKERS ядер на воркер
 """
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Callable, Any
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import asyncio
+import time
 from jose import JWTError, jwt
 import bcrypt
 from pydantic import BaseModel
@@ -13,6 +19,12 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
 
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))   # стоимость; старые хеши пересчитываются при входе
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread").lower()   # thread | process
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))       # одновременных bcrypt на воркер
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))  # ожидающих сверх них — иначе 503
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "10"))            # process: приоритет ниже API
+
 
 class Token(BaseModel):
     """Модель токена доступа"""
@@ -47,12 +59,107 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 
-def get_password_hash(password: str) -> str:
+def get_password_hash(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
     """Хеширование пароля"""
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
     return hashed.decode('utf-8')
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """Хеш посчитан с меньшей стоимостью, чем BCRYPT_ROUNDS ($2b$12$...)"""
+    try:
+        return int(hashed_password.split("$")[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+class PasswordHasherBusyError(Exception):
+    """Очередь проверки паролей переполнена — повторить через retry_after секунд"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Слишком много попыток входа, повторите через {int(retry_after) + 1} с")
+
+
+def _lower_priority() -> None:
+    try:
+        os.nice(PASSWORD_HASH_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+class PasswordHasher:
+    """Ограниченный пул для bcrypt: PASSWORD_HASH_WORKERS выполняются, до PASSWORD_HASH_MAX_QUEUE ждут,
+    остальные сразу отклоняются. thread — bcrypt отпускает GIL; process — отдельные процессы
+    с пониженным приоритетом (nice), CPU планировщик отдаёт в первую очередь API"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._avg_seconds = 0.25   # скользящее среднее одного вызова, сек
+        self._counters = {"completed": 0, "rejected": 0, "rehashed": 0}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if PASSWORD_HASH_EXECUTOR == "process":
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_lower_priority,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def retry_after(self) -> float:
+        return max(1.0, self._pending / self.workers * self._avg_seconds)
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        if self._pending >= self.workers + self.max_queue:
+            self._counters["rejected"] += 1
+            raise PasswordHasherBusyError(self.retry_after())
+        waited = self._pending >= self.workers
+        self._pending += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+            self._counters["completed"] += 1
+            if not waited:
+                # Время самого bcrypt (без ожидания в очереди) — для оценки Retry-After
+                self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * (time.monotonic() - started)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password, BCRYPT_ROUNDS)
+
+    async def rehash_if_needed(self, password: str, hashed_password: str) -> Optional[str]:
+        """Новый хеш, если старый дешевле BCRYPT_ROUNDS; под нагрузкой пересчёт откладывается"""
+        if not needs_rehash(hashed_password) or self._pending >= self.workers:
+            return None
+        self._counters["rehashed"] += 1
+        return await self.hash(password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "executor": PASSWORD_HASH_EXECUTOR,
+            "rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "avg_seconds": round(self._avg_seconds, 4),
+            **self._counters,
+        }
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Создание JWT токена"""
     to_encode = data.copy()
@@ -73,3 +180,7 @@ def decode_access_token(token: str) -> Optional[dict]:
         return payload
     except JWTError:
         return None
+
+
+# Глобальный экземпляр
+password_hasher = PasswordHasher()
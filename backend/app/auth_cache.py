@@ -0,0 +1,204 @@
+"""
+Кэш проверенных токенов внутри процесса: токен → (username, plan, disabled)
+Попадание не декодирует JWT и не ходит в БД. Запись живёт AUTH_CACHE_TTL секунд, но не дольше
+самого токена; при переполнении вытесняется самая давно использованная.
+Смена тарифа и блокировка сбрасывают записи пользователя сразу в своём процессе, а через
+журнал инвалидаций в локальном SQLite — и в остальных воркерах (не позже AUTH_CACHE_SYNC_INTERVAL).
+Журнал и счётчики читает и пишет фоновый поток: get() не ходит в SQLite и не ждёт его блокировок
+"""
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from app.local_store import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_ENABLED = os.getenv("AUTH_CACHE_ENABLED", "1") == "1"
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))                    # сек
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_SYNC_INTERVAL = float(os.getenv("AUTH_CACHE_SYNC_INTERVAL", "1"))  # сек между чтениями журнала
+JOURNAL_RETENTION = 3600.0   # сек хранения записей журнала (больше любого TTL кэша)
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS auth_cache_invalidations (
+        seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+        username   TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS auth_cache_stats (
+        name  TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )""",
+]
+
+Entry = Tuple[str, str, bool, float]   # (username, plan, disabled, expires_at)
+
+
+class AuthCache:
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_seq: Optional[int] = None
+        self._synced_at = 0.0
+        self._syncing = False
+        self._flush_lock = threading.Lock()   # фоновая синхронизация и stats() не отправляют дельту дважды
+        # Счётчики процесса; при синхронизации дельты уходят в общую таблицу
+        self._counters: Dict[str, int] = {}
+        self._flushed: Dict[str, int] = {}
+
+    def _conn(self):
+        return ensure_schema("auth_cache", _SCHEMA)
+
+    def _count(self, name: str, delta: int = 1) -> None:
+        self._counters[name] = self._counters.get(name, 0) + delta
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Пользователь по токену или None (промах — токен нужно проверить заново)"""
+        if not AUTH_CACHE_ENABLED:
+            return None
+        self._maybe_sync()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self._count("misses")
+                return None
+            if entry[3] <= now:
+                del self._entries[token]
+                self._count("expired")
+                self._count("misses")
+                return None
+            self._entries.move_to_end(token)
+            self._count("hits")
+        username, plan, disabled, _ = entry
+        return {"username": username, "plan": plan, "disabled": disabled}
+
+    def set(self, token: str, user: Dict[str, Any], token_expires_at: Optional[float] = None) -> None:
+        if not AUTH_CACHE_ENABLED:
+            return
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        with self._lock:
+            if self._last_seq is None:
+                # Позиция в журнале ещё не прочитана — инвалидацию до неё запись бы пропустила
+                return
+            self._entries[token] = (
+                user["username"], user.get("plan") or "free", bool(user.get("disabled")), expires_at,
+            )
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count("evicted")
+
+    def _drop_user(self, username: str) -> int:
+        with self._lock:
+            tokens = [token for token, entry in self._entries.items() if entry[0] == username]
+            for token in tokens:
+                del self._entries[token]
+        return len(tokens)
+
+    def invalidate(self, username: str) -> None:
+        """Сбросить записи пользователя здесь и (через журнал) в остальных воркерах"""
+        self._drop_user(username)
+        with self._lock:
+            self._count("invalidations")
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.execute(
+                "INSERT INTO auth_cache_invalidations (username, created_at) VALUES (?, ?)",
+                (username, now),
+            )
+            conn.execute("DELETE FROM auth_cache_invalidations WHERE created_at < ?", (now - JOURNAL_RETENTION,))
+        except Exception as e:
+            # Без журнала другие воркеры увидят изменение не позже чем через AUTH_CACHE_TTL
+            logger.warning(f"Не удалось записать инвалидацию кэша авторизации: {e}")
+
+    def _maybe_sync(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._syncing or now - self._synced_at < AUTH_CACHE_SYNC_INTERVAL:
+                return
+            self._syncing = True
+            self._synced_at = now
+        threading.Thread(target=self._sync_in_background, name="auth-cache-sync", daemon=True).start()
+
+    def _sync_in_background(self) -> None:
+        try:
+            self._sync()
+        except Exception as e:
+            # Журнал недоступен — не рискуем устаревшими тарифами и блокировками
+            logger.warning(f"Не удалось прочитать журнал инвалидаций кэша авторизации: {e}")
+            with self._lock:
+                self._entries.clear()
+        finally:
+            with self._lock:
+                self._syncing = False
+
+    def _sync(self) -> None:
+        conn = self._conn()
+        if self._last_seq is None:
+            # Старт процесса: кэш пуст, прошлые инвалидации не нужны
+            self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM auth_cache_invalidations").fetchone()[0]
+        else:
+            rows = conn.execute(
+                "SELECT seq, username FROM auth_cache_invalidations WHERE seq > ? ORDER BY seq",
+                (self._last_seq,),
+            ).fetchall()
+            for seq, username in rows:
+                self._drop_user(username)
+                self._last_seq = seq
+        self._flush_counters(conn)
+
+    def _flush_counters(self, conn) -> None:
+        with self._flush_lock:
+            with self._lock:
+                deltas = [
+                    (name, value - self._flushed.get(name, 0))
+                    for name, value in self._counters.items()
+                    if value != self._flushed.get(name, 0)
+                ]
+            if not deltas:
+                return
+            conn.executemany(
+                "INSERT INTO auth_cache_stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                deltas,
+            )
+            for name, delta in deltas:
+                self._flushed[name] = self._flushed.get(name, 0) + delta
+
+    def stats(self) -> dict:
+        """Счётчики всех воркеров (с задержкой до AUTH_CACHE_SYNC_INTERVAL) и текущего процесса"""
+        conn = self._conn()
+        self._flush_counters(conn)
+        shared = dict(conn.execute("SELECT name, value FROM auth_cache_stats").fetchall())
+        hits, misses = shared.pop("hits", 0), shared.pop("misses", 0)
+        local_hits, local_misses = self._counters.get("hits", 0), self._counters.get("misses", 0)
+        return {
+            "enabled": AUTH_CACHE_ENABLED,
+            "ttl_seconds": self.ttl,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "expired": shared.pop("expired", 0),
+            "evicted": shared.pop("evicted", 0),
+            "invalidations": shared.pop("invalidations", 0),
+            "process": {
+                "entries": len(self._entries),
+                "hits": local_hits,
+                "misses": local_misses,
+                "hit_rate": round(local_hits / (local_hits + local_misses), 4) if local_hits + local_misses else 0.0,
+            },
+        }
+
+
+# Глобальный экземпляр
+auth_cache = AuthCache()
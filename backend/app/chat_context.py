@@ -0,0 +1,123 @@
+"""
+История чата под бюджет токенов
+В промпт попадают последние сообщения, которые помещаются в бюджет; более ранние
+сжимаются в накопительный конспект. Конспект обновляется инкрементально и уже после
+ответа, поэтому каждый ход чата отправляет в LLM ограниченный по размеру промпт.
+
+Состояние конспекта: {"summary": текст, "upto": сколько сообщений в него вошло,
+"prefix": хэш этих сообщений} — если историю на клиенте поменяли, конспект не подходит
+"""
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+from app.llm import call_groq, estimate_tokens
+from app.local_store import DiskCache
+from app.prompts import PROMPT_CHAT_SUMMARY
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))       # бюджет на последние сообщения
+CHAT_MESSAGE_TOKENS = int(os.getenv("CHAT_MESSAGE_TOKENS", "500"))        # одно сообщение в промпте — не длиннее
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "400"))        # размер конспекта
+CLARIFY_HISTORY_TOKENS = int(os.getenv("CLARIFY_HISTORY_TOKENS", "800"))  # история диалога в /api/clarify
+
+NO_HISTORY = "Нет предыдущих сообщений"
+
+# Конспекты переписки в /api/chat (без сохранённого агента) — по пользователю и дашборду
+chat_summaries = DiskCache("chat_summaries", ttl=30 * 24 * 3600, max_entries=20000, max_bytes=32 * 1024 * 1024)
+
+
+def _role(message: Dict[str, str]) -> str:
+    return "Пользователь" if message.get("role") == "user" else "Ассистент"
+
+
+def clip(text: str, max_tokens: int) -> str:
+    """Обрезает слишком длинное сообщение (по оценке токенов)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 3].rstrip() + "…"
+
+
+def _line(message: Dict[str, str]) -> str:
+    return f"{_role(message)}: {clip(message.get('content', ''), CHAT_MESSAGE_TOKENS)}"
+
+
+def recent_start(messages: List[Dict[str, str]], budget: int) -> int:
+    """Индекс, с которого последние сообщения помещаются в бюджет (последнее — всегда)"""
+    used = 0
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(_line(messages[i])) + 1
+        if used > budget and i < len(messages) - 1:
+            return i + 1
+    return 0
+
+
+def _prefix_hash(messages: List[Dict[str, str]], upto: int) -> str:
+    raw = json.dumps([[m.get("role"), m.get("content")] for m in messages[:upto]], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def valid_state(state: Optional[Dict[str, Any]], messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Сохранённый конспект, если он относится к началу этой истории, иначе пустой"""
+    if state and state.get("summary") and 0 < state.get("upto", 0) <= len(messages):
+        if state.get("prefix") == _prefix_hash(messages, state["upto"]):
+            return state
+    return {"summary": "", "upto": 0, "prefix": ""}
+
+
+def format_history(
+    messages: List[Dict[str, str]],
+    state: Optional[Dict[str, Any]] = None,
+    budget: int = CHAT_HISTORY_TOKENS,
+) -> str:
+    """История для промпта: конспект + последние сообщения в пределах бюджета"""
+    state = valid_state(state, messages)
+    start = max(state["upto"], recent_start(messages, budget))
+    lines = []
+    if state["summary"]:
+        lines.append(f"Краткое содержание ранней переписки: {state['summary']}")
+    lines.extend(_line(m) for m in messages[start:])
+    return "\n".join(lines) or NO_HISTORY
+
+
+def compaction_cut(messages: List[Dict[str, str]], state: Dict[str, Any]) -> Optional[int]:
+    """Сколько сообщений должно войти в конспект, если хвост после него вышел за бюджет
+
+    Сжимаем с запасом (хвост до половины бюджета) — следующие несколько ходов обходятся без LLM.
+    """
+    tail = messages[state["upto"]:]
+    if sum(estimate_tokens(_line(m)) + 1 for m in tail) <= CHAT_HISTORY_TOKENS:
+        return None
+    cut = recent_start(messages, CHAT_HISTORY_TOKENS // 2)
+    return cut if cut > state["upto"] else None
+
+
+async def compact(messages: List[Dict[str, str]], state: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Новое состояние конспекта или None, если сжимать пока нечего (или LLM недоступен)"""
+    state = valid_state(state, messages)
+    cut = compaction_cut(messages, state)
+    if cut is None:
+        return None
+    prompt = PROMPT_CHAT_SUMMARY.format(
+        summary=state["summary"] or "пока пусто",
+        messages="\n".join(_line(m) for m in messages[state["upto"]:cut]),
+        max_words=CHAT_SUMMARY_TOKENS // 2,
+    )
+    try:
+        result = await call_groq(prompt, max_retries=1)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить конспект чата: {e}")
+        return None
+    summary = str(result.get("summary") or "").strip()
+    if not summary:
+        return None
+    logger.info(f"Конспект чата обновлён: {cut - state['upto']} сообщений сжато")
+    return {"summary": clip(summary, CHAT_SUMMARY_TOKENS), "upto": cut, "prefix": _prefix_hash(messages, cut)}
+
+
+def conversation_key(username: str, dashboard: Dict[str, Any]) -> str:
+    """Ключ переписки в /api/chat — пользователь + дашборд, о котором идёт речь"""
+    raw = json.dumps([username, dashboard], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
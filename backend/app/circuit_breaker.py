@@ -0,0 +1,185 @@
+"""
+Circuit breaker перед LLM-провайдером
+closed — запросы идут как обычно; open — провайдер считается недоступным, вызовы сразу
+отклоняются (этапы пайплайна берут fallback, чат отвечает 503); half_open — после паузы
+пропускается пробный запрос. Решение принимается по скользящему окну ошибок и медленных ответов
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+import httpx
+from groq import APIConnectionError, APIStatusError
+from app.local_store import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ENABLED = os.getenv("LLM_BREAKER_ENABLED", "1") == "1"
+BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "60"))              # сек, скользящее окно
+BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))           # меньше — не судим
+BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("LLM_BREAKER_SLOW_CALL", "30"))        # сек, медленный = ошибка
+BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("LLM_BREAKER_HALF_OPEN_CALLS", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS circuit_breaker_state (
+        worker     TEXT PRIMARY KEY,
+        state      TEXT NOT NULL,
+        calls      INTEGER NOT NULL,
+        failures   INTEGER NOT NULL,
+        opened_at  REAL,
+        updated_at REAL NOT NULL
+    )""",
+]
+
+
+class LLMUnavailableError(Exception):
+    """LLM-провайдер недоступен (breaker разомкнут) — повторить через retry_after секунд"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"LLM-провайдер временно недоступен, повторите через {int(retry_after) + 1} с")
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self._state = CLOSED
+        self._calls = deque()          # (timestamp, failed)
+        self._opened_at: Optional[float] = None
+        self._half_open_inflight = 0
+        self._transitions = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.time() - self._opened_at >= BREAKER_OPEN_SECONDS:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    def is_open(self) -> bool:
+        """Проверка без резервирования пробного запроса (для ранних 503 в эндпоинтах)"""
+        return BREAKER_ENABLED and self.state == OPEN
+
+    def retry_after(self) -> float:
+        if self._state != OPEN or self._opened_at is None:
+            return 1.0
+        return max(1.0, BREAKER_OPEN_SECONDS - (time.time() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли делать вызов; в half_open резервирует слот пробного запроса"""
+        if not BREAKER_ENABLED:
+            return True
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._half_open_inflight < BREAKER_HALF_OPEN_CALLS:
+            self._half_open_inflight += 1
+            return True
+        return False
+
+    def record_success(self, latency: float) -> None:
+        if latency >= BREAKER_SLOW_CALL:
+            logger.warning(f"Медленный ответ LLM: {latency:.1f}с")
+            self._record(failed=True)
+        else:
+            self._record(failed=False)
+
+    def record_error(self, error: BaseException) -> None:
+        """Сеть, таймауты и 5xx — сбой провайдера; 429, 4xx и отмена — нейтральный исход.
+        Обрыв потокового ответа приходит как исключение httpx — тоже сбой"""
+        if isinstance(error, (APIConnectionError, httpx.TransportError)) or (
+            isinstance(error, APIStatusError) and error.status_code >= 500
+        ):
+            self._record(failed=True)
+        else:
+            self._release()
+
+    def _release(self) -> None:
+        if self._state == HALF_OPEN and self._half_open_inflight > 0:
+            self._half_open_inflight -= 1
+
+    def _record(self, failed: bool) -> None:
+        if not BREAKER_ENABLED:
+            return
+        now = time.time()
+        if self._state == HALF_OPEN:
+            self._release()
+            self._set_state(OPEN if failed else CLOSED)
+            return
+        self._calls.append((now, failed))
+        while self._calls and self._calls[0][0] < now - BREAKER_WINDOW:
+            self._calls.popleft()
+        if self._state == CLOSED and failed and len(self._calls) >= BREAKER_MIN_CALLS:
+            failures = sum(1 for _, f in self._calls if f)
+            if failures / len(self._calls) >= BREAKER_FAILURE_RATE:
+                self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning(f"Circuit breaker LLM: {self._state} → {state}")
+        self._state = state
+        self._transitions += 1
+        self._half_open_inflight = 0
+        if state == OPEN:
+            self._opened_at = time.time()
+        if state == CLOSED:
+            self._calls.clear()
+            self._opened_at = None
+        self._publish()
+
+    def stats(self) -> dict:
+        failures = sum(1 for _, f in self._calls if f)
+        return {
+            "worker": str(os.getpid()),
+            "state": self.state,
+            "calls": len(self._calls),
+            "failures": failures,
+            "failure_rate": round(failures / len(self._calls), 4) if self._calls else 0.0,
+            "opened_at": self._opened_at,
+            "retry_after": round(self.retry_after(), 1) if self._state == OPEN else None,
+            "transitions": self._transitions,
+        }
+
+    # ── Видимость для админки: снимок состояния каждого воркера в локальном SQLite ──
+
+    def _publish(self) -> None:
+        snapshot = self.stats()
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, snapshot)
+        except RuntimeError:
+            self._write_snapshot(snapshot)
+
+    @staticmethod
+    def _write_snapshot(snapshot: dict) -> None:
+        try:
+            ensure_schema("circuit_breaker", _SCHEMA).execute(
+                "INSERT OR REPLACE INTO circuit_breaker_state "
+                "(worker, state, calls, failures, opened_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (snapshot["worker"], snapshot["state"], snapshot["calls"], snapshot["failures"],
+                 snapshot["opened_at"], time.time()),
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние breaker: {e}")
+
+    @staticmethod
+    def all_workers() -> list:
+        """Последние переходы состояния во всех воркерах"""
+        rows = ensure_schema("circuit_breaker", _SCHEMA).execute(
+            "SELECT worker, state, calls, failures, opened_at, updated_at "
+            "FROM circuit_breaker_state ORDER BY updated_at DESC"
+        ).fetchall()
+        return [
+            dict(zip(("worker", "state", "calls", "failures", "opened_at", "updated_at"), row))
+            for row in rows
+        ]
+
+
+# Глобальный экземпляр (один на воркер)
+circuit_breaker = CircuitBreaker()
@@ -3,13 +3,20 @@
 Автоматически определяет тип БД из DATABASE_URL
 """
 import os
-from typing import Optional, List, Dict, Any
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Boolean, func, text
+from typing import Optional, List, Dict, Any, Tuple
+from sqlalchemy import (
+    create_engine, Column, String, Text, DateTime, Boolean, Integer, func, text, or_, and_,
+    select, insert, exists, literal, case, Date,
+)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, date
 import json
 import uuid
-from app.auth import get_password_hash, verify_password
+from app.auth import get_password_hash
+from app.auth_cache import auth_cache
 
 # Автоматическое определение БД
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ai_architect.db")
@@ -40,7 +47,7 @@ class UserModel(Base):
     plan            = Column(String, default="free")   # free | starter | pro | admin
     plan_expires_at = Column(DateTime, nullable=True)  # None = бессрочно
     disabled        = Column(Boolean, default=False)
-    created_at      = Column(DateTime, default=datetime.utcnow)
+    created_at      = Column(DateTime, default=datetime.utcnow, index=True)
 
 
 class AgentModel(Base):
@@ -54,6 +61,7 @@ class AgentModel(Base):
     idea          = Column(Text)
     full_response = Column(Text)              # JSON
     chat_history  = Column(Text, default="[]")  # JSON array
+    chat_summary  = Column(Text, nullable=True)  # JSON: конспект ранней переписки (см. chat_context.py)
     created_at    = Column(DateTime, default=datetime.utcnow)
 
 
@@ -63,10 +71,105 @@ class UsageEventModel(Base):
 
     id         = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     username   = Column(String, nullable=False, index=True)
-    event_type = Column(String, default="generation")  # generation | chat
+    event_type = Column(String, default="generation")  # generation | generation_cached | generation_cancelled | generation_partial | chat
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class UsageCounterModel(Base):
+    """Счётчики для проверки лимитов за O(1): генерации за месяц month и сохранённые агенты.
+    Обновляются в одной транзакции с usage_events / agents"""
+    __tablename__ = "usage_counters"
+
+    username    = Column(String, primary_key=True)
+    month       = Column(String, nullable=False)           # "2026-10" — месяц, к которому относится generations
+    generations = Column(Integer, default=0, nullable=False)
+    agents      = Column(Integer, default=0, nullable=False)
+
+
+class DailyStatModel(Base):
+    """Дневные агрегаты для админки: обновляются в одной транзакции с событиями.
+    Метрики-события (generations, chats, signups, ...) — число за день; plan:<тариф> — приращение
+    числа пользователей на тарифе (сумма за всё время = текущее количество)"""
+    __tablename__ = "daily_stats"
+
+    day    = Column(Date, primary_key=True)
+    metric = Column(String, primary_key=True)
+    value  = Column(Integer, default=0, nullable=False)
+
+
+class DataMigrationModel(Base):
+    """Выполненные одноразовые заполнения данных — маркеры отдельно от метрик daily_stats"""
+    __tablename__ = "data_migrations"
+
+    name       = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GenerationJobModel(Base):
+    """Задача генерации — переживает рестарт воркеров, выполняется с арендой (lease)"""
+    __tablename__ = "generation_jobs"
+
+    id               = Column(String, primary_key=True)          # = session_id
+    username         = Column(String, nullable=False, index=True)
+    priority         = Column(Integer, default=2)                 # 0 — pro/admin, 1 — starter, 2 — free
+    mode             = Column(String, default="full")             # full | fast
+    state            = Column(String, default="queued", index=True)  # queued | running | complete | failed | cancelled
+    idea_text        = Column(Text)
+    full_context     = Column(Text)
+    fingerprint      = Column(String, nullable=True)              # ключ кэша генераций
+    stages           = Column(Text, default="{}")   # JSON: этап → done | fallback (завершённые)
+    stage_results    = Column(Text, default="{}")   # JSON: ответы LLM по этапам — для продолжения после сбоя
+    partials         = Column(Text, default="{}")   # JSON: готовые разделы AgentResponse
+    result           = Column(Text, nullable=True)  # JSON: итоговый AgentResponse
+    error            = Column(Text, nullable=True)
+    attempts         = Column(Integer, default=0)
+    cancel_requested     = Column(Boolean, default=False)   # отмена выполняющейся задачи — исполнитель остановит её
+    cancel_on_disconnect = Column(Boolean, default=False)   # отменить, если SSE-подписчиков нет дольше grace-периода
+    subscriber_seen_at   = Column(DateTime, nullable=True)  # последний признак подключённого SSE-клиента
+    speculative_until    = Column(DateTime, nullable=True)  # спекулятивный запуск из /api/clarify: отмена, если не забрали до срока
+    lease_owner      = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at       = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at       = Column(DateTime, nullable=True)
+    finished_at      = Column(DateTime, nullable=True)
+
+
+class ProgressSpillModel(Base):
+    """Итоговый снимок прогресса, вытесненный из памяти (PROGRESS_STORE=memory) — для опоздавших SSE"""
+    __tablename__ = "progress_spill"
+
+    session_id = Column(String, primary_key=True)
+    version    = Column(Integer, nullable=False)
+    data       = Column(Text, nullable=False)   # JSON: снимок прогресса с result
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+def _job_to_dict(job: GenerationJobModel) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "username": job.username,
+        "priority": job.priority,
+        "mode": job.mode,
+        "state": job.state,
+        "idea_text": job.idea_text,
+        "full_context": job.full_context,
+        "fingerprint": job.fingerprint,
+        "stages": json.loads(job.stages or "{}"),
+        "stage_results": json.loads(job.stage_results or "{}"),
+        "partials": json.loads(job.partials or "{}"),
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "attempts": job.attempts or 0,
+        "cancel_requested": bool(job.cancel_requested),
+        "cancel_on_disconnect": bool(job.cancel_on_disconnect),
+        "speculative_until": job.speculative_until.isoformat() if job.speculative_until else None,
+        "lease_owner": job.lease_owner,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
 # ── Лимиты по тарифам ──────────────────────────────────────────────────────────
 PLAN_LIMITS = {
     "free":    {"generations_per_month": 3,  "max_agents": 5},
@@ -83,6 +186,41 @@ PLAN_NAMES = {
 }
 
 
+def _current_month(now: Optional[datetime] = None) -> str:
+    return (now or datetime.utcnow()).strftime("%Y-%m")
+
+
+# Метрики дневных агрегатов, доступные в /api/admin/stats/series
+DAILY_METRICS = (
+    "generations", "generations_cancelled", "generations_partial", "generations_cached", "chats",
+    "signups", "agents_saved", "agents_deleted", "plan_changes",
+)
+_BACKFILL_MIGRATION = "daily_stats_backfill"
+_UNDATED_DAY = date(1970, 1, 1)   # день для записей без created_at: попадают в итоги, но не в ряды
+# Типы событий генерации; в лимит месяца идёт только generation — отменённые и частичные прогоны
+# (generation_partial — отмена после первого готового этапа) в нём не учитываются
+GENERATION_EVENT_TYPES = ("generation", "generation_cancelled", "generation_partial", "generation_cached")
+
+
+def _bump_daily(db, metric: str, delta: int = 1, day: Optional[date] = None) -> None:
+    """Атомарное приращение дневной метрики (upsert); коммитит вызывающий"""
+    values = {"day": day or datetime.utcnow().date(), "metric": metric, "value": delta}
+    if DATABASE_URL.startswith("mysql"):
+        stmt = mysql_insert(DailyStatModel).values(**values)
+        stmt = stmt.on_duplicate_key_update(value=DailyStatModel.value + stmt.inserted.value)
+    else:
+        stmt = sqlite_insert(DailyStatModel).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "metric"], set_={"value": DailyStatModel.value + stmt.excluded.value},
+        )
+    db.execute(stmt)
+
+
+def _as_date(value) -> date:
+    """func.date(): строка в SQLite, date в MySQL"""
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
 def _migrate_existing_db():
     """Добавляет новые колонки в существующие таблицы (безопасно)"""
     with engine.connect() as conn:
@@ -90,6 +228,12 @@ def _migrate_existing_db():
             "ALTER TABLE users ADD COLUMN email TEXT",
             "ALTER TABLE users ADD COLUMN plan TEXT DEFAULT 'free'",
             "ALTER TABLE users ADD COLUMN plan_expires_at DATETIME",
+            "ALTER TABLE agents ADD COLUMN chat_summary TEXT",
+            "ALTER TABLE generation_jobs ADD COLUMN cancel_requested BOOLEAN DEFAULT 0",
+            "ALTER TABLE generation_jobs ADD COLUMN cancel_on_disconnect BOOLEAN DEFAULT 0",
+            "ALTER TABLE generation_jobs ADD COLUMN subscriber_seen_at DATETIME",
+            "ALTER TABLE generation_jobs ADD COLUMN speculative_until DATETIME",
+            "CREATE INDEX ix_users_created_at ON users (created_at)",
         ]:
             try:
                 conn.execute(text(ddl))
@@ -98,8 +242,92 @@ def _migrate_existing_db():
                 pass  # Колонка уже существует
 
 
+def _backfill_usage_counters():
+    """Строки usage_counters для пользователей, у которых их ещё нет, — одним запросом
+    по сгруппированным usage_events и agents (список пользователей в админке — простой JOIN)"""
+    missing = ~exists().where(UsageCounterModel.username == UserModel.username)
+    with engine.connect() as conn:
+        if conn.execute(select(UserModel.username).where(missing).limit(1)).first() is None:
+            return
+        month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        gens = (
+            select(UsageEventModel.username, func.count().label("n"))
+            .where(UsageEventModel.event_type == "generation", UsageEventModel.created_at >= month_start)
+            .group_by(UsageEventModel.username)
+            .subquery()
+        )
+        agents = (
+            select(AgentModel.user_username.label("username"), func.count().label("n"))
+            .group_by(AgentModel.user_username)
+            .subquery()
+        )
+        rows = (
+            select(
+                UserModel.username,
+                literal(_current_month()),
+                func.coalesce(gens.c.n, 0),
+                func.coalesce(agents.c.n, 0),
+            )
+            .outerjoin(gens, gens.c.username == UserModel.username)
+            .outerjoin(agents, agents.c.username == UserModel.username)
+            .where(missing)
+        )
+        try:
+            conn.execute(insert(UsageCounterModel).from_select(
+                ["username", "month", "generations", "agents"], rows,
+            ))
+            conn.commit()
+        except IntegrityError:
+            conn.rollback()   # параллельно стартующий воркер успел первым
+
+
 Base.metadata.create_all(bind=engine)
 _migrate_existing_db()
+_backfill_usage_counters()
+
+
+def _backfill_daily_stats():
+    """Один раз заполняет daily_stats по существующим users / usage_events / agents.
+    Маркер в data_migrations — в той же транзакции: параллельный воркер получит конфликт ключа
+    и пропустит заполнение"""
+    db = SessionLocal()
+    try:
+        if db.query(DataMigrationModel.name).filter(DataMigrationModel.name == _BACKFILL_MIGRATION).first():
+            return
+        db.add(DataMigrationModel(name=_BACKFILL_MIGRATION))
+        db.flush()
+        # Прежние версии хранили маркер строкой daily_stats — переносим его, заполнение уже сделано
+        if db.query(DailyStatModel).filter(
+            DailyStatModel.day == _UNDATED_DAY, DailyStatModel.metric == "_backfilled",
+        ).delete(synchronize_session=False):
+            db.commit()
+            return
+
+        def day_of(value) -> date:
+            return _as_date(value) if value else _UNDATED_DAY
+
+        user_day = func.date(UserModel.created_at)
+        for day, plan, count in db.query(user_day, UserModel.plan, func.count()).group_by(user_day, UserModel.plan):
+            _bump_daily(db, "signups", count, day_of(day))
+            _bump_daily(db, f"plan:{plan or 'free'}", count, day_of(day))
+        event_day = func.date(UsageEventModel.created_at)
+        for day, event_type, count in (
+            db.query(event_day, UsageEventModel.event_type, func.count())
+            .filter(UsageEventModel.event_type.in_(GENERATION_EVENT_TYPES))
+            .group_by(event_day, UsageEventModel.event_type)
+        ):
+            _bump_daily(db, event_type.replace("generation", "generations", 1), count, day_of(day))
+        agent_day = func.date(AgentModel.created_at)
+        for day, count in db.query(agent_day, func.count()).group_by(agent_day):
+            _bump_daily(db, "agents_saved", count, day_of(day))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+    finally:
+        db.close()
+
+
+_backfill_daily_stats()
 
 
 class Database:
@@ -113,8 +341,12 @@ class Database:
                     hashed_password=get_password_hash("admin123"),
                     plan="admin",
                 ))
+                _bump_daily(db, "signups")
+                _bump_daily(db, "plan:admin")
                 db.commit()
             elif existing.plan != "admin":
+                _bump_daily(db, f"plan:{existing.plan or 'free'}", -1)
+                _bump_daily(db, "plan:admin")
                 existing.plan = "admin"
                 db.commit()
         finally:
@@ -122,17 +354,21 @@ class Database:
 
     # ── Users ──────────────────────────────────────────────────────────────────
 
-    def create_user(self, username: str, password: str, email: Optional[str] = None) -> Dict[str, Any]:
+    def create_user(self, username: str, hashed_password: str, email: Optional[str] = None) -> Dict[str, Any]:
+        """hashed_password считает вызывающий (app.auth.password_hasher — вне event loop)"""
         db = SessionLocal()
         try:
             if db.query(UserModel).filter(UserModel.username == username).first():
                 raise ValueError(f"Пользователь '{username}' уже существует")
             db.add(UserModel(
                 username=username,
-                hashed_password=get_password_hash(password),
+                hashed_password=hashed_password,
                 email=email,
                 plan="free",
             ))
+            db.add(UsageCounterModel(username=username, month=_current_month(), generations=0, agents=0))
+            _bump_daily(db, "signups")
+            _bump_daily(db, "plan:free")
             db.commit()
             return {"username": username, "plan": "free", "disabled": False}
         finally:
@@ -156,22 +392,30 @@ class Database:
         finally:
             db.close()
 
-    def authenticate(self, username: str, password: str):
-        user = self.get_user(username)
-        if not user:
-            return None
-        if not verify_password(password, user["hashed_password"]):
-            return None
-        return user
+    def set_password_hash(self, username: str, hashed_password: str):
+        """Пересчитанный хеш (новая стоимость bcrypt) при входе"""
+        db = SessionLocal()
+        try:
+            user = db.query(UserModel).filter(UserModel.username == username).first()
+            if user:
+                user.hashed_password = hashed_password
+                db.commit()
+        finally:
+            db.close()
 
     def upgrade_plan(self, username: str, plan: str, expires_at=None):
         db = SessionLocal()
         try:
             user = db.query(UserModel).filter(UserModel.username == username).first()
             if user:
+                if (user.plan or "free") != plan:
+                    _bump_daily(db, "plan_changes")
+                    _bump_daily(db, f"plan:{user.plan or 'free'}", -1)
+                    _bump_daily(db, f"plan:{plan}")
                 user.plan = plan
                 user.plan_expires_at = expires_at
                 db.commit()
+                auth_cache.invalidate(username)
         finally:
             db.close()
 
@@ -182,23 +426,125 @@ class Database:
             if user:
                 user.disabled = disabled
                 db.commit()
+                auth_cache.invalidate(username)
         finally:
             db.close()
 
     # ── Usage / Limits ─────────────────────────────────────────────────────────
 
-    def record_generation(self, username: str):
+    def _ensure_counters(self, db, username: str) -> None:
+        """Строка счётчиков пользователя; при первом обращении заполняется по usage_events и agents"""
+        if db.query(UsageCounterModel.username).filter(UsageCounterModel.username == username).first():
+            return
+        db.add(UsageCounterModel(
+            username=username,
+            month=_current_month(),
+            generations=self.get_monthly_generations(username),
+            agents=self.get_user_agent_count(username),
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()   # строку уже создал параллельный запрос
+
+    def reserve_generation(self, username: str, limit: int, event_id: Optional[str] = None) -> bool:
+        """Списывает генерацию, если лимит тарифа (-1 — безлимит) ещё не исчерпан: условный инкремент
+        счётчика и событие usage_events в одной транзакции. Два параллельных запроса не пройдут оба"""
         db = SessionLocal()
         try:
+            self._ensure_counters(db, username)
+            month = _current_month()
+            # Новый месяц — счётчик генераций с нуля
+            db.query(UsageCounterModel).filter(
+                UsageCounterModel.username == username, UsageCounterModel.month != month,
+            ).update({UsageCounterModel.month: month, UsageCounterModel.generations: 0}, synchronize_session=False)
+            query = db.query(UsageCounterModel).filter(UsageCounterModel.username == username)
+            if limit != -1:
+                query = query.filter(UsageCounterModel.generations < limit)
+            if not query.update(
+                {UsageCounterModel.generations: UsageCounterModel.generations + 1}, synchronize_session=False,
+            ):
+                db.rollback()
+                return False
             db.add(UsageEventModel(
-                id=str(uuid.uuid4()),
+                id=event_id or str(uuid.uuid4()),
                 username=username,
                 event_type="generation",
             ))
+            _bump_daily(db, "generations")
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def record_generation(self, username: str, event_type: str = "generation", event_id: Optional[str] = None):
+        """event_id — session_id генерации: по нему отменённая генерация перестаёт считаться в лимите"""
+        if event_type == "generation":
+            self.reserve_generation(username, -1, event_id)
+            return
+        db = SessionLocal()
+        try:
+            db.add(UsageEventModel(
+                id=event_id or str(uuid.uuid4()),
+                username=username,
+                event_type=event_type,
+            ))
+            if event_type == "generation_cached":
+                _bump_daily(db, "generations_cached")
             db.commit()
         finally:
             db.close()
 
+    def record_chat(self):
+        """Сообщение в чате (ассистент или агент) — только в дневные агрегаты, без usage_events"""
+        db = SessionLocal()
+        try:
+            _bump_daily(db, "chats")
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _uncount_generation(db, event_id: str, event_type: Optional[str]) -> bool:
+        """Снимает списанную генерацию: событие меняет тип (или удаляется при event_type=None),
+        счётчик месяца уменьшается. Вызывающий коммитит"""
+        event = (
+            db.query(UsageEventModel.username, UsageEventModel.created_at)
+            .filter(UsageEventModel.id == event_id, UsageEventModel.event_type == "generation")
+            .first()
+        )
+        if event is None:
+            return False
+        query = db.query(UsageEventModel).filter(
+            UsageEventModel.id == event_id, UsageEventModel.event_type == "generation",
+        )
+        if event_type is None:
+            changed = query.delete(synchronize_session=False)
+        else:
+            changed = query.update({UsageEventModel.event_type: event_type}, synchronize_session=False)
+        if changed:
+            _bump_daily(db, "generations", -1, event.created_at.date())
+            if event_type is not None:
+                _bump_daily(db, event_type.replace("generation", "generations", 1), 1, event.created_at.date())
+            db.query(UsageCounterModel).filter(
+                UsageCounterModel.username == event.username,
+                UsageCounterModel.month == _current_month(event.created_at),
+                UsageCounterModel.generations > 0,
+            ).update(
+                {UsageCounterModel.generations: UsageCounterModel.generations - 1}, synchronize_session=False,
+            )
+        return changed == 1
+
+    def refund_generation(self, event_id: str) -> bool:
+        """Возврат списания, если генерация так и не началась (например, спекулятивную не удалось забрать)"""
+        db = SessionLocal()
+        try:
+            refunded = self._uncount_generation(db, event_id, None)
+            db.commit()
+            return refunded
+        finally:
+            db.close()
+
     def get_monthly_generations(self, username: str) -> int:
         db = SessionLocal()
         try:
@@ -224,13 +570,20 @@ class Database:
         finally:
             db.close()
 
-    def get_usage_info(self, username: str) -> dict:
-        user = self.get_user(username)
-        plan = user.get("plan", "free") if user else "free"
+    def get_usage_info(self, username: str, plan: Optional[str] = None) -> dict:
+        """Лимиты и использование по счётчикам usage_counters; plan — если он уже известен вызывающему"""
+        db = SessionLocal()
+        try:
+            if plan is None:
+                user_plan = db.query(UserModel.plan).filter(UserModel.username == username).scalar()
+                plan = user_plan or "free"
+            self._ensure_counters(db, username)
+            counters = db.query(UsageCounterModel).filter(UsageCounterModel.username == username).first()
+            gens_used = counters.generations if counters.month == _current_month() else 0
+            agents_count = counters.agents
+        finally:
+            db.close()
         limits = PLAN_LIMITS.get(plan, PLAN_LIMITS["free"])
-
-        gens_used = self.get_monthly_generations(username)
-        agents_count = self.get_user_agent_count(username)
         gen_limit = limits["generations_per_month"]
         agent_limit = limits["max_agents"]
 
@@ -250,10 +603,18 @@ class Database:
 
     def save_agent(
         self, agent_id: str, username: str, name: str, role: str,
-        avatar: str, idea: str, full_response: dict,
-    ) -> dict:
+        avatar: str, idea: str, full_response: dict, max_agents: int = -1,
+    ) -> Optional[dict]:
+        """None — лимит агентов тарифа (max_agents, -1 — безлимит) исчерпан"""
         db = SessionLocal()
         try:
+            self._ensure_counters(db, username)
+            query = db.query(UsageCounterModel).filter(UsageCounterModel.username == username)
+            if max_agents != -1:
+                query = query.filter(UsageCounterModel.agents < max_agents)
+            if not query.update({UsageCounterModel.agents: UsageCounterModel.agents + 1}, synchronize_session=False):
+                db.rollback()
+                return None
             db.add(AgentModel(
                 id=agent_id,
                 user_username=username,
@@ -264,6 +625,7 @@ class Database:
                 full_response=json.dumps(full_response, ensure_ascii=False),
                 chat_history="[]",
             ))
+            _bump_daily(db, "agents_saved")
             db.commit()
             return {"id": agent_id, "name": name}
         finally:
@@ -310,6 +672,7 @@ class Database:
                 "idea": agent.idea,
                 "full_response": json.loads(agent.full_response),
                 "chat_history": json.loads(agent.chat_history or "[]"),
+                "chat_summary": json.loads(agent.chat_summary) if agent.chat_summary else None,
                 "created_at": agent.created_at.isoformat(),
             }
         finally:
@@ -326,6 +689,10 @@ class Database:
             if not agent:
                 return False
             db.delete(agent)
+            db.query(UsageCounterModel).filter(
+                UsageCounterModel.username == username, UsageCounterModel.agents > 0,
+            ).update({UsageCounterModel.agents: UsageCounterModel.agents - 1}, synchronize_session=False)
+            _bump_daily(db, "agents_deleted")
             db.commit()
             return True
         finally:
@@ -345,75 +712,567 @@ class Database:
         finally:
             db.close()
 
-    # ── Admin ──────────────────────────────────────────────────────────────────
+    def update_chat_summary(self, agent_id: str, username: str, chat_summary: dict):
+        db = SessionLocal()
+        try:
+            agent = (
+                db.query(AgentModel)
+                .filter(AgentModel.id == agent_id, AgentModel.user_username == username)
+                .first()
+            )
+            if agent:
+                agent.chat_summary = json.dumps(chat_summary, ensure_ascii=False)
+                db.commit()
+        finally:
+            db.close()
 
-    def get_all_users(self) -> list:
-        db = SessionLocal()
-        try:
-            users = db.query(UserModel).order_by(UserModel.created_at.desc()).all()
-            result = []
-            for u in users:
-                now = datetime.utcnow()
-                month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                gens = (
-                    db.query(func.count(UsageEventModel.id))
-                    .filter(
-                        UsageEventModel.username == u.username,
-                        UsageEventModel.event_type == "generation",
-                        UsageEventModel.created_at >= month_start,
-                    )
-                    .scalar()
-                ) or 0
-                agents_cnt = (
-                    db.query(func.count(AgentModel.id))
-                    .filter(AgentModel.user_username == u.username)
-                    .scalar()
-                ) or 0
-                result.append({
-                    "username": u.username,
-                    "email": u.email,
-                    "plan": u.plan or "free",
-                    "disabled": u.disabled,
-                    "created_at": u.created_at.isoformat() if u.created_at else None,
-                    "generations_this_month": gens,
-                    "agents_count": agents_cnt,
-                })
-            return result
+    # ── Generation jobs ────────────────────────────────────────────────────────
+
+    def create_job(
+        self, job_id: str, username: str, priority: int, mode: str,
+        idea_text: str, full_context: str, fingerprint: Optional[str] = None,
+        cancel_on_disconnect: bool = False, speculative_until: Optional[datetime] = None,
+    ) -> None:
+        db = SessionLocal()
+        try:
+            db.add(GenerationJobModel(
+                id=job_id,
+                username=username,
+                priority=priority,
+                mode=mode,
+                state="queued",
+                idea_text=idea_text,
+                full_context=full_context,
+                fingerprint=fingerprint,
+                cancel_on_disconnect=cancel_on_disconnect,
+                speculative_until=speculative_until,
+            ))
+            db.commit()
         finally:
             db.close()
 
-    def get_admin_stats(self) -> dict:
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            job = db.query(GenerationJobModel).filter(GenerationJobModel.id == job_id).first()
+            return _job_to_dict(job) if job else None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _claimable(now: datetime):
+        """Задача в очереди или выполняется, но аренда истекла (воркер упал)"""
+        return or_(
+            GenerationJobModel.state == "queued",
+            and_(GenerationJobModel.state == "running", GenerationJobModel.lease_expires_at < now),
+        )
+
+    def claim_job(self, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Забирает следующую задачу по приоритету; условный UPDATE — задачу получит только один воркер"""
         db = SessionLocal()
         try:
             now = datetime.utcnow()
-            month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            candidates = (
+                db.query(GenerationJobModel.id)
+                .filter(self._claimable(now))
+                .order_by(GenerationJobModel.priority, GenerationJobModel.created_at)
+                .limit(5)
+                .all()
+            )
+            for (job_id,) in candidates:
+                claimed = (
+                    db.query(GenerationJobModel)
+                    .filter(GenerationJobModel.id == job_id, self._claimable(now))
+                    .update({
+                        GenerationJobModel.state: "running",
+                        GenerationJobModel.lease_owner: owner,
+                        GenerationJobModel.lease_expires_at: now + timedelta(seconds=lease_seconds),
+                        GenerationJobModel.attempts: GenerationJobModel.attempts + 1,
+                        GenerationJobModel.started_at: now,
+                    }, synchronize_session=False)
+                )
+                db.commit()
+                if claimed == 1:
+                    job = db.query(GenerationJobModel).filter(GenerationJobModel.id == job_id).first()
+                    return _job_to_dict(job)
+            return None
+        finally:
+            db.close()
+
+    def _update_owned_job(self, job_id: str, owner: str, values: dict) -> bool:
+        """Изменение задачи только её текущим владельцем — False, если аренду перехватили"""
+        db = SessionLocal()
+        try:
+            updated = (
+                db.query(GenerationJobModel)
+                .filter(
+                    GenerationJobModel.id == job_id,
+                    GenerationJobModel.lease_owner == owner,
+                    GenerationJobModel.state == "running",
+                )
+                .update(values, synchronize_session=False)
+            )
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def renew_job_lease(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        return self._update_owned_job(job_id, owner, {
+            GenerationJobModel.lease_expires_at: datetime.utcnow() + timedelta(seconds=lease_seconds),
+        })
 
-            total_users  = db.query(func.count(UserModel.username)).scalar() or 0
-            paid_users   = (
-                db.query(func.count(UserModel.username))
-                .filter(UserModel.plan.in_(["starter", "pro"]))
+    def save_job_stage(self, job_id: str, owner: str, stages: dict, stage_results: dict, partials: dict) -> bool:
+        return self._update_owned_job(job_id, owner, {
+            GenerationJobModel.stages: json.dumps(stages, ensure_ascii=False),
+            GenerationJobModel.stage_results: json.dumps(stage_results, ensure_ascii=False),
+            GenerationJobModel.partials: json.dumps(partials, ensure_ascii=False),
+        })
+
+    def finish_job(self, job_id: str, owner: str, result: dict) -> bool:
+        return self._update_owned_job(job_id, owner, {
+            GenerationJobModel.state: "complete",
+            GenerationJobModel.result: json.dumps(result, ensure_ascii=False),
+            GenerationJobModel.lease_owner: None,
+            GenerationJobModel.lease_expires_at: None,
+            GenerationJobModel.finished_at: datetime.utcnow(),
+        })
+
+    def fail_job(self, job_id: str, owner: str, error: str) -> bool:
+        return self._update_owned_job(job_id, owner, {
+            GenerationJobModel.state: "failed",
+            GenerationJobModel.error: error[:2000],
+            GenerationJobModel.lease_owner: None,
+            GenerationJobModel.lease_expires_at: None,
+            GenerationJobModel.finished_at: datetime.utcnow(),
+        })
+
+    def _mark_generation_cancelled(self, db, job_id: str) -> None:
+        """Правило учёта отмены: полная генерация не списывается. Если ни один этап не успел
+        завершиться ответом LLM — событие становится generation_cancelled, если хотя бы один раздел
+        уже ушёл пользователю (stage_result) — generation_partial. Оба типа возвращаются в лимит
+        месяца и считаются отдельно в daily_stats"""
+        stages = db.query(GenerationJobModel.stages).filter(GenerationJobModel.id == job_id).scalar()
+        partial = any(st == "done" for st in json.loads(stages or "{}").values())
+        self._uncount_generation(db, job_id, "generation_partial" if partial else "generation_cancelled")
+
+    def request_job_cancel(self, job_id: str) -> Optional[str]:
+        """Отмена задачи: из очереди — сразу (cancelled), выполняющейся — флагом для исполнителя
+        (cancelling). Возвращает новое состояние или текущее, если задача уже завершена"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            dequeued = (
+                db.query(GenerationJobModel)
+                .filter(GenerationJobModel.id == job_id, GenerationJobModel.state == "queued")
+                .update({
+                    GenerationJobModel.state: "cancelled",
+                    GenerationJobModel.finished_at: now,
+                }, synchronize_session=False)
+            )
+            if dequeued:
+                self._mark_generation_cancelled(db, job_id)
+                db.commit()
+                return "cancelled"
+            flagged = (
+                db.query(GenerationJobModel)
+                .filter(GenerationJobModel.id == job_id, GenerationJobModel.state == "running")
+                .update({GenerationJobModel.cancel_requested: True}, synchronize_session=False)
+            )
+            db.commit()
+            if flagged:
+                return "cancelling"
+            job = db.query(GenerationJobModel).filter(GenerationJobModel.id == job_id).first()
+            return job.state if job else None
+        finally:
+            db.close()
+
+    def cancel_job(self, job_id: str, owner: str) -> bool:
+        """Исполнитель остановил задачу: готовые этапы остаются в задаче; False — задача уже
+        не выполняется этим исполнителем (например, успела завершиться)"""
+        db = SessionLocal()
+        try:
+            updated = (
+                db.query(GenerationJobModel)
+                .filter(
+                    GenerationJobModel.id == job_id,
+                    GenerationJobModel.lease_owner == owner,
+                    GenerationJobModel.state == "running",
+                )
+                .update({
+                    GenerationJobModel.state: "cancelled",
+                    GenerationJobModel.lease_owner: None,
+                    GenerationJobModel.lease_expires_at: None,
+                    GenerationJobModel.finished_at: datetime.utcnow(),
+                }, synchronize_session=False)
+            )
+            if updated:
+                self._mark_generation_cancelled(db, job_id)
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def claim_speculative_job(
+        self, job_id: str, priority: int, fingerprint: Optional[str], cancel_on_disconnect: bool,
+    ) -> bool:
+        """Пользователь подтвердил генерацию: спекулятивная задача становится обычной (приоритет тарифа).
+        False — задачи нет, она уже забрана, отменена или её срок истёк"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            claimed = (
+                db.query(GenerationJobModel)
+                .filter(
+                    GenerationJobModel.id == job_id,
+                    GenerationJobModel.speculative_until >= now,
+                    GenerationJobModel.state.in_(["queued", "running", "complete"]),
+                    GenerationJobModel.cancel_requested == False,  # noqa: E712
+                )
+                .update({
+                    GenerationJobModel.speculative_until: None,
+                    GenerationJobModel.priority: priority,
+                    GenerationJobModel.fingerprint: fingerprint,
+                    GenerationJobModel.cancel_on_disconnect: cancel_on_disconnect,
+                    GenerationJobModel.subscriber_seen_at: now,
+                }, synchronize_session=False)
+            )
+            db.commit()
+            return claimed == 1
+        finally:
+            db.close()
+
+    def touch_job_subscriber(self, job_id: str) -> None:
+        db = SessionLocal()
+        try:
+            db.query(GenerationJobModel).filter(
+                GenerationJobModel.id == job_id,
+                GenerationJobModel.state.in_(["queued", "running"]),
+            ).update({GenerationJobModel.subscriber_seen_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def get_jobs_to_cancel(self, owner: str, disconnect_grace: float) -> List[str]:
+        """Задачи исполнителя с запрошенной отменой, без SSE-подписчиков дольше disconnect_grace
+        или незабранные спекулятивные с истёкшим сроком"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            abandoned_before = now - timedelta(seconds=disconnect_grace)
+            rows = (
+                db.query(GenerationJobModel.id)
+                .filter(
+                    GenerationJobModel.lease_owner == owner,
+                    GenerationJobModel.state == "running",
+                    or_(
+                        GenerationJobModel.cancel_requested == True,  # noqa: E712
+                        and_(
+                            GenerationJobModel.cancel_on_disconnect == True,  # noqa: E712
+                            func.coalesce(GenerationJobModel.subscriber_seen_at, GenerationJobModel.created_at)
+                            < abandoned_before,
+                        ),
+                        GenerationJobModel.speculative_until < now,
+                    ),
+                )
+                .all()
+            )
+            return [job_id for (job_id,) in rows]
+        finally:
+            db.close()
+
+    def release_jobs(self, owner: str) -> int:
+        """Остановка воркера: его задачи сразу возвращаются в очередь, не дожидаясь истечения аренды"""
+        db = SessionLocal()
+        try:
+            released = (
+                db.query(GenerationJobModel)
+                .filter(GenerationJobModel.lease_owner == owner, GenerationJobModel.state == "running")
+                .update({
+                    GenerationJobModel.state: "queued",
+                    GenerationJobModel.lease_owner: None,
+                    GenerationJobModel.lease_expires_at: None,
+                    # Штатная остановка — не сбой, попытку не засчитываем
+                    GenerationJobModel.attempts: GenerationJobModel.attempts - 1,
+                }, synchronize_session=False)
+            )
+            db.commit()
+            return released
+        finally:
+            db.close()
+
+    def count_queued_jobs(self, max_priority: int) -> int:
+        """Сколько задач в очереди будут выполнены раньше задачи с таким приоритетом"""
+        db = SessionLocal()
+        try:
+            return (
+                db.query(func.count(GenerationJobModel.id))
+                .filter(GenerationJobModel.state == "queued", GenerationJobModel.priority <= max_priority)
                 .scalar()
             ) or 0
-            total_agents = db.query(func.count(AgentModel.id)).scalar() or 0
-            gens_month   = (
-                db.query(func.count(UsageEventModel.id))
+        finally:
+            db.close()
+
+    def get_job_queue_position(self, job_id: str) -> Optional[int]:
+        db = SessionLocal()
+        try:
+            job = db.query(GenerationJobModel).filter(GenerationJobModel.id == job_id).first()
+            if not job or job.state != "queued":
+                return None
+            ahead = (
+                db.query(func.count(GenerationJobModel.id))
                 .filter(
-                    UsageEventModel.event_type == "generation",
-                    UsageEventModel.created_at >= month_start,
+                    GenerationJobModel.state == "queued",
+                    or_(
+                        GenerationJobModel.priority < job.priority,
+                        and_(
+                            GenerationJobModel.priority == job.priority,
+                            GenerationJobModel.created_at < job.created_at,
+                        ),
+                    ),
                 )
                 .scalar()
             ) or 0
+            return ahead + 1
+        finally:
+            db.close()
 
+    def get_job_stats(self) -> dict:
+        db = SessionLocal()
+        try:
+            counts = dict(
+                db.query(GenerationJobModel.state, func.count(GenerationJobModel.id))
+                .group_by(GenerationJobModel.state)
+                .all()
+            )
+            recent = (
+                db.query(GenerationJobModel.started_at, GenerationJobModel.finished_at)
+                .filter(GenerationJobModel.state == "complete", GenerationJobModel.started_at.isnot(None))
+                .order_by(GenerationJobModel.finished_at.desc())
+                .limit(50)
+                .all()
+            )
+            durations = [(f - s).total_seconds() for s, f in recent if s and f]
             return {
-                "total_users": total_users,
-                "paid_users": paid_users,
-                "free_users": total_users - paid_users,
-                "total_agents": total_agents,
-                "generations_this_month": gens_month,
+                "queued": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "complete": counts.get("complete", 0),
+                "failed": counts.get("failed", 0),
+                "cancelled": counts.get("cancelled", 0),
+                "avg_duration_seconds": round(sum(durations) / len(durations), 2) if durations else None,
             }
         finally:
             db.close()
 
+    def spill_progress(self, session_id: str, version: int, progress: dict) -> None:
+        db = SessionLocal()
+        try:
+            db.merge(ProgressSpillModel(
+                session_id=session_id,
+                version=version,
+                data=json.dumps(progress, ensure_ascii=False),
+                created_at=datetime.utcnow(),
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def load_spilled_progress(self, session_id: str) -> Optional[tuple]:
+        """(версия, прогресс) или None"""
+        db = SessionLocal()
+        try:
+            row = db.query(ProgressSpillModel).filter(ProgressSpillModel.session_id == session_id).first()
+            return (row.version, json.loads(row.data)) if row else None
+        finally:
+            db.close()
+
+    def purge_finished_jobs(self, older_than_days: int) -> int:
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+            deleted = (
+                db.query(GenerationJobModel)
+                .filter(
+                    GenerationJobModel.state.in_(["complete", "failed", "cancelled"]),
+                    GenerationJobModel.finished_at < cutoff,
+                )
+                .delete(synchronize_session=False)
+            )
+            db.query(ProgressSpillModel).filter(ProgressSpillModel.created_at < cutoff).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    # ── Admin ──────────────────────────────────────────────────────────────────
+
+    def get_users_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[Dict[str, Any]] = None,
+        sort: str = "created_at",
+        descending: bool = True,
+        plan: Optional[str] = None,
+        disabled: Optional[bool] = None,
+        search: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], int]:
+        """Страница пользователей одним запросом (users ⟕ usage_counters) с keyset-пагинацией.
+        cursor — {"value", "username"} последней строки предыдущей страницы.
+        Возвращает (пользователи, курсор следующей страницы или None, всего по фильтру)"""
+        generations = case(
+            (UsageCounterModel.month == _current_month(), UsageCounterModel.generations), else_=0,
+        )
+        agents = func.coalesce(UsageCounterModel.agents, 0)
+        sort_column = {
+            "created_at": UserModel.created_at,
+            "username": UserModel.username,
+            "generations": generations,
+            "agents": agents,
+        }[sort]
+
+        filters = []
+        if plan:
+            filters.append(UserModel.plan == plan)
+        if disabled is not None:
+            filters.append(UserModel.disabled == disabled if disabled else or_(
+                UserModel.disabled == False, UserModel.disabled.is_(None),  # noqa: E712
+            ))
+        if search:
+            # % и _ в строке поиска — обычные символы, а не шаблон LIKE
+            escaped = search.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = f"%{escaped}%"
+            filters.append(or_(
+                func.lower(UserModel.username).like(pattern, escape="\\"),
+                func.lower(UserModel.email).like(pattern, escape="\\"),
+            ))
+
+        db = SessionLocal()
+        try:
+            total = db.query(func.count(UserModel.username)).filter(*filters).scalar() or 0
+
+            query = (
+                db.query(UserModel, generations.label("generations"), agents.label("agents"))
+                .outerjoin(UsageCounterModel, UsageCounterModel.username == UserModel.username)
+                .filter(*filters)
+            )
+            if cursor is not None:
+                # NULL (created_at старых записей) и в SQLite, и в MySQL меньше любого значения:
+                # первые при сортировке по возрастанию, последние — по убыванию
+                value = cursor["value"]
+                if sort == "created_at" and value is not None:
+                    value = datetime.fromisoformat(value)
+                if value is None:
+                    tie = and_(sort_column.is_(None), (
+                        UserModel.username < cursor["username"] if descending
+                        else UserModel.username > cursor["username"]
+                    ))
+                    query = query.filter(tie if descending else or_(tie, sort_column.isnot(None)))
+                elif descending:
+                    query = query.filter(or_(
+                        sort_column < value,
+                        and_(sort_column == value, UserModel.username < cursor["username"]),
+                        sort_column.is_(None),
+                    ))
+                else:
+                    query = query.filter(or_(
+                        sort_column > value,
+                        and_(sort_column == value, UserModel.username > cursor["username"]),
+                    ))
+            if descending:
+                query = query.order_by(sort_column.desc(), UserModel.username.desc())
+            else:
+                query = query.order_by(sort_column.asc(), UserModel.username.asc())
+            rows = query.limit(limit + 1).all()
+
+            users = [
+                {
+                    "username": u.username,
+                    "email": u.email,
+                    "plan": u.plan or "free",
+                    "disabled": u.disabled,
+                    "created_at": u.created_at.isoformat() if u.created_at else None,
+                    "generations_this_month": gens or 0,
+                    "agents_count": agents_cnt or 0,
+                }
+                for u, gens, agents_cnt in rows[:limit]
+            ]
+            next_cursor = None
+            if len(rows) > limit:
+                last = users[-1]
+                value = {
+                    "created_at": last["created_at"],
+                    "username": last["username"],
+                    "generations": last["generations_this_month"],
+                    "agents": last["agents_count"],
+                }[sort]
+                next_cursor = {"value": value, "username": last["username"]}
+            return users, next_cursor, total
+        finally:
+            db.close()
+
+    def get_admin_stats(self) -> dict:
+        """Сводка из daily_stats: суммы по метрикам, без подсчёта строк в больших таблицах"""
+        db = SessionLocal()
+        try:
+            month_start = datetime.utcnow().date().replace(day=1)
+            totals = dict(
+                db.query(DailyStatModel.metric, func.sum(DailyStatModel.value))
+                .group_by(DailyStatModel.metric)
+                .all()
+            )
+            gens_month = (
+                db.query(func.sum(DailyStatModel.value))
+                .filter(DailyStatModel.metric == "generations", DailyStatModel.day >= month_start)
+                .scalar()
+            ) or 0
+        finally:
+            db.close()
+
+        total_users = int(totals.get("signups") or 0)
+        paid_users = int((totals.get("plan:starter") or 0) + (totals.get("plan:pro") or 0))
+        return {
+            "total_users": total_users,
+            "paid_users": paid_users,
+            "free_users": total_users - paid_users,
+            "total_agents": int((totals.get("agents_saved") or 0) - (totals.get("agents_deleted") or 0)),
+            "generations_this_month": int(gens_month),
+        }
+
+    def get_stats_series(
+        self, metrics: List[str], start: date, end: date, bucket: str = "day",
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Ряды метрик за [start, end] по дням или неделям (неделя — с понедельника), пустые периоды = 0"""
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(DailyStatModel.day, DailyStatModel.metric, DailyStatModel.value)
+                .filter(
+                    DailyStatModel.metric.in_(metrics),
+                    DailyStatModel.day >= start,
+                    DailyStatModel.day <= end,
+                )
+                .all()
+            )
+        finally:
+            db.close()
+
+        def bucket_start(day: date) -> date:
+            return day - timedelta(days=day.weekday()) if bucket == "week" else day
+
+        step = timedelta(days=7 if bucket == "week" else 1)
+        periods = []
+        period = bucket_start(start)
+        while period <= end:
+            periods.append(period)
+            period += step
+        values = {metric: dict.fromkeys(periods, 0) for metric in metrics}
+        for day, metric, value in rows:
+            values[metric][bucket_start(_as_date(day))] += value
+        return {
+            metric: [{"date": period.isoformat(), "value": value} for period, value in by_period.items()]
+            for metric, by_period in values.items()
+        }
+
 
 # Глобальный экземпляр БД
 user_db = Database()
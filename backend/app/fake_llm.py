@@ -0,0 +1,444 @@
+"""
+Фейковый OpenAI/Groq-совместимый LLM-сервер для нагрузочных тестов
+Отвечает валидным по схеме JSON на промпты из app/prompts.py, эмулирует задержки,
+ошибки 5xx, 429 с retry-after, лимиты RPM/TPM и битый JSON (--malformed-rate) —
+квота Groq не расходуется.
+
+Запуск:  python -m app.fake_llm --port 8090 --latency lognormal:1.5:0.5 --error-rate 0.02
+Бэкенд:  LLM_PROVIDER=fake LLM_BASE_URL=http://127.0.0.1:8090
+Статистика сервера — GET /stats, сброс — DELETE /stats
+"""
+import os
+import re
+import math
+import time
+import json
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.prompts import (
+    PROMPT_CLARIFIER,
+    PROMPT_ANALYST,
+    PROMPT_ARCHITECT,
+    PROMPT_VISUALIZER,
+    PROMPT_PM,
+    PROMPT_FAST,
+    PROMPT_CHAT_ASSISTANT,
+    PROMPT_CHAT_SUMMARY,
+    PROMPT_JSON_FIX,
+    PROMPT_JSON_CONTINUE,
+)
+
+
+# ── Распределения задержек ────────────────────────────────────────────────────
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Задержка до первого токена, сек: fixed:1.5 | uniform:0.5:3 | normal:1.5:0.4 |
+    lognormal:1.5:0.5 (медиана, sigma) | exp:1.5 (среднее)"""
+    kind, *params = spec.strip().split(":")
+    try:
+        values = [float(p) for p in params]
+        if kind == "fixed":
+            (value,) = values
+            return lambda rnd: value
+        if kind == "uniform":
+            low, high = values
+            return lambda rnd: rnd.uniform(low, high)
+        if kind == "normal":
+            mean, std = values
+            return lambda rnd: max(0.0, rnd.gauss(mean, std))
+        if kind == "lognormal":
+            median, sigma = values
+            return lambda rnd: median * math.exp(rnd.gauss(0.0, sigma))
+        if kind == "exp":
+            (mean,) = values
+            return lambda rnd: rnd.expovariate(1.0 / mean) if mean > 0 else 0.0
+    except ValueError:
+        pass
+    raise ValueError(f"Неверное распределение задержки: {spec}")
+
+
+class FakeLLMConfig:
+    """Настройки эмуляции: переменные окружения FAKE_LLM_*, переопределяются из командной строки"""
+
+    def __init__(self):
+        self.latency = os.getenv("FAKE_LLM_LATENCY", "lognormal:1.5:0.5")
+        self.tokens_per_second = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "250"))   # скорость стрима
+        self.error_rate = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))           # доля ответов 5xx
+        self.rate_limit_rate = float(os.getenv("FAKE_LLM_429_RATE", "0"))        # доля случайных 429
+        self.retry_after = float(os.getenv("FAKE_LLM_RETRY_AFTER", "2"))         # сек, для случайных 429
+        self.malformed_rate = float(os.getenv("FAKE_LLM_MALFORMED_RATE", "0"))   # доля ответов с битым JSON
+        self.rpm = int(os.getenv("FAKE_LLM_RPM", "0"))                           # 0 — без лимита
+        self.tpm = int(os.getenv("FAKE_LLM_TPM", "0"))
+        seed = os.getenv("FAKE_LLM_SEED")
+        self.random = random.Random(int(seed) if seed else None)
+        self.sample_latency = parse_latency(self.latency)
+
+    def set_latency(self, spec: str) -> None:
+        self.sample_latency = parse_latency(spec)
+        self.latency = spec
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "tokens_per_second": self.tokens_per_second,
+            "error_rate": self.error_rate,
+            "rate_limit_rate": self.rate_limit_rate,
+            "retry_after": self.retry_after,
+            "malformed_rate": self.malformed_rate,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+        }
+
+
+config = FakeLLMConfig()
+
+
+# ── Ответы на промпты ─────────────────────────────────────────────────────────
+
+def _prefix(template: str) -> str:
+    """Неизменная часть промпта — до первой подстановки"""
+    return template.split("{", 1)[0]
+
+
+def _line(prompt: str, label: str, default: str = "задача") -> str:
+    match = re.search(r"^%s:\s*(.+)$" % re.escape(label), prompt, re.MULTILINE)
+    value = match.group(1).strip() if match else ""
+    return (value or default)[:160]
+
+
+_INTEGRATIONS = ["Telegram Bot API", "Google Sheets", "amoCRM", "1С", "PostgreSQL", "Email (SMTP)", "Notion", "Slack"]
+_STACK = ["Python", "FastAPI", "LangChain", "PostgreSQL", "Redis", "Docker", "Celery", "React"]
+
+
+def _clarifier(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    if rnd.random() < 0.5:
+        return {"needs_clarification": False, "questions": []}
+    return {
+        "needs_clarification": True,
+        "questions": rnd.sample([
+            "Какие источники данных уже есть?",
+            "Кто будет основным пользователем агента?",
+            "Какой бюджет и срок запуска?",
+            "Нужны ли интеграции с текущими системами?",
+        ], rnd.randint(1, 3)),
+    }
+
+
+def _analyst(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    idea = _line(prompt, "Идея")
+    return {
+        "task": f"Автоматизировать: {idea}",
+        "inputs": ["Запросы пользователей", "Справочные данные компании"],
+        "outputs": ["Готовые ответы и отчёты", "Уведомления ответственным"],
+        "integrations": rnd.sample(_INTEGRATIONS, 3),
+    }
+
+
+def _architect(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    task = _line(prompt, "Задача агента")
+    steps = "\n".join(f"{i}. Шаг обработки запроса номер {i}: проверь данные, уточни детали, сформируй ответ." for i in range(1, 9))
+    return {
+        "name": rnd.choice(["Атлас", "Вектор", "Орбита", "Сигма"]),
+        "role": "Ассистент по автоматизации",
+        "avatar": rnd.choice(["🤖", "🧭", "🛠️", "📊"]),
+        "system_prompt": f"Ты — ИИ-агент. Твоя задача: {task}.\n\nПорядок работы:\n{steps}\n\nОтвечай кратко и по делу.",
+        "tech_stack": rnd.sample(_STACK, 4),
+    }
+
+
+def _visualizer(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    return {
+        "mermaid_code": 'graph LR; A["Запрос"] --> B["Анализ"]; B --> C["Обработка"]; '
+                        'C --> D["Проверка"]; D --> E["Ответ"];'
+    }
+
+
+def _pm(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    days = rnd.randint(3, 7)
+    return {
+        "project_type": rnd.choice(["technical", "business", "research", "other"]),
+        "key_metrics": [
+            {"label": "Ориентировочная стоимость", "value": f"{rnd.randint(20, 90)},000 - {rnd.randint(100, 300)},000", "unit": "₽"},
+            {"label": "Время на реализацию", "value": f"{days}", "unit": "дней"},
+        ],
+        "resources_needed": [
+            {"category": "Инструменты/ПО", "items": rnd.sample(_STACK, 2)},
+            {"category": "Специалисты/Услуги", "items": ["Python-разработчик", "Аналитик"]},
+        ],
+        "implementation_plan": [
+            {"day": day, "task": f"Этап {day}: реализация и проверка", "duration": f"{rnd.randint(2, 8)} часов"}
+            for day in range(1, days + 1)
+        ],
+        "risk_status": rnd.choice(["normal", "normal", "warning", "high"]),
+    }
+
+
+def _fast(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    analyst = _analyst(prompt, rnd)
+    architect = _architect(prompt.replace("Идея:", "Задача агента:"), rnd)
+    return {**analyst, **architect, **_visualizer(prompt, rnd), **_pm(prompt, rnd)}
+
+
+def _chat(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    message = _line(prompt, "Вопрос/сообщение пользователя", "вопрос")
+    body = " ".join(
+        f"Шаг {i}: сделайте конкретное действие и проверьте результат, прежде чем идти дальше."
+        for i in range(1, rnd.randint(4, 8))
+    )
+    return {
+        "response": f"По вопросу «{message}»: {body}",
+        "suggested_actions": ["Проверить исходные данные", "Настроить интеграцию", "Запустить пилот"],
+    }
+
+
+def _chat_summary(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    previous = _line(prompt, "Текущий конспект", "").replace("пока пусто", "")
+    return {"summary": f"{previous} Обсудили шаги внедрения, бюджет и интеграции.".strip()[-600:]}
+
+
+def _followup(prompt: str, rnd: random.Random) -> Dict[str, Any]:
+    """«Исправь»/«продолжи»: ответ на исходное задание из конца промпта (продолжение — целым объектом)"""
+    return respond(prompt.rsplit("Задание:\n", 1)[-1], rnd)[1]
+
+
+RESPONDERS: List[Tuple[str, str, Callable[[str, random.Random], Dict[str, Any]]]] = [
+    ("clarifier", _prefix(PROMPT_CLARIFIER), _clarifier),
+    ("analyst", _prefix(PROMPT_ANALYST), _analyst),
+    ("architect", _prefix(PROMPT_ARCHITECT), _architect),
+    ("visualizer", _prefix(PROMPT_VISUALIZER), _visualizer),
+    ("pm", _prefix(PROMPT_PM), _pm),
+    ("fast", _prefix(PROMPT_FAST), _fast),
+    ("chat", _prefix(PROMPT_CHAT_ASSISTANT), _chat),
+    ("chat_summary", _prefix(PROMPT_CHAT_SUMMARY), _chat_summary),
+    ("json_fix", _prefix(PROMPT_JSON_FIX), _followup),
+    ("json_continue", _prefix(PROMPT_JSON_CONTINUE), _followup),
+]
+
+
+def respond(prompt: str, rnd: random.Random) -> Tuple[str, Dict[str, Any]]:
+    """(тип промпта, ответ) — неизвестный промпт получает ответ в формате чата"""
+    for kind, prefix, responder in RESPONDERS:
+        if prompt.startswith(prefix):
+            return kind, responder(prompt, rnd)
+    return "unknown", _chat(prompt, rnd)
+
+
+def _malform(content: str, rnd: random.Random) -> Tuple[str, str, str]:
+    """(испорченный ответ, finish_reason, вид порчи) — типичные ошибки LLM в JSON"""
+    kind = rnd.choice(["trailing_comma", "unescaped_quotes", "truncated", "wrapped"])
+    if kind == "trailing_comma":
+        return content[:-1] + ",}", "stop", kind
+    if kind == "unescaped_quotes" and '\\"' in content:
+        return content.replace('\\"', '"'), "stop", kind
+    if kind == "wrapped":
+        return f"Вот ответ:\n```json\n{content}\n```", "stop", kind
+    return content[:int(len(content) * rnd.uniform(0.5, 0.9))], "length", "truncated"
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 3 + 1
+
+
+# ── Эмуляция лимитов и статистика ────────────────────────────────────────────
+
+class FakeLimits:
+    """Скользящее окно в минуту — как лимиты аккаунта Groq"""
+
+    def __init__(self):
+        self.requests: deque = deque()   # (timestamp, tokens)
+
+    def _trim(self, now: float) -> None:
+        while self.requests and self.requests[0][0] <= now - 60:
+            self.requests.popleft()
+
+    def check(self, tokens: int) -> Tuple[Optional[float], Dict[str, str]]:
+        """(retry_after или None, заголовки x-ratelimit-*)"""
+        now = time.time()
+        self._trim(now)
+        used_requests = len(self.requests)
+        used_tokens = sum(t for _, t in self.requests)
+        reset = f"{max(0.0, self.requests[0][0] + 60 - now):.2f}s" if self.requests else "0s"
+        retry_after = None
+        if (config.rpm and used_requests >= config.rpm) or (config.tpm and used_tokens + tokens > config.tpm):
+            retry_after = max(0.1, self.requests[0][0] + 60 - now) if self.requests else 1.0
+        else:
+            self.requests.append((now, tokens))
+            used_requests += 1
+            used_tokens += tokens
+        headers = {}
+        if config.rpm:
+            headers.update({
+                "x-ratelimit-limit-requests": str(config.rpm),
+                "x-ratelimit-remaining-requests": str(max(0, config.rpm - used_requests)),
+                "x-ratelimit-reset-requests": reset,
+            })
+        if config.tpm:
+            headers.update({
+                "x-ratelimit-limit-tokens": str(config.tpm),
+                "x-ratelimit-remaining-tokens": str(max(0, config.tpm - used_tokens)),
+                "x-ratelimit-reset-tokens": reset,
+            })
+        return retry_after, headers
+
+
+limits = FakeLimits()
+stats: Counter = Counter()
+inflight = {"now": 0, "max": 0}
+
+
+# ── HTTP API ──────────────────────────────────────────────────────────────────
+
+app = FastAPI(title="Fake LLM (OpenAI/Groq-compatible)")
+
+
+def _error(status_code: int, message: str, kind: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": kind, "code": kind}},
+        headers=headers,
+    )
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+async def _stream(completion_id: str, model: str, content: str, prompt_tokens: int):
+    created = int(time.time())
+    chunk_size = 12   # ~4 токена
+    delay = chunk_size / 3 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+    try:
+        for i in range(0, len(content), chunk_size):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            if delay:
+                await asyncio.sleep(delay)
+        final = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": completion_id, "usage": _usage(prompt_tokens, _tokens(content))},
+        }
+        yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        inflight["now"] -= 1
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or []
+    prompt = messages[-1].get("content", "") if messages else ""
+    model = body.get("model", "fake-model")
+    rnd = config.random
+    kind, payload = respond(prompt, rnd)
+    content = json.dumps(payload, ensure_ascii=False)
+    prompt_tokens = _tokens(prompt)
+    stats["requests"] += 1
+    stats[f"kind_{kind}"] += 1
+
+    retry_after, headers = limits.check(prompt_tokens + int(body.get("max_tokens") or _tokens(content)))
+    if retry_after is None and rnd.random() < config.rate_limit_rate:
+        retry_after = config.retry_after
+    if retry_after is not None:
+        stats["rate_limited"] += 1
+        headers["retry-after"] = f"{retry_after:.2f}"
+        return _error(429, f"Rate limit reached for model `{model}`. Please try again in {retry_after:.2f}s.",
+                      "rate_limit_exceeded", headers)
+
+    inflight["now"] += 1
+    inflight["max"] = max(inflight["max"], inflight["now"])
+    streaming = False
+    try:
+        await asyncio.sleep(config.sample_latency(rnd))
+        if rnd.random() < config.error_rate:
+            stats["errors"] += 1
+            status_code = rnd.choice([500, 502, 503])
+            return _error(status_code, "Fake upstream failure", "internal_server_error", headers)
+
+        stats["completed"] += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        finish_reason = "stop"
+        if not body.get("stream") and rnd.random() < config.malformed_rate:
+            content, finish_reason, damage = _malform(content, rnd)
+            stats[f"malformed_{damage}"] += 1
+        if body.get("stream"):
+            streaming = True   # счётчик in-flight уменьшит сам стрим
+            return StreamingResponse(
+                _stream(completion_id, model, content, prompt_tokens),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+        return JSONResponse(content={
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": _usage(prompt_tokens, _tokens(content)),
+        }, headers=headers)
+    finally:
+        if not streaming:
+            inflight["now"] -= 1
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "config": config.as_dict(),
+        "inflight": inflight["now"],
+        "max_inflight": inflight["max"],
+        **stats,
+    }
+
+
+@app.delete("/stats")
+async def reset_stats():
+    stats.clear()
+    inflight["max"] = inflight["now"]
+    return {"success": True}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковый OpenAI/Groq-совместимый LLM-сервер")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", help="fixed:S | uniform:MIN:MAX | normal:MEAN:STD | lognormal:MEDIAN:SIGMA | exp:MEAN")
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--rate-limit-rate", type=float, help="доля случайных ответов 429")
+    parser.add_argument("--retry-after", type=float)
+    parser.add_argument("--malformed-rate", type=float, help="доля ответов с битым JSON (обрезка, запятые, кавычки)")
+    parser.add_argument("--rpm", type=int)
+    parser.add_argument("--tpm", type=int)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.latency:
+        config.set_latency(args.latency)
+    for name in ("tokens_per_second", "error_rate", "rate_limit_rate", "retry_after", "malformed_rate", "rpm", "tpm"):
+        if getattr(args, name) is not None:
+            setattr(config, name, getattr(args, name))
+    if args.seed is not None:
+        config.random.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
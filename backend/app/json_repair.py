@@ -0,0 +1,321 @@
+"""
+Локальный ремонт JSON из ответов LLM — вместо повторного вызова модели
+Чинит обёртку ```json и текст вокруг объекта, комментарии, висячие запятые, True/False/None,
+неэкранированные кавычки, переводы строк и обратные слэши внутри строк (частый случай в mermaid_code),
+а также ответ, обрезанный по max_tokens: строка и открытые структуры закрываются,
+недописанный последний элемент отбрасывается.
+Счётчики исходов по этапам общие для всех воркеров (локальный SQLite)
+"""
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from app.local_store import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+_ESCAPES = set('"\\/bfnrtu')
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_CONTROL = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_LITERAL = re.compile(r"(True|False|None)\b")
+_CLOSERS = {"{": "}", "[": "]"}
+STATS_FLUSH_INTERVAL = 5.0   # сек между записями накопленных счётчиков в SQLite
+
+
+class JSONRepairError(json.JSONDecodeError):
+    """Ответ не удалось починить локально или он не прошёл проверку схемы.
+    truncated — ответ обрезан (нужно продолжение), partial — разобранный, но негодный объект"""
+
+    def __init__(
+        self, msg: str, doc: str, pos: int = 0,
+        truncated: bool = False, partial: Optional[Dict[str, Any]] = None,
+    ):
+        super().__init__(msg, doc, pos)
+        self.truncated = truncated
+        self.partial = partial
+
+
+def _close(out: List[str], stack: List[str]) -> str:
+    text = "".join(out).rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    return text + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+
+def _drop_trailing_comma(out: List[str]) -> bool:
+    k = len(out) - 1
+    while k >= 0 and out[k].isspace():
+        k -= 1
+    if k >= 0 and out[k] == ",":
+        del out[k]
+        return True
+    return False
+
+
+def _next_significant(text: str, i: int) -> int:
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return i
+
+
+def _last_significant(out: List[str]) -> str:
+    for piece in reversed(out):
+        if not piece.isspace():
+            return piece[-1]
+    return ""
+
+
+def _closes_string(content: str, i: int, is_key: bool, stack: List[str]) -> bool:
+    """Закрывает ли кавычка content[i] строку — по тому, что идёт за ней.
+    Иначе это кавычка внутри текста: A["Узел"], C{"Решение?"} в mermaid_code"""
+    j = _next_significant(content, i + 1)
+    if j >= len(content):
+        return True
+    nxt = content[j]
+    if is_key:
+        return nxt == ":"
+    k = _next_significant(content, j + 1)
+    follower = content[k] if k < len(content) else ""
+    if nxt == ",":
+        if stack[-1] == "{":
+            return follower in ('"', "}", "")
+        return follower == "" or follower in '"{[]-0123456789tfnTFN'
+    if nxt in "}]":
+        if _CLOSERS[stack[-1]] != nxt:
+            return False
+        if follower == "" or follower in ",}]":
+            return True
+        # Закрытие корня — дальше может идти пояснение (в том числе с JSON), но не продолжение строки
+        return len(stack) == 1 and not _string_continues(content[k:])
+    return False
+
+
+def _string_continues(rest: str) -> bool:
+    """Есть ли в тексте после «закрытия корня» кавычка вне фигурных скобок, за которой корень
+    закрывается снова: C{"Решение?"} --> D"} — первая кавычка была внутри строки;
+    {"x": "a"} пояснение {"y": 1} — корень закрыт, хвост отбрасывается"""
+    depth = 0
+    for j, ch in enumerate(rest):
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth = max(0, depth - 1)
+        elif ch == '"' and not depth:
+            k = _next_significant(rest, j + 1)
+            if k < len(rest) and rest[k] == "}":
+                return True
+    return False
+
+
+def repair_json(content: str) -> Tuple[Dict[str, Any], List[str]]:
+    """(объект, список применённых исправлений); JSONRepairError — если починить не удалось"""
+    try:
+        result = json.loads(content)
+        if isinstance(result, dict):
+            return result, []
+    except json.JSONDecodeError:
+        pass
+
+    start = content.find("{")
+    if start == -1:
+        raise JSONRepairError("В ответе нет JSON-объекта", content)
+
+    fixes = set()
+    if content[:start].strip():
+        fixes.add("surrounding_text")
+    out: List[str] = []
+    stack: List[str] = []
+    cuts: List[Tuple[int, List[str]]] = []   # места, где можно отрезать недописанный хвост
+    in_string = is_key = False
+    i, n = start, len(content)
+    while i < n:
+        ch = content[i]
+        if in_string:
+            if ch == "\\":
+                nxt = content[i + 1] if i + 1 < n else ""
+                if not nxt:
+                    i += 1
+                    continue
+                if nxt in _ESCAPES and (nxt != "u" or _HEX4.match(content, i + 2)):
+                    out.append(ch + nxt)
+                    i += 2
+                    continue
+                out.append("\\\\")   # \d, \s, \( в тексте — литеральный обратный слэш
+                fixes.add("escape")
+                i += 1
+                continue
+            if ch == '"':
+                j = _next_significant(content, i + 1)
+                if not is_key and j < n and content[j] == '"' and "\n" in content[i + 1:j]:
+                    # Пропущенная запятая между элементами на разных строках
+                    out.append('",')
+                    fixes.add("missing_comma")
+                elif _closes_string(content, i, is_key, stack):
+                    out.append('"')
+                else:
+                    out.append('\\"')
+                    fixes.add("quote")
+                    i += 1
+                    continue
+                in_string = False
+                i += 1
+                continue
+            if ch in _CONTROL or ord(ch) < 0x20:
+                out.append(_CONTROL.get(ch) or "\\u%04x" % ord(ch))
+                fixes.add("control_char")
+                i += 1
+                continue
+            out.append(ch)
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            is_key = bool(stack) and stack[-1] == "{" and _last_significant(out) in "{,"
+            out.append(ch)
+        elif ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+            cuts.append((len(out), list(stack)))
+        elif ch in "}]":
+            if _drop_trailing_comma(out):
+                fixes.add("trailing_comma")
+            if not stack or _CLOSERS[stack[-1]] != ch:
+                fixes.add("bracket")
+                i += 1
+                continue
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                if content[i + 1:].strip().strip("`").strip():
+                    fixes.add("surrounding_text")
+                break
+        elif ch == ",":
+            cuts.append((len(out), list(stack)))
+            out.append(ch)
+        elif ch == "/" and content.startswith("//", i):
+            end = content.find("\n", i)
+            i = n if end == -1 else end
+            fixes.add("comment")
+            continue
+        elif _LITERAL.match(content, i) and (not out or not out[-1].isalnum()):
+            word = _LITERAL.match(content, i).group(1)
+            out.append(_LITERALS[word])
+            fixes.add("python_literal")
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    truncated = in_string or bool(stack)
+    if in_string:
+        out.append('"')
+    candidates = [_close(out, stack)]
+    if truncated:
+        fixes.add("truncated")
+        # Недописанный последний элемент ("key": без значения, обрезанное число) — отбрасываем
+        candidates += [_close(out[:pos], cut_stack) for pos, cut_stack in reversed(cuts)]
+
+    last_error: Optional[json.JSONDecodeError] = None
+    for candidate in candidates:
+        try:
+            result = json.loads(candidate)
+        except json.JSONDecodeError as e:
+            last_error = last_error or e
+            continue
+        if isinstance(result, dict):
+            return result, sorted(fixes)
+    raise JSONRepairError(
+        f"Не удалось починить JSON: {last_error.msg if last_error else 'ожидался объект'}",
+        content,
+        last_error.pos if last_error else 0,
+        truncated=truncated,
+    )
+
+
+class RepairStats:
+    """Исходы разбора ответов LLM по этапам, общие для всех воркеров:
+    parsed — валидный ответ как есть, repaired — починен локально, unrepairable — JSON не починить,
+    invalid — разобран, но не прошёл проверку схемы этапа; followup_ok / followup_failed — итог
+    повторного вызова с промптом «продолжи» или «исправь».
+    repair_rate — доля проблемных ответов, обошедшихся без повторного вызова LLM.
+    Исходы копятся в процессе и попадают в таблицу фоновым потоком не реже STATS_FLUSH_INTERVAL"""
+
+    _SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS json_repair_stats (
+            stage   TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            count   INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (stage, outcome)
+        )""",
+    ]
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._flushing = False
+
+    def _conn(self):
+        return ensure_schema("json_repair_stats", self._SCHEMA)
+
+    def record(self, stage: Optional[str], outcome: str) -> None:
+        if stage is None:
+            return
+        with self._lock:
+            self._pending[(stage, outcome)] = self._pending.get((stage, outcome), 0) + 1
+            if self._flushing or time.monotonic() - self._flushed_at < STATS_FLUSH_INTERVAL:
+                return
+            self._flushing = True
+        threading.Thread(target=self.flush, name="json-repair-stats", daemon=True).start()
+
+    def flush(self) -> None:
+        """Переносит накопленные счётчики в общую таблицу (вызывать вне цикла событий)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            if pending:
+                self._conn().executemany(
+                    "INSERT INTO json_repair_stats (stage, outcome, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT(stage, outcome) DO UPDATE SET count = count + excluded.count",
+                    [(stage, outcome, count) for (stage, outcome), count in pending.items()],
+                )
+        except Exception as e:
+            logger.warning(f"Не удалось записать статистику ремонта JSON: {e}")
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+        finally:
+            with self._lock:
+                self._flushing = False
+                self._flushed_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        self.flush()
+        per_stage: Dict[str, Dict[str, Any]] = {}
+        for stage, outcome, count in self._conn().execute("SELECT stage, outcome, count FROM json_repair_stats"):
+            per_stage.setdefault(stage, {})[outcome] = count
+        for counters in per_stage.values():
+            repaired = counters.get("repaired", 0)
+            broken = repaired + counters.get("unrepairable", 0) + counters.get("invalid", 0)
+            followup_ok, followup_failed = counters.get("followup_ok", 0), counters.get("followup_failed", 0)
+            counters["repair_rate"] = round(repaired / broken, 4) if broken else None
+            counters["followup_rate"] = (
+                round(followup_ok / (followup_ok + followup_failed), 4) if followup_ok + followup_failed else None
+            )
+        return per_stage
+
+    def clear(self) -> int:
+        with self._lock:
+            self._pending.clear()
+        return self._conn().execute("DELETE FROM json_repair_stats").rowcount
+
+
+# Глобальный экземпляр
+repair_stats = RepairStats()
+atexit.register(repair_stats.flush)
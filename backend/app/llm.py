@@ -0,0 +1,441 @@
+"""
+Асинхронный клиент LLM (Groq или другой провайдер из app/llm_provider.py)
+Один общий пул HTTP-соединений на воркер, ретраи без блокировки event loop
+"""
+import re
+import json
+import logging
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, AsyncIterator, Callable
+from groq import APIError, APIConnectionError, RateLimitError
+from app.llm_cache import llm_cache, make_key, LLM_CACHE_ENABLED
+from app.llm_provider import LLMProvider, create_provider
+from app.rate_limiter import rate_limiter, RATE_LIMIT_ENABLED
+from app.circuit_breaker import circuit_breaker, LLMUnavailableError
+from app.singleflight import SingleFlight
+from app.json_repair import repair_json, repair_stats, JSONRepairError
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+LLM_TEMPERATURE = 0.7
+LLM_MAX_TOKENS = 2048
+LLM_EXPECTED_COMPLETION = 1024   # резерв токенов на ответ в лимитере, уточняется по usage
+
+_provider: Optional[LLMProvider] = None
+
+# Сэкономленные запросы учитываются в счётчиках кэша: coalesced_local / coalesced_remote
+singleflight = SingleFlight(on_saved=lambda kind: llm_cache.bump(f"coalesced_{kind}"))
+
+# Обход кэша для текущего HTTP-запроса (Cache-Control: no-cache), наследуется фоновыми задачами
+cache_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+
+def get_provider() -> LLMProvider:
+    """Ленивая инициализация провайдера — после load_dotenv() и внутри воркера"""
+    global _provider
+    if _provider is None:
+        _provider = create_provider()
+        logger.info(f"LLM-провайдер: {_provider.name}, модель {_provider.model}")
+    return _provider
+
+
+async def close_client() -> None:
+    """Закрытие пула соединений при остановке приложения"""
+    global _provider
+    if _provider is not None:
+        await _provider.aclose()
+    _provider = None
+
+
+def _cache_key(prompt: str) -> str:
+    # Провайдер входит в ключ — ответы фейкового сервера не попадут в выдачу реального
+    provider = get_provider()
+    return make_key(f"{provider.name}:{provider.model}", prompt, LLM_TEMPERATURE, LLM_MAX_TOKENS)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (для кириллицы ~3 символа на токен)"""
+    return len(text) // 3 + 1
+
+
+async def _cache_get(key: str, count: bool = True) -> Optional[Dict[str, Any]]:
+    try:
+        return await asyncio.to_thread(llm_cache.get, key, count)
+    except Exception as e:
+        logger.warning(f"Кэш LLM недоступен (чтение): {e}")
+        return None
+
+
+async def _cache_set(key: str, value: Dict[str, Any]) -> None:
+    try:
+        await asyncio.to_thread(llm_cache.set, key, value)
+    except Exception as e:
+        logger.warning(f"Кэш LLM недоступен (запись): {e}")
+
+
+async def _create_completion(prompt: str, **kwargs):
+    """Один запрос к LLM через circuit breaker и лимитер; возвращает (сырой ответ, резерв токенов)"""
+    if not circuit_breaker.allow():
+        raise LLMUnavailableError(circuit_breaker.retry_after())
+    reserved = 0
+    try:
+        reserved = await rate_limiter.acquire(estimate_tokens(prompt) + LLM_EXPECTED_COMPLETION)
+        started = time.monotonic()
+        raw = await get_provider().create(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS,
+            **kwargs,
+        )
+    except BaseException as e:
+        circuit_breaker.record_error(e)
+        # Ответа нет (5xx, таймаут, 429, отмена) — резерв целиком возвращается в ведро;
+        # shield — чтобы повторная отмена не оставила резерв списанным
+        await asyncio.shield(rate_limiter.settle(reserved, 0))
+        raise
+    if not kwargs.get("stream"):
+        # Исход потокового вызова известен только в конце ответа — его учитывает stream_groq
+        circuit_breaker.record_success(time.monotonic() - started)
+    await rate_limiter.observe(raw.headers)
+    return raw, reserved
+
+
+Validator = Callable[[Dict[str, Any]], Optional[str]]
+
+
+def _parse_json(
+    content: str, stage: Optional[str], truncated: bool = False, validate: Optional[Validator] = None,
+) -> Dict[str, Any]:
+    """JSON из ответа; битый сначала чинится локально, затем проверяется validate (текст ошибки или None).
+    JSONRepairError — нужен вызов «продолжи/исправь»"""
+    fixes = []
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError:
+        result = None
+    if not isinstance(result, dict):
+        try:
+            result, fixes = repair_json(content)
+        except JSONRepairError as e:
+            repair_stats.record(stage, "unrepairable")
+            e.truncated = e.truncated or truncated
+            raise
+    truncated = truncated or "truncated" in fixes
+
+    error = validate(result) if validate else None
+    if error is not None:
+        repair_stats.record(stage, "invalid")
+        raise JSONRepairError(error, content, truncated=truncated, partial=result)
+    if fixes:
+        repair_stats.record(stage, "repaired")
+        logger.info(f"JSON ответа починен локально ({stage or 'llm'}): {', '.join(fixes)}")
+    else:
+        repair_stats.record(stage, "parsed")
+    return result
+
+
+def _failed_generation(e: APIError) -> Optional[str]:
+    """JSON mode Groq: ответ, не прошедший проверку JSON (400 json_validate_failed), приходит в теле ошибки"""
+    body = getattr(e, "body", None)
+    error = body.get("error", body) if isinstance(body, dict) else None
+    if isinstance(error, dict) and isinstance(error.get("failed_generation"), str):
+        return error["failed_generation"]
+    return None
+
+
+async def _call_with_retries(
+    prompt: str, max_retries: int, cache_key: Optional[str],
+    stage: Optional[str] = None, validate: Optional[Validator] = None,
+) -> Dict[str, Any]:
+    """Сам запрос к Groq с retry-логикой; при неудаче — исключение.
+    Битый JSON не повторяется вслепую: чинится локально, иначе JSONRepairError"""
+    last_error = None
+
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Вызов Groq API (попытка {attempt + 1}/{max_retries})")
+            raw, reserved = await _create_completion(prompt, response_format={"type": "json_object"})
+            response = await raw.parse()
+            await rate_limiter.settle(reserved, response.usage.total_tokens if response.usage else None)
+
+            content = response.choices[0].message.content
+            logger.info(f"Получен ответ от Groq API, длина: {len(content)}")
+
+            result = _parse_json(
+                content, stage, truncated=response.choices[0].finish_reason == "length", validate=validate,
+            )
+            if cache_key:
+                await _cache_set(cache_key, result)
+            return result
+
+        except JSONRepairError:
+            raise
+
+        except LLMUnavailableError as e:
+            last_error = e
+            logger.warning("Circuit breaker разомкнут, вызов Groq API пропущен")
+            break
+
+        except RateLimitError as e:
+            last_error = e
+            # Лимитер сам выдержит паузу по retry-after перед следующей попыткой — во всех воркерах
+            await rate_limiter.observe(e.response.headers, limited=True)
+            logger.warning(f"Лимит Groq API: {e}")
+            if not RATE_LIMIT_ENABLED:
+                await asyncio.sleep((attempt + 1) * 3)
+
+        except APIConnectionError as e:
+            last_error = e
+            if circuit_breaker.is_open():
+                continue  # следующая попытка сразу упрётся в breaker — не ждём зря
+            wait_time = (attempt + 1) * 3  # Нарастающая задержка: 3с, 6с, 9с
+            logger.warning(f"Ошибка сети: {e}. Ждём {wait_time}с...")
+            await asyncio.sleep(wait_time)
+
+        except APIError as e:
+            content = _failed_generation(e)
+            if content is not None:
+                logger.warning(f"Groq отклонил ответ как невалидный JSON, чиним локально ({len(content)} символов)")
+                result = _parse_json(content, stage, validate=validate)
+                if cache_key:
+                    await _cache_set(cache_key, result)
+                return result
+            last_error = e
+            logger.error(f"Ошибка API: {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2)
+                continue
+            break
+
+        except Exception as e:
+            last_error = e
+            logger.error(f"Неожиданная ошибка: {e}")
+            break
+
+    if isinstance(last_error, LLMUnavailableError):
+        raise last_error
+    raise Exception(f"Не удалось получить ответ после {max_retries} попыток: {last_error}")
+
+
+async def call_groq(
+    prompt: str,
+    max_retries: int = 3,
+    fallback_result: Optional[Dict[str, Any]] = None,
+    use_cache: bool = True,
+    stage: Optional[str] = None,
+    validate: Optional[Validator] = None,
+) -> Dict[str, Any]:
+    """Вызов Groq API с кэшем, single-flight, retry-логикой и fallback
+
+    Args:
+        prompt: Промпт для API
+        max_retries: Максимальное количество попыток
+        fallback_result: Результат при неудаче (если None — выбрасывается исключение)
+        use_cache: Читать/писать кэш ответов (False — всегда идти в сеть)
+        stage: Этап пайплайна — для статистики ремонта JSON (repair_stats)
+        validate: Проверка ответа (текст ошибки или None) — негодный ответ не кэшируется,
+            а вызывает JSONRepairError, как и JSON, который не удалось починить
+
+    Одинаковые одновременные вызовы (в том числе из разных воркеров) делают один запрос.
+    Пока circuit breaker разомкнут, сразу возвращается fallback_result,
+    а без него — LLMUnavailableError.
+    """
+    key = _cache_key(prompt)
+    cache_key = key if use_cache and LLM_CACHE_ENABLED and not cache_bypass.get() else None
+    if cache_key:
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            logger.info("Ответ Groq API взят из кэша")
+            return cached
+
+    try:
+        return await singleflight.do(
+            key,
+            lambda: _call_with_retries(prompt, max_retries, cache_key, stage, validate),
+            # Между воркерами результат передаётся через кэш — без кэша только внутри воркера
+            shared_get=(lambda: _cache_get(cache_key, count=False)) if cache_key else None,
+        )
+    except Exception:
+        # Все попытки исчерпаны
+        if fallback_result:
+            logger.warning(f"Использую fallback результат после {max_retries} попыток")
+            return fallback_result
+        raise
+
+
+async def recache(prompt: str, result: Dict[str, Any]) -> None:
+    """Кладёт в кэш для prompt ответ, исправленный повторным вызовом"""
+    if LLM_CACHE_ENABLED and not cache_bypass.get():
+        await _cache_set(_cache_key(prompt), result)
+
+
+def loads_loose(content: str) -> Dict[str, Any]:
+    """json.loads, терпимый к обёртке ```json ... ```, тексту вокруг объекта и типичным ошибкам LLM
+    (см. app/json_repair.py); при неудаче — JSONRepairError (подкласс json.JSONDecodeError)"""
+    return repair_json(content)[0]
+
+
+async def call_groq_text(prompt: str, max_retries: int = 2) -> str:
+    """Вызов без JSON mode — для продолжения обрезанного ответа (кусок JSON сам по себе невалиден)"""
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Вызов Groq API, текст (попытка {attempt + 1}/{max_retries})")
+            raw, reserved = await _create_completion(prompt)
+            response = await raw.parse()
+            await rate_limiter.settle(reserved, response.usage.total_tokens if response.usage else None)
+            return response.choices[0].message.content or ""
+        except RateLimitError as e:
+            await rate_limiter.observe(e.response.headers, limited=True)
+            if attempt == max_retries - 1:
+                raise
+            logger.warning(f"Лимит Groq API: {e}")
+            if not RATE_LIMIT_ENABLED:
+                await asyncio.sleep((attempt + 1) * 3)
+        except APIConnectionError as e:
+            if attempt == max_retries - 1:
+                raise
+            wait_time = (attempt + 1) * 3
+            logger.warning(f"Ошибка сети: {e}. Ждём {wait_time}с...")
+            await asyncio.sleep(wait_time)
+    raise Exception(f"Не удалось получить ответ после {max_retries} попыток")
+
+
+async def stream_groq(prompt: str, max_retries: int = 3, use_cache: bool = True) -> AsyncIterator[str]:
+    """Потоковый вызов Groq API — отдаёт фрагменты ответа по мере генерации
+
+    Ретраи возможны только до первого фрагмента. Кэш общий с call_groq:
+    при попадании весь ответ отдаётся одним фрагментом, итог кладётся в кэш.
+    JSON mode в Groq не поддерживает стриминг, поэтому формат задаёт сам промпт.
+    """
+    cache_key = None
+    if use_cache and LLM_CACHE_ENABLED and not cache_bypass.get():
+        cache_key = _cache_key(prompt)
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            logger.info("Ответ Groq API (стрим) взят из кэша")
+            yield json.dumps(cached, ensure_ascii=False)
+            return
+
+    raw, reserved = None, 0
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Потоковый вызов Groq API (попытка {attempt + 1}/{max_retries})")
+            started = time.monotonic()
+            raw, reserved = await _create_completion(prompt, stream=True)
+            break
+        except RateLimitError as e:
+            await rate_limiter.observe(e.response.headers, limited=True)
+            if attempt == max_retries - 1:
+                raise
+            logger.warning(f"Лимит Groq API: {e}")
+            if not RATE_LIMIT_ENABLED:
+                await asyncio.sleep((attempt + 1) * 3)
+        except APIConnectionError as e:
+            if attempt == max_retries - 1:
+                raise
+            wait_time = (attempt + 1) * 3
+            logger.warning(f"Ошибка сети: {e}. Ждём {wait_time}с...")
+            await asyncio.sleep(wait_time)
+
+    parts = []
+    used_tokens, first_chunk_at = None, None
+    try:
+        stream = await raw.parse()
+        async for chunk in stream:
+            if first_chunk_at is None:
+                first_chunk_at = time.monotonic()
+            # Groq присылает расход токенов в последнем фрагменте (x_groq.usage)
+            x_groq = getattr(chunk, "x_groq", None)
+            usage = chunk.usage or (x_groq.usage if x_groq is not None else None)
+            if usage is not None:
+                used_tokens = usage.total_tokens
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    except BaseException as e:
+        # Обрыв посреди ответа — сбой провайдера; отмена клиентом — нейтральный исход
+        circuit_breaker.record_error(e)
+        raise
+    else:
+        # Для breaker важна задержка до первого фрагмента, а не длина ответа
+        circuit_breaker.record_success((first_chunk_at or time.monotonic()) - started)
+    finally:
+        content = "".join(parts)
+        # Без usage (поток оборван) — оценка по промпту и полученному тексту
+        if used_tokens is None:
+            used_tokens = estimate_tokens(prompt) + estimate_tokens(content)
+        await rate_limiter.settle(reserved, used_tokens)
+
+    logger.info(f"Потоковый ответ от Groq API завершён, длина: {len(content)}")
+    if cache_key:
+        try:
+            await _cache_set(cache_key, loads_loose(content))
+        except json.JSONDecodeError:
+            pass
+
+
+class JsonFieldStream:
+    """Вытаскивает значение строкового поля из JSON, который приходит по кусочкам
+
+    feed() возвращает только новый раскодированный текст поля — его можно сразу
+    отправлять клиенту, не дожидаясь конца ответа. Весь текст копится в raw.
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, field: str):
+        self.raw = ""
+        self._pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._pos: Optional[int] = None   # позиция внутри строки поля
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self.raw += chunk
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._pattern.search(self.raw)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        out = []
+        buf, i = self.raw, self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            # Escape-последовательность: ждём, пока она придёт целиком
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc == "u":
+                if i + 6 > len(buf):
+                    break
+                code = int(buf[i + 2:i + 6], 16)
+                # Суррогатная пара (эмодзи) — нужен второй \uXXXX
+                if 0xD800 <= code < 0xDC00:
+                    if i + 12 > len(buf):
+                        break
+                    if buf[i + 6:i + 8] == "\\u":
+                        low = int(buf[i + 8:i + 12], 16)
+                        out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                        i += 12
+                        continue
+                out.append(chr(code))
+                i += 6
+                continue
+            out.append(self._ESCAPES.get(esc, esc))
+            i += 2
+        self._pos = i
+        return "".join(out)
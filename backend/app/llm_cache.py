@@ -0,0 +1,29 @@
+"""
+Кэш ответов LLM на диске (content-addressed)
+Ключ — хэш (model, prompt, temperature, max_tokens); TTL + LRU-вытеснение по размеру.
+Таблица лежит в локальном SQLite и общая для всех воркеров gunicorn
+"""
+import os
+import json
+import hashlib
+from app.local_store import DiskCache
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))          # секунд
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+
+def make_key(model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """SHA-256 от параметров запроса — одинаковые запросы дают одинаковый ключ"""
+    raw = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Глобальный экземпляр кэша
+llm_cache = DiskCache(
+    "llm_cache",
+    ttl=LLM_CACHE_TTL,
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    max_bytes=LLM_CACHE_MAX_BYTES,
+)
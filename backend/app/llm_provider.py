@@ -0,0 +1,125 @@
+"""
+Провайдеры LLM за call_groq / stream_groq
+groq — реальный Groq API (по умолчанию); fake — встроенный фейковый сервер
+(python -m app.fake_llm) для нагрузочных тестов без расхода квоты.
+Провайдер выбирается через LLM_PROVIDER, модель — через LLM_MODEL
+"""
+import os
+from typing import Callable, Dict, List, Optional
+import httpx
+from groq import AsyncGroq
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+FAKE_LLM_URL = "http://127.0.0.1:8090"
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))                  # секунд на запрос
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))   # на один воркер
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+
+
+class LLMProvider:
+    """Интерфейс провайдера: chat.completions с доступом к заголовкам ответа
+
+    create() возвращает сырой ответ (headers + await parse()), ошибки — исключения SDK groq
+    (APIConnectionError, APIStatusError, RateLimitError): на них завязаны ретраи, лимитер и breaker
+    """
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    async def create(self, messages: List[Dict[str, str]], **kwargs):
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+class GroqProvider(LLMProvider):
+    """Groq API (или любой сервер с тем же протоколом — base_url)"""
+
+    name = "groq"
+
+    def __init__(
+        self,
+        model: str,
+        api_key: Optional[str],
+        base_url: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        super().__init__(model)
+        self._api_key = api_key
+        self._base_url = base_url
+        self._http_client = http_client
+        self._client: Optional[AsyncGroq] = None
+
+    def client(self) -> AsyncGroq:
+        """Ленивое создание клиента — внутри воркера, с общим пулом соединений"""
+        if self._client is None:
+            if self._http_client is None:
+                self._http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                    ),
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+                )
+            # Ретраи делаем сами (см. call_groq), встроенные в SDK отключаем
+            self._client = AsyncGroq(
+                api_key=self._api_key,
+                base_url=self._base_url,
+                http_client=self._http_client,
+                max_retries=0,
+            )
+        return self._client
+
+    async def create(self, messages: List[Dict[str, str]], **kwargs):
+        return await self.client().chat.completions.with_raw_response.create(
+            model=self.model,
+            messages=messages,
+            **kwargs,
+        )
+
+    async def aclose(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = None
+        self._client = None
+
+
+class FakeProvider(GroqProvider):
+    """Фейковый OpenAI/Groq-совместимый сервер из app/fake_llm.py"""
+
+    name = "fake"
+
+    def __init__(self, model: str, base_url: Optional[str] = None):
+        super().__init__(model, api_key="fake", base_url=base_url or FAKE_LLM_URL)
+
+
+def _groq_factory(model: str, base_url: Optional[str]) -> LLMProvider:
+    return GroqProvider(model, api_key=os.getenv("GROQ_API_KEY"), base_url=base_url)
+
+
+def _fake_factory(model: str, base_url: Optional[str]) -> LLMProvider:
+    return FakeProvider(model, base_url=base_url)
+
+
+PROVIDERS: Dict[str, Callable[[str, Optional[str]], LLMProvider]] = {
+    "groq": _groq_factory,
+    "fake": _fake_factory,
+}
+
+
+def register_provider(name: str, factory: Callable[[str, Optional[str]], LLMProvider]) -> None:
+    """Подключение своего провайдера: factory(model, base_url) -> LLMProvider"""
+    PROVIDERS[name] = factory
+
+
+def create_provider(name: Optional[str] = None) -> LLMProvider:
+    """Провайдер по настройкам окружения (читаются при вызове — уже после load_dotenv())"""
+    name = (name or os.getenv("LLM_PROVIDER", "groq")).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Неизвестный LLM_PROVIDER: {name} (доступны: {', '.join(PROVIDERS)})")
+    model = os.getenv("LLM_MODEL", DEFAULT_MODEL)
+    return PROVIDERS[name](model, os.getenv("LLM_BASE_URL") or None)
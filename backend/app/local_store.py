@@ -0,0 +1,157 @@
+"""
+Локальное хранилище состояния (SQLite-файл рядом с приложением)
+Общее для всех воркеров gunicorn на одной машине и не зависит от DATABASE_URL:
+здесь живут кэши, счётчики и служебные таблицы бэкенда
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Iterable, Optional, Any
+
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "./ai_architect_local.db")
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_initialized_schemas = set()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Соединение на поток (autocommit, WAL — читатели не блокируют писателя)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(LOCAL_STORE_PATH, timeout=10.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+def ensure_schema(name: str, statements: Iterable[str]) -> sqlite3.Connection:
+    """Создаёт таблицы модуля один раз на процесс и возвращает соединение"""
+    conn = get_connection()
+    if name not in _initialized_schemas:
+        with _schema_lock:
+            if name not in _initialized_schemas:
+                for ddl in statements:
+                    conn.execute(ddl)
+                _initialized_schemas.add(name)
+    return conn
+
+
+class DiskCache:
+    """Кэш «ключ → JSON» в локальном SQLite: TTL, LRU-вытеснение по числу записей и байтам,
+    счётчики попаданий/промахов общие для всех воркеров"""
+
+    def __init__(self, table: str, ttl: int, max_entries: int, max_bytes: int):
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._schema = [
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                key         TEXT PRIMARY KEY,
+                value       TEXT NOT NULL,
+                tag         TEXT,
+                size        INTEGER NOT NULL,
+                created_at  REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_access ON {table}(last_access)",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_tag ON {table}(tag)",
+            f"""CREATE TABLE IF NOT EXISTS {table}_stats (
+                name  TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )""",
+        ]
+
+    def _conn(self) -> sqlite3.Connection:
+        return ensure_schema(self.table, self._schema)
+
+    def bump(self, name: str, delta: int = 1) -> None:
+        """Увеличивает общий счётчик (hits, misses, ... или любой свой)"""
+        self._conn().execute(
+            f"INSERT INTO {self.table}_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, delta),
+        )
+
+    def get(self, key: str, count: bool = True) -> Optional[Any]:
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row and now - row[1] <= self.ttl:
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            if count:
+                self.bump("hits")
+            return json.loads(row[0])
+        if row:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.bump("expired")
+        if count:
+            self.bump("misses")
+        return None
+
+    def set(self, key: str, value: Any, tag: Optional[str] = None) -> None:
+        conn = self._conn()
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, tag, size, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, payload, tag, len(payload.encode("utf-8")), now, now),
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Удаляет просроченные записи, затем самые давно использованные — до лимитов"""
+        expired = conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,)).rowcount
+        count, total = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        evicted = 0
+        if count > self.max_entries or total > self.max_bytes:
+            # Вытесняем с запасом 10%, чтобы не чистить на каждой записи
+            keep_entries = int(self.max_entries * 0.9)
+            keep_bytes = int(self.max_bytes * 0.9)
+            rows = conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access DESC").fetchall()
+            kept, kept_bytes, drop = 0, 0, []
+            for key, size in rows:
+                if kept < keep_entries and kept_bytes + size <= keep_bytes:
+                    kept += 1
+                    kept_bytes += size
+                else:
+                    drop.append((key,))
+            conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", drop)
+            evicted = len(drop)
+        if expired:
+            self.bump("expired", expired)
+        if evicted:
+            self.bump("evicted", evicted)
+
+    def delete(self, key: str) -> bool:
+        return self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self, tag: Optional[str] = None) -> int:
+        """Удаляет все записи или только записи с указанным тегом"""
+        if tag is None:
+            return self._conn().execute(f"DELETE FROM {self.table}").rowcount
+        return self._conn().execute(f"DELETE FROM {self.table} WHERE tag = ?", (tag,)).rowcount
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        counters = dict(conn.execute(f"SELECT name, value FROM {self.table}_stats").fetchall())
+        entries, total = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        hits, misses = counters.pop("hits", 0), counters.pop("misses", 0)
+        return {
+            "entries": entries,
+            "size_bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "expired": counters.pop("expired", 0),
+            "evicted": counters.pop("evicted", 0),
+            **counters,
+        }
@@ -1,27 +1,66 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Tuple, Callable
 import os
 import json
-import logging
 import time
+import base64
+import logging
 import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from groq import Groq
-from groq import APIError, APIConnectionError, RateLimitError
 from app.auth import (
     create_access_token, 
     decode_access_token, 
-    get_password_hash,
+    password_hasher,
+    PasswordHasherBusyError,
     UserCreate, 
     UserLogin, 
     Token,
     User
 )
-from app.database import user_db
+from app.database import user_db, PLAN_LIMITS, DAILY_METRICS
+from app.auth_cache import auth_cache
+from app.prompts import (
+    PROMPT_CLARIFIER,
+    PROMPT_CHAT_ASSISTANT,
+)
+from app.llm import call_groq, stream_groq, loads_loose, JsonFieldStream, close_client, cache_bypass
+from app.llm_cache import llm_cache, LLM_CACHE_ENABLED
+from app.json_repair import repair_stats
+from app.rate_limiter import rate_limiter
+from app.circuit_breaker import circuit_breaker, LLMUnavailableError
+from app.scheduler import scheduler, QueueFullError, GENERATION_MAX_CONCURRENT
+from app.worker import JobRunner, GENERATION_EXECUTOR, GENERATION_DISCONNECT_GRACE
+from app.progress_store import progress_store
+from app.pipeline import (
+    AgentResponse,
+    PIPELINE_STAGES,
+    PIPELINE_VERSION,
+    FAST_PIPELINE_VERSION,
+    GENERATION_MODE_FULL,
+    GENERATION_MODE_FAST,
+    CANCELLED_PROGRESS,
+    job_progress,
+    cache_result,
+)
+from app.chat_context import (
+    format_history,
+    compact,
+    chat_summaries,
+    conversation_key,
+    CLARIFY_HISTORY_TOKENS,
+)
+from app.result_cache import (
+    generation_cache,
+    make_fingerprint,
+    GENERATION_CACHE_ENABLED,
+    SCOPE_USER,
+)
 
 load_dotenv()
 
@@ -29,7 +68,26 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Architect API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Исполнитель генераций внутри API-воркера; при GENERATION_EXECUTOR=worker задачи
+    # выполняет только отдельный пул python -m app.worker
+    await progress_store.start()
+    runner = None
+    if GENERATION_EXECUTOR == "inline":
+        runner = JobRunner(GENERATION_MAX_CONCURRENT)
+        await runner.start()
+        scheduler.on_submit(runner.wake)
+    yield
+    if runner is not None:
+        await runner.stop()
+    await progress_store.stop()
+    # Закрываем общий пул соединений к LLM
+    await close_client()
+    password_hasher.shutdown()
+
+
+app = FastAPI(title="AI Architect API", lifespan=lifespan)
 
 # Security схема
 security = HTTPBearer(auto_error=False)
@@ -42,13 +100,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "Retry-After"],
 )
 
-# Инициализируем клиент Groq
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
-# Хранилище состояний для сессий генерации
-generation_progress = {}
+@app.middleware("http")
+async def llm_cache_control(request: Request, call_next):
+    """Cache-Control: no-cache в запросе — ответы LLM не берутся из кэша"""
+    cache_control = request.headers.get("cache-control", "").lower()
+    token = cache_bypass.set("no-cache" in cache_control or "no-store" in cache_control)
+    try:
+        return await call_next(request)
+    finally:
+        cache_bypass.reset(token)
+
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    """Провайдер LLM недоступен (breaker разомкнут) — быстрый 503 вместо долгого ожидания"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after) + 1)},
+    )
+
+
+@app.exception_handler(PasswordHasherBusyError)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusyError):
+    """Очередь bcrypt переполнена — лишние логины отклоняются, не занимая CPU воркера"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after) + 1)},
+    )
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    """Очередь генераций переполнена — клиент повторит запрос позже"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after) + 1)},
+    )
+
+
+def _ensure_llm_available() -> None:
+    """Ранний отказ для потоковых эндпоинтов — после начала стрима статус уже не поменять"""
+    if circuit_breaker.is_open():
+        raise LLMUnavailableError(circuit_breaker.retry_after())
 
 
 async def get_current_user(
@@ -63,24 +163,30 @@ async def get_current_user(
         )
     
     token = credentials.credentials
-    payload = decode_access_token(token)
-    
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Неверный токен",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    username = payload.get("sub")
-    if not username:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Неверный токен",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    user = user_db.get_user(username)
+    # Горячий путь: токен уже проверен этим процессом — без JWT и без запроса к БД
+    user = auth_cache.get(token)
+    if user is None:
+        payload = decode_access_token(token)
+
+        if not payload:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Неверный токен",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        username = payload.get("sub")
+        if not username:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Неверный токен",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        user = await asyncio.to_thread(user_db.get_user, username)
+        if user:
+            auth_cache.set(token, user, payload.get("exp"))
+
     if not user or user.get("disabled"):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,7 +194,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    return User(username=username, plan=user.get("plan", "free"))
+    return User(username=user["username"], plan=user.get("plan", "free"))
 
 
 class GenerationStage(BaseModel):
@@ -108,6 +214,8 @@ class ClarifyRequest(BaseModel):
     """Запрос на уточнение идеи"""
     idea: str
     conversation_history: Optional[List[dict]] = None  # История диалога
+    speculative: bool = False  # если вопросов нет — сразу запустить генерацию (session_id в ответе)
+    mode: Optional[str] = None  # режим спекулятивной генерации, как в GenerateRequest
 
 
 class ClarifyResponse(BaseModel):
@@ -115,6 +223,7 @@ class ClarifyResponse(BaseModel):
     needs_clarification: bool
     questions: List[str]
     summary: Optional[str] = None  # Краткое понимание идеи
+    session_id: Optional[str] = None  # спекулятивная генерация — подтвердить через /api/generate
 
 
 class DialogMessage(BaseModel):
@@ -129,243 +238,10 @@ class DialogContext(BaseModel):
     messages: List[DialogMessage]
 
 
-class ImplementationStep(BaseModel):
-    day: int
-    task: str
-    duration: str
-
-
-class KeyMetric(BaseModel):
-    label: str       # "Ориентировочная стоимость"
-    value: str       # "300,000 - 800,000"
-    unit: str        # "₽" или "часов" или "шт"
-
-class ResourceGroup(BaseModel):
-    category: str       # "Запчасти", "Инструменты", "Специалисты"
-    items: List[str]    # Список конкретных позиций
-
-class ProjectMetrics(BaseModel):
-    project_type: str               # "technical", "business", "research", "other"
-    key_metrics: List[KeyMetric]    # Контекстные KPI
-    resources_needed: List[ResourceGroup]  # Что понадобится
-
-class AgentProfile(BaseModel):
-    name: str
-    role: str
-    avatar: str
-
-
-class AgentResponse(BaseModel):
-    agent_profile: AgentProfile
-    description: str
-    mermaid_code: str
-    system_prompt: str
-    tech_stack: List[str]
-    implementation_plan: List[ImplementationStep]
-    project_metrics: ProjectMetrics
-    risk_status: str
-
-
-# Промпты для 4-уровневой цепочки
-PROMPT_CLARIFIER = """Ты — опытный бизнес-аналитик. Твоя задача — понять идею пользователя и задать уточняющие вопросы, если информации недостаточно.
-
-Идея пользователя: {idea}
-
-Проанализируй идею и определи:
-1. Достаточно ли информации для создания ИИ-агента?
-2. Какие детали нужно уточнить?
-
-Если идея ясная и конкретная — верни needs_clarification: false
-Если нужны уточнения — задай 1-3 конкретных вопроса (не больше!)
-
-Важно:
-- Не спрашивай очевидные вещи
-- Вопросы должны быть конкретными и по делу
-- Если идея совсем непонятная — спроси что имеется в виду
-
-Верни ответ в формате JSON:
-{{
-  "needs_clarification": true/false,
-  "questions": ["вопрос 1", "вопрос 2"] // пустой массив если вопросов нет
-}}"""
-
-PROMPT_ANALYST = """Ты — бизнес-аналитик. Проанализируй идею ИИ-агента и определи:
-1. Основную задачу агента
-2. Входные данные (что получает)
-3. Выходные данные (что выдаёт)
-4. Интеграции (какие сервисы нужны)
-
-Идея: {idea}
-Контекст из диалога: {context}
-
-Верни ответ в формате JSON:
-{{
-  "task": "...",
-  "inputs": [...],
-  "outputs": [...],
-  "integrations": [...]
-}}"""
-
-PROMPT_ARCHITECT = """Ты — AI архитектор. Создай системный промпт для ИИ-агента.
-
-Задача агента: {task}
-Интеграции: {integrations}
-
-Верни ответ в формате JSON:
-{{
-  "name": "креативное имя агента",
-  "role": "роль агента",
-  "avatar": "эмодзи",
-  "system_prompt": "полный системный промпт для агента",
-  "tech_stack": [...]
-}}"""
-
-PROMPT_VISUALIZER = """Ты — визуализатор. Создай схему работы агента на языке Mermaid.js.
-
-Задача: {task}
-Входные данные: {inputs}
-Выходные данные: {outputs}
-
-ВАЖНО:
-- Используй только латинские буквы для идентификаторов узлов (A, B, C...)
-- Текст внутри узлов пиши в кавычках: A["Текст узла"]
-- Не используй спецсимволы в идентификаторах
-- Схема должна быть валидной для Mermaid.js
-
-Верни ответ в формате JSON:
-{{
-  "mermaid_code": "graph LR; A[\"Текст\"] --> B[\"Текст\"];"
-}}"""
-
-PROMPT_PM = """Ты — проект-менеджер. Проанализируй задачу и создай КОНТЕКСТНЫЙ план выполнения.
-
-Задача: {task}
-
-ВАЖНО: Сначала определи тип проекта:
-- "technical" — техническая/DIY задача (установка, ремонт, сборка, программирование)
-- "business" — автоматизация бизнес-процессов (боты, CRM, аналитика)
-- "research" — исследование, обучение, анализ данных
-- "other" — всё остальное
-
-В зависимости от типа — генерируй РЕЛЕВАНТНЫЕ метрики:
-- technical: стоимость, материалы, инструменты, специалисты
-- business: экономия времени, ROI, интеграции, ресурсы
-- research: источники, методология, ключевые выводы
-- other: наиболее подходящие метрики
-
-Верни ответ в формате JSON:
-{{
-  "project_type": "technical" | "business" | "research" | "other",
-  "key_metrics": [
-    {{"label": "Ориентировочная стоимость", "value": "50,000 - 150,000", "unit": "₽"}},
-    {{"label": "Время на реализацию", "value": "2-4", "unit": "недели"}}
-  ],
-  "resources_needed": [
-    {{
-      "category": "Материалы/Запчасти",
-      "items": ["конкретный элемент 1", "элемент 2"]
-    }},
-    {{
-      "category": "Инструменты/ПО",
-      "items": ["инструмент 1", "инструмент 2"]
-    }},
-    {{
-      "category": "Специалисты/Услуги",
-      "items": ["кто нужен", "что заказать"]
-    }}
-  ],
-  "implementation_plan": [
-    {{"day": 1, "task": "...", "duration": "..."}},
-    {{"day": 2, "task": "...", "duration": "..."}}
-  ],
-  "risk_status": "normal" | "warning" | "high"
-}}"""
-
-PROMPT_CHAT_ASSISTANT = """Ты — активный помощник-исполнитель, который помогает пользователю ДОВЕСТИ ЗАДАЧУ ДО КОНЦА.
-
-Контекст задачи:
-- Агент/проект: {agent_name} ({agent_role})
-- Суть задачи: {description}
-- Стек/ресурсы: {tech_stack}
-- Текущий шаг: {current_step}
-
-История переписки: {conversation_history}
-
-Вопрос/сообщение пользователя: {message}
-
-Твой подход:
-1. Если пользователь спрашивает ЧТО делать — давай КОНКРЕТНЫЕ инструкции (не абстрактные советы)
-2. Если спрашивает ГДЕ купить/найти — называй конкретные места, сервисы, ресурсы
-3. Если спрашивает СКОЛЬКО стоит — давай реальные диапазоны цен с пояснениями
-4. Если пользователь застрял — предложи альтернативный путь
-5. После ответа — предложи СЛЕДУЮЩИЙ конкретный шаг, который пользователь может сделать прямо сейчас
-
-Важно:
-- Будь конкретным, не общим
-- Давай ссылки на реальные ресурсы если знаешь
-- Разбивай сложные шаги на маленькие действия
-- Отвечай как опытный практик, который сам это делал
-
-Верни ответ в формате JSON:
-{{
-  "response": "конкретный ответ с практическими деталями",
-  "suggested_actions": ["Следующий шаг 1", "Следующий шаг 2", "Следующий шаг 3"]
-}}"""
-
-
-def call_groq(prompt: str, max_retries: int = 3, fallback_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    """Вызов Groq API с retry-логикой и fallback
-    
-    Args:
-        prompt: Промпт для API
-        max_retries: Максимальное количество попыток
-        fallback_result: Результат при неудаче (если None — выбрасывается исключение)
-    """
-    last_error = None
-
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Вызов Groq API (попытка {attempt + 1}/{max_retries})")
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=2048,
-                response_format={"type": "json_object"}
-            )
-
-            content = response.choices[0].message.content
-            logger.info(f"Получен ответ от Groq API, длина: {len(content)}")
-
-            result = json.loads(content)
-            return result
-
-        except (APIConnectionError, RateLimitError) as e:
-            last_error = e
-            wait_time = (attempt + 1) * 3  # Экспоненциальная задержка: 3с, 6с, 9с
-            logger.warning(f"Ошибка сети/лимита: {e}. Ждём {wait_time}с...")
-            time.sleep(wait_time)
-
-        except (APIError, json.JSONDecodeError) as e:
-            last_error = e
-            logger.error(f"Ошибка API или парсинга JSON: {e}")
-            # При ошибке парсинга JSON пробуем ещё раз
-            if attempt < max_retries - 1:
-                time.sleep(2)
-                continue
-            break
-
-        except Exception as e:
-            last_error = e
-            logger.error(f"Неожиданная ошибка: {e}")
-            break
-
-    # Все попытки исчерпаны
-    if fallback_result:
-        logger.warning(f"Использую fallback результат после {max_retries} попыток")
-        return fallback_result
-    
-    raise Exception(f"Не удалось получить ответ после {max_retries} попыток: {last_error}")
+# Тарифы, для которых fast — режим по умолчанию (если клиент не указал mode), через запятую
+FAST_MODE_PLANS = {p.strip() for p in os.getenv("FAST_MODE_PLANS", "").split(",") if p.strip()}
+# Отменять генерацию, если у неё нет SSE-подписчика дольше GENERATION_DISCONNECT_GRACE (клиент может переопределить)
+GENERATION_CANCEL_ON_DISCONNECT = os.getenv("GENERATION_CANCEL_ON_DISCONNECT", "0") == "1"
 
 
 @app.get("/")
@@ -376,8 +252,11 @@ def read_root():
 @app.post("/api/auth/register", response_model=User)
 async def register(user_data: UserCreate):
     """Регистрация нового пользователя"""
+    if await asyncio.to_thread(user_db.get_user, user_data.username):
+        raise HTTPException(status_code=400, detail=f"Пользователь '{user_data.username}' уже существует")
+    hashed_password = await password_hasher.hash(user_data.password)
     try:
-        user = user_db.create_user(user_data.username, user_data.password, user_data.email)
+        user = await asyncio.to_thread(user_db.create_user, user_data.username, hashed_password, user_data.email)
         logger.info(f"Зарегистрирован новый пользователь: {user_data.username}")
         return user
     except ValueError as e:
@@ -387,14 +266,19 @@ async def register(user_data: UserCreate):
 @app.post("/api/auth/login", response_model=Token)
 async def login(user_data: UserLogin):
     """Вход пользователя"""
-    user = user_db.authenticate(user_data.username, user_data.password)
-    if not user:
+    user = await asyncio.to_thread(user_db.get_user, user_data.username)
+    if not user or not await password_hasher.verify(user_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
+    # Хеш со старой стоимостью bcrypt пересчитываем, пока пароль известен
+    new_hash = await password_hasher.rehash_if_needed(user_data.password, user["hashed_password"])
+    if new_hash:
+        await asyncio.to_thread(user_db.set_password_hash, user["username"], new_hash)
+
     access_token = create_access_token(data={"sub": user["username"]})
     logger.info(f"Пользователь {user_data.username} вошёл в систему")
     return {
@@ -414,7 +298,7 @@ async def get_me(current_user: User = Depends(get_current_user)):
 @app.get("/api/usage")
 async def get_usage(current_user: User = Depends(get_current_user)):
     """Лимиты и использование текущего пользователя"""
-    return user_db.get_usage_info(current_user.username)
+    return await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan)
 
 
 class UpgradePlanRequest(BaseModel):
@@ -430,7 +314,7 @@ async def upgrade_plan(
     allowed = {"starter", "pro"}
     if request.plan not in allowed:
         raise HTTPException(status_code=400, detail="Недопустимый тариф")
-    user_db.upgrade_plan(current_user.username, request.plan)
+    await asyncio.to_thread(user_db.upgrade_plan, current_user.username, request.plan)
     logger.info(f"Пользователь {current_user.username} перешёл на план {request.plan}")
     return {"success": True, "plan": request.plan}
 
@@ -449,15 +333,15 @@ async def clarify_idea(
         # Формируем промпт с учётом истории диалога
         context_str = ""
         if request.conversation_history:
-            context_str = "История диалога:\n"
-            for msg in request.conversation_history[-6:]:  # Последние 6 сообщений
-                role = "Пользователь" if msg["role"] == "user" else "Ассистент"
-                context_str += f"{role}: {msg['content']}\n"
+            # Последние сообщения в пределах бюджета токенов
+            context_str = "История диалога:\n" + format_history(
+                request.conversation_history, budget=CLARIFY_HISTORY_TOKENS,
+            ) + "\n"
         
         full_idea = f"{request.idea}\n\n{context_str}" if context_str else request.idea
         
         clarifier_prompt = PROMPT_CLARIFIER.format(idea=full_idea)
-        result = call_groq(clarifier_prompt)
+        result = await call_groq(clarifier_prompt)
         
         # Добавим краткое резюме идеи
         summary = f"Идея: {request.idea}"
@@ -471,6 +355,10 @@ async def clarify_idea(
         }
         
         logger.info(f"Clarify результат: needs_clarification={response_data['needs_clarification']}, questions={len(response_data['questions'])}")
+        # Вопросов нет — клиент сразу подтвердит генерацию; запускаем её уже сейчас.
+        # С историей диалога контекст подтверждения заранее неизвестен — не спекулируем
+        if request.speculative and not response_data["needs_clarification"] and not context_str:
+            response_data["session_id"] = await _start_speculative(request, summary, current_user)
         return response_data
         
     except Exception as e:
@@ -489,6 +377,9 @@ class GenerateRequest(BaseModel):
     attachments: Optional[List[str]] = None
     original_idea: Optional[str] = None  # Для диалога
     messages: Optional[List[DialogMessage]] = None  # Для диалога
+    mode: Optional[str] = None  # "full" | "fast"; по умолчанию — по тарифу (FAST_MODE_PLANS)
+    cancel_on_disconnect: Optional[bool] = None  # отменить, если вкладку закрыли; по умолчанию — GENERATION_CANCEL_ON_DISCONNECT
+    session_id: Optional[str] = None  # спекулятивная генерация из /api/clarify — забрать вместо новой
 
 
 class ChatRequest(BaseModel):
@@ -517,96 +408,141 @@ def _build_context(request: GenerateRequest) -> Tuple[str, str]:
     return request.idea, ""
 
 
-async def _run_pipeline(session_id: str, idea_text: str, full_context: str) -> None:
-    """Запускает 4-шаговый пайплайн в фоне. Каждый Groq-вызов — в отдельном потоке."""
-
-    def _set(stage: str, step: int, *, done: bool = False, result: Optional[Dict[str, Any]] = None) -> None:
-        generation_progress[session_id] = {
-            "stage": stage, "step": step, "total": 4,
-            "completed": done, **({"result": result} if result else {}),
-        }
+async def _publish_cached(session_id: str, result: Dict[str, Any]) -> None:
+    """Сессия сразу в состоянии «готово» — SSE отдаст результат первым же событием"""
+    await progress_store.publish(session_id, {
+        "stage": "Готово!", "step": len(PIPELINE_STAGES), "total": len(PIPELINE_STAGES),
+        "stages": {name: "done" for name in PIPELINE_STAGES},
+        "completed": True, "cached": True, "result": result,
+    })
 
-    # Fallback результаты на случай недоступности Groq
-    FALLBACK_ANALYST = {"task": "Автоматизация задачи", "inputs": [], "outputs": [], "integrations": []}
-    FALLBACK_ARCHITECT = {"name": "AI Assistant", "role": "Помощник", "avatar": "🤖", "system_prompt": "Вы полезный ассистент.", "tech_stack": []}
-    FALLBACK_VISUALIZER = {"mermaid_code": "graph LR; A[\"Задача\"] --> B[\"Решение\"];"}
-    FALLBACK_PM = {"project_type": "other", "key_metrics": [], "resources_needed": [], "implementation_plan": [{"day": 1, "task": "Начать работу", "duration": "1 день"}], "risk_status": "normal"}
 
-    try:
-        # Шаг 1: Аналитик
-        _set("Декомпозиция бизнес-задачи...", 1)
-        logger.info("Шаг 1/4: Аналитик...")
-        analyst_result = await asyncio.to_thread(
-            call_groq, PROMPT_ANALYST.format(idea=idea_text, context=full_context),
-            fallback_result=FALLBACK_ANALYST
-        )
+def _generation_mode(requested: Optional[str], plan: Optional[str]) -> str:
+    mode = requested or (GENERATION_MODE_FAST if plan in FAST_MODE_PLANS else GENERATION_MODE_FULL)
+    if mode not in (GENERATION_MODE_FULL, GENERATION_MODE_FAST):
+        raise HTTPException(status_code=400, detail="Неизвестный режим генерации: ожидается full или fast")
+    return mode
 
-        # Шаг 2: Архитектор
-        _set("Проектирование архитектуры...", 2)
-        logger.info("Шаг 2/4: Архитектор...")
-        architect_result = await asyncio.to_thread(
-            call_groq, PROMPT_ARCHITECT.format(
-                task=analyst_result.get("task", "Автоматизация"),
-                integrations=", ".join(analyst_result.get("integrations", [])),
-            ),
-            fallback_result=FALLBACK_ARCHITECT
-        )
 
-        # Шаг 3: Визуализатор
-        _set("Отрисовка схемы...", 3)
-        logger.info("Шаг 3/4: Визуализатор...")
-        visualizer_result = await asyncio.to_thread(
-            call_groq, PROMPT_VISUALIZER.format(
-                task=analyst_result.get("task", "Автоматизация"),
-                inputs=", ".join(analyst_result.get("inputs", [])),
-                outputs=", ".join(analyst_result.get("outputs", [])),
-            ),
-            fallback_result=FALLBACK_VISUALIZER
-        )
+def _fingerprints(idea_text: str, full_context: str, mode: str) -> Tuple[str, List[str]]:
+    """(fingerprint задачи, кандидаты для поиска в кэше) — полный результат подходит и для fast, обратное — нет"""
+    full_fingerprint = make_fingerprint(idea_text, full_context, PIPELINE_VERSION)
+    if mode != GENERATION_MODE_FAST:
+        return full_fingerprint, [full_fingerprint]
+    fast_fingerprint = make_fingerprint(idea_text, full_context, FAST_PIPELINE_VERSION)
+    return fast_fingerprint, [full_fingerprint, fast_fingerprint]
 
-        # Шаг 4: PM
-        _set("Расчёт метрик и плана...", 4)
-        logger.info("Шаг 4/4: PM...")
-        pm_result = await asyncio.to_thread(
-            call_groq, PROMPT_PM.format(task=analyst_result.get("task", "Автоматизация")),
-            fallback_result=FALLBACK_PM
-        )
 
-        # Сборка ответа
-        response_data = {
-            "agent_profile": {
-                "name": architect_result.get("name", "AI Assistant"),
-                "role": architect_result.get("role", "Помощник"),
-                "avatar": architect_result.get("avatar", "🤖"),
-            },
-            "description": analyst_result.get("task", "Автоматизация задачи"),
-            "mermaid_code": visualizer_result.get("mermaid_code", ""),
-            "system_prompt": architect_result.get("system_prompt", ""),
-            "tech_stack": architect_result.get("tech_stack", []),
-            "implementation_plan": [
-                {"day": s.get("day", 0), "task": s.get("task", ""), "duration": s.get("duration", "")}
-                for s in pm_result.get("implementation_plan", [])
-            ],
-            "project_metrics": {
-                "project_type": pm_result.get("project_type", "other"),
-                "key_metrics": pm_result.get("key_metrics", []),
-                "resources_needed": pm_result.get("resources_needed", []),
-            },
-            "risk_status": pm_result.get("risk_status", "normal"),
+async def _cached_generation(
+    idea_text: str, full_context: str, mode: str, username: str,
+) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[str]]:
+    """(результат, scope, fingerprint) из кэша готовых генераций; fingerprint=None — кэш выключен"""
+    if not GENERATION_CACHE_ENABLED or cache_bypass.get():
+        return None, None, None
+    fingerprint, candidates = _fingerprints(idea_text, full_context, mode)
+    try:
+        for candidate in candidates:
+            cached, scope = await asyncio.to_thread(generation_cache.get, candidate, username)
+            if cached is not None:
+                return cached, scope, fingerprint
+    except Exception as e:
+        logger.warning(f"Кэш генераций недоступен (чтение): {e}")
+    return None, None, fingerprint
+
+
+async def _charge_generation(current_user: User, session_id: str) -> None:
+    """Списывает генерацию одним условным инкрементом счётчика; 402, если лимит тарифа исчерпан.
+    id события = session_id — при отмене оно переклассифицируется в generation_cancelled / generation_partial"""
+    limit = PLAN_LIMITS.get(current_user.plan, PLAN_LIMITS["free"])["generations_per_month"]
+    if await asyncio.to_thread(user_db.reserve_generation, current_user.username, limit, event_id=session_id):
+        return
+    usage = await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan)
+    raise HTTPException(
+        status_code=402,
+        detail={
+            "code": "LIMIT_REACHED",
+            "message": f"Вы использовали все {usage['generations_limit']} генерации за этот месяц.",
+            "plan": usage["plan"],
+            "generations_used": usage["generations_used"],
+            "generations_limit": usage["generations_limit"],
         }
+    )
 
-        logger.info(f"Генерация {session_id} завершена.")
-        _set("Готово!", 4, done=True, result=response_data)
 
+async def _start_speculative(request: ClarifyRequest, summary: str, current_user: User) -> Optional[str]:
+    """Запускает генерацию, не дожидаясь /api/generate, — с тем же контекстом, который клиент
+    пришлёт при подтверждении. Генерация не списывается, пока её не заберут (claim)"""
+    import uuid
+    try:
+        mode = _generation_mode(request.mode, current_user.plan)
+        generate_request = GenerateRequest(
+            idea=request.idea,
+            original_idea=request.idea,
+            messages=[
+                DialogMessage(role="user", content=request.idea),
+                DialogMessage(role="assistant", content=summary),
+            ],
+        )
+        idea_text, full_context = _build_context(generate_request)
+        usage = await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan)
+        if not usage["can_generate"]:
+            return None
+        cached, _, _ = await _cached_generation(idea_text, full_context, mode, current_user.username)
+        if cached is not None:
+            return None   # /api/generate отдаст результат из кэша сразу
+        await asyncio.to_thread(scheduler.check_admission, current_user.plan)
+        session_id = str(uuid.uuid4())
+        await asyncio.to_thread(
+            scheduler.submit,
+            session_id, current_user.username, current_user.plan, mode, idea_text, full_context,
+            speculative=True,
+        )
+    except (HTTPException, QueueFullError):
+        return None
     except Exception as e:
-        logger.error(f"Ошибка пайплайна {session_id}: {e}")
-        generation_progress[session_id] = {"stage": str(e), "error": True, "completed": True}
-
-    finally:
-        async def _cleanup() -> None:
-            await asyncio.sleep(300)  # 5 минут
-            generation_progress.pop(session_id, None)
-        asyncio.create_task(_cleanup())
+        logger.warning(f"Не удалось запустить спекулятивную генерацию: {e}")
+        return None
+    logger.info(f"Спекулятивная генерация ({mode}). Session: {session_id}")
+    return session_id
+
+
+async def _claim_speculative(
+    session_id: str, idea_text: str, full_context: str, mode: str,
+    cancel_on_disconnect: bool, current_user: User,
+) -> Optional[Dict[str, Any]]:
+    """Подтверждение спекулятивной генерации; None — забрать нельзя, запускаем обычную"""
+    job = await asyncio.to_thread(user_db.get_job, session_id)
+    if job is None or job["username"] != current_user.username or job["speculative_until"] is None:
+        return None
+    if job["idea_text"] != idea_text or job["full_context"] != full_context or job["mode"] != mode:
+        # Клиент подтверждает другую идею — спекулятивный запуск больше не нужен
+        await asyncio.to_thread(scheduler.cancel, session_id)
+        return None
+
+    # Списываем до claim: после него задача уже обычная и выполнится в любом случае
+    await _charge_generation(current_user, session_id)
+    fingerprint = None
+    if GENERATION_CACHE_ENABLED and not cache_bypass.get():
+        fingerprint, _ = _fingerprints(idea_text, full_context, mode)
+    claimed = await asyncio.to_thread(
+        scheduler.claim, session_id, current_user.plan, fingerprint, cancel_on_disconnect,
+    )
+    if not claimed:
+        await asyncio.to_thread(user_db.refund_generation, session_id)
+        return None
+
+    # Пайплайн мог завершиться до подтверждения — тогда в кэш он ничего не положил
+    job = await asyncio.to_thread(user_db.get_job, session_id)
+    if job["state"] == "complete":
+        await cache_result(job, job["stages"], job["result"])
+    logger.info(f"Спекулятивная генерация подтверждена ({job['state']}). Session: {session_id}")
+    return {
+        "session_id": session_id,
+        "mode": mode,
+        "queue_position": await asyncio.to_thread(scheduler.position, session_id) or 0,
+        "usage": await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan),
+        "speculative": True,
+    }
 
 
 @app.post("/api/generate")
@@ -619,58 +555,316 @@ async def generate_agent(
     Фронтенд подписывается на SSE /api/generate/{session_id}/progress
     и получает прогресс в реальном времени + результат в финальном событии.
     """
-    # ── Проверка лимита ────────────────────────────────────────────────────────
-    usage = user_db.get_usage_info(current_user.username)
-    if not usage["can_generate"]:
-        raise HTTPException(
-            status_code=402,
-            detail={
-                "code": "LIMIT_REACHED",
-                "message": f"Вы использовали все {usage['generations_limit']} генерации за этот месяц.",
-                "plan": usage["plan"],
-                "generations_used": usage["generations_used"],
-                "generations_limit": usage["generations_limit"],
-            }
+    import uuid
+    idea_text, full_context = _build_context(request)
+    mode = _generation_mode(request.mode, current_user.plan)
+    cancel_on_disconnect = (
+        GENERATION_CANCEL_ON_DISCONNECT if request.cancel_on_disconnect is None
+        else request.cancel_on_disconnect
+    )
+
+    # ── Спекулятивный запуск из /api/clarify: уже идёт, осталось списать генерацию ──
+    if request.session_id:
+        claimed = await _claim_speculative(
+            request.session_id, idea_text, full_context, mode, cancel_on_disconnect, current_user,
         )
+        if claimed is not None:
+            return claimed
 
-    import uuid
+    # ── Кэш готовых генераций ──────────────────────────────────────────────────
+    cached, cache_scope, fingerprint = await _cached_generation(
+        idea_text, full_context, mode, current_user.username,
+    )
+
+    # Повторная отправка своей же идеи (refresh, обрыв SSE) уже оплачена — лимит не трогаем
+    if cached is not None and cache_scope == SCOPE_USER:
+        await asyncio.to_thread(user_db.record_generation, current_user.username, event_type="generation_cached")
+        session_id = str(uuid.uuid4())
+        await _publish_cached(session_id, cached)
+        logger.info(f"Генерация из личного кэша. Session: {session_id}")
+        return {
+            "session_id": session_id,
+            "usage": await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan),
+            "mode": mode,
+            "cached": True,
+            "result": cached,
+        }
+
+    # ── Проверка лимита и списание генерации (до результата) ──────────────────
     session_id = str(uuid.uuid4())
-    generation_progress[session_id] = {"stage": "Инициализация...", "step": 0, "total": 4, "completed": False}
+    await _charge_generation(current_user, session_id)
 
-    idea_text, full_context = _build_context(request)
-    logger.info(f"Запуск генерации. Session: {session_id}. Идея: {idea_text[:80]}...")
+    # Очередь новых пайплайнов слишком глубокая — 503, списание возвращаем
+    # (кэшированный результат ниже отдаётся и при переполненной очереди)
+    if cached is None:
+        try:
+            await asyncio.to_thread(scheduler.check_admission, current_user.plan)
+        except QueueFullError:
+            await asyncio.to_thread(user_db.refund_generation, session_id)
+            raise
+
+    # Чужой результат из глобального кэша — для пользователя это новый агент, списываем генерацию
+    if cached is not None:
+        await _publish_cached(session_id, cached)
+        logger.info(f"Генерация из глобального кэша. Session: {session_id}")
+        return {
+            "session_id": session_id,
+            "usage": await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan),
+            "mode": mode,
+            "cached": True,
+            "result": cached,
+        }
+
+    logger.info(f"Запуск генерации ({mode}). Session: {session_id}. Идея: {idea_text[:80]}...")
+
+    # Задача — в очередь generation_jobs: её заберёт исполнитель с учётом тарифа
+    queue_position = await asyncio.to_thread(
+        scheduler.submit,
+        session_id,
+        current_user.username,
+        current_user.plan,
+        mode,
+        idea_text,
+        full_context,
+        fingerprint=fingerprint,
+        cancel_on_disconnect=cancel_on_disconnect,
+    )
+
+    return {
+        "session_id": session_id,
+        "mode": mode,
+        "queue_position": queue_position,
+        "usage": await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan),
+    }
 
-    # Записываем событие генерации сразу (до результата)
-    user_db.record_generation(current_user.username)
 
-    asyncio.create_task(_run_pipeline(session_id, idea_text, full_context))
+@app.post("/api/generate/{session_id}/cancel")
+async def cancel_generation(session_id: str, current_user: User = Depends(get_current_user)):
+    """Отмена генерации: оставшиеся этапы не выполняются, слот исполнителя освобождается,
+    генерация возвращается в лимит: generation_cancelled, если ни один этап ещё не отдал результат,
+    generation_partial — после первого готового раздела"""
+    job = await asyncio.to_thread(user_db.get_job, session_id)
+    if job is None or (job["username"] != current_user.username and current_user.plan != "admin"):
+        raise HTTPException(status_code=404, detail="Генерация не найдена")
 
-    return {"session_id": session_id, "usage": user_db.get_usage_info(current_user.username)}
+    if job["state"] == "cancelled":
+        return {"session_id": session_id, "state": "cancelled"}
+    state = await asyncio.to_thread(scheduler.cancel, session_id)
+    if state in ("complete", "failed"):
+        raise HTTPException(status_code=409, detail="Генерация уже завершена")
+    if state == "cancelled":
+        # Задачу сняли из очереди — исполнитель её не увидит, финальное событие публикуем сами
+        await progress_store.publish(session_id, CANCELLED_PROGRESS)
+    logger.info(f"Отмена генерации {session_id} ({state}) пользователем {current_user.username}")
+    return {"session_id": session_id, "state": state}
+
+
+def _sse(payload: Dict[str, Any], event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id else ""
+    prefix += f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+# Заголовки для SSE: без кэширования и без буферизации в Nginx
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))   # сек, комментарий-пинг для прокси и балансировщиков
+SSE_RETRY_MS = 2000                                         # пауза EventSource перед переподключением
+SSE_MAX_DURATION = 600                                      # 10 минут на одно соединение
+# Как часто SSE-соединение отмечает задачу «подписчик на месте» (для cancel_on_disconnect)
+SSE_SUBSCRIBER_TOUCH = min(10.0, GENERATION_DISCONNECT_GRACE / 3)
+
+
+def _last_event_id(request: Request) -> int:
+    try:
+        return max(0, int(request.headers.get("last-event-id", "0")))
+    except ValueError:
+        return 0
 
 
 @app.get("/api/generate/{session_id}/progress")
-async def get_generation_progress(session_id: str):
-    """SSE — реальный стриминг прогресса + результат в финальном событии"""
+async def get_generation_progress(session_id: str, request: Request):
+    """SSE — прогресс по мере публикации + результат в финальном событии
+
+    Каждый готовый этап дополнительно приходит отдельным событием `stage_result`
+    с разделами AgentResponse, которые он закрывает (description, system_prompt, mermaid_code, план).
+    События прогресса нумеруются версией снимка (`id:`): переподключившийся EventSource
+    присылает Last-Event-ID и получает только то, что пропустил. Раз в SSE_HEARTBEAT секунд
+    без событий отправляется комментарий `: keep-alive`.
+    """
+    async def _job_progress() -> Optional[Dict[str, Any]]:
+        """Прогресс из generation_jobs — задача в очереди или выполняется на другой машине"""
+        try:
+            job = await asyncio.to_thread(user_db.get_job, session_id)
+            if job is None:
+                return None
+            position = None
+            if job["state"] == "queued":
+                position = await asyncio.to_thread(scheduler.position, session_id)
+            return job_progress(job, position)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать задачу {session_id}: {e}")
+            return None
+
+    # Возобновление: разделы из последнего полученного снимка повторно не отправляем
+    version, last_progress = _last_event_id(request), None
+    if version:
+        baseline = await progress_store.get(session_id, version=version)
+        if baseline is not None:
+            last_progress = baseline[1]
+            if last_progress.get("completed") or last_progress.get("error"):
+                # Клиент уже получил финальное событие — 204 останавливает переподключения EventSource
+                return Response(status_code=204)
+            from_store = True
+        else:
+            # Снимка с такой версией нет: история обрезана, хранилище перезапущено или id новее
+            # текущей версии — начинаем с текущего снимка, иначе wait() ждал бы несуществующую версию
+            from_store = await progress_store.get(session_id) is not None
+            version = 0
+    else:
+        from_store = False
+
     async def event_generator():
-        last_step = -1
-        for _ in range(1200):  # 10 минут максимум
-            if session_id in generation_progress:
-                progress = generation_progress[session_id]
-                current_step = progress.get("step", 0)
+        nonlocal version, last_progress, from_store
+        sent_partials = set((last_progress or {}).get("partials", {}))
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        last_sent, last_touch = time.monotonic(), 0.0
+        while time.monotonic() < deadline:
+            if time.monotonic() - last_touch >= SSE_SUBSCRIBER_TOUCH:
+                last_touch = time.monotonic()
+                try:
+                    await asyncio.to_thread(user_db.touch_job_subscriber, session_id)
+                except Exception as e:
+                    logger.warning(f"Не удалось отметить подписчика {session_id}: {e}")
+            # Пока снимков нет — раз в секунду смотрим задачу в БД, потом ждём только публикаций
+            timeout = min(SSE_HEARTBEAT, SSE_SUBSCRIBER_TOUCH) if from_store else 1.0
+            snapshot = await progress_store.wait(session_id, version, timeout=timeout)
+            event_id = None
+            if snapshot is not None:
+                (version, progress), event_id, from_store = snapshot, snapshot[0], True
+            elif not from_store:
+                progress = await _job_progress()
+            else:
+                progress = None
+
+            if progress is None or progress == last_progress:
+                if time.monotonic() - last_sent >= SSE_HEARTBEAT:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+                continue
 
-                # Шлём событие при каждом изменении шага
-                if current_step != last_step or progress.get("completed") or progress.get("error"):
-                    yield f"data: {json.dumps(progress, ensure_ascii=False)}\n\n"
-                    last_step = current_step
+            # Разделы без id: при обрыве посреди снимка они придут повторно, клиент их просто перезапишет
+            for name, section in progress.get("partials", {}).items():
+                if name not in sent_partials:
+                    sent_partials.add(name)
+                    yield _sse({
+                        "stage": name,
+                        "status": progress.get("stages", {}).get(name),
+                        "data": section,
+                    }, event="stage_result")
+            yield _sse({k: v for k, v in progress.items() if k != "partials"}, event_id=event_id)
+            last_progress, last_sent = progress, time.monotonic()
+
+            if progress.get("completed") or progress.get("error"):
+                return
+
+        if last_progress is None:
+            yield _sse({"stage": "Превышено время ожидания", "error": True})
+        # Генерация ещё идёт — закрываем соединение, EventSource продолжит с Last-Event-ID
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def _history_dicts(history: List[DialogMessage]) -> List[Dict[str, str]]:
+    return [{"role": m.role, "content": m.content} for m in history]
+
+
+def _build_chat_prompt(
+    dashboard: Dict[str, Any],
+    history: List[Dict[str, str]],
+    message: str,
+    current_step: Optional[str],
+    summary_state: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Промпт чата: история — конспект + последние сообщения в пределах бюджета токенов"""
+    return PROMPT_CHAT_ASSISTANT.format(
+        agent_name=dashboard["agent_profile"]["name"],
+        agent_role=dashboard["agent_profile"]["role"],
+        description=dashboard["description"],
+        tech_stack=", ".join(dashboard["tech_stack"]),
+        current_step=current_step or "не указан",
+        conversation_history=format_history(history, summary_state),
+        message=message,
+    )
 
-                if progress.get("completed") or progress.get("error"):
-                    return
 
-            await asyncio.sleep(0.2)
+def _schedule_compaction(
+    messages: List[Dict[str, str]], state: Optional[Dict[str, Any]], save: Callable[[Dict[str, Any]], None],
+) -> None:
+    """Обновление конспекта переписки в фоне — уже после ответа, не задерживая чат"""
+    async def _run():
+        new_state = await compact(messages, state)
+        if new_state:
+            try:
+                await asyncio.to_thread(save, new_state)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить конспект чата: {e}")
+    asyncio.create_task(_run())
+
+
+async def _prepare_assistant_chat(request: ChatRequest, username: str):
+    """Промпт для /api/chat и колбэк, который после ответа обновит конспект переписки"""
+    dashboard = request.dashboard_context.model_dump()
+    history = _history_dicts(request.conversation_history or [])
+    key = conversation_key(username, dashboard)
+    try:
+        state = await asyncio.to_thread(chat_summaries.get, key)
+    except Exception as e:
+        logger.warning(f"Конспекты чата недоступны: {e}")
+        state = None
+
+    def after_response(response_text: str) -> None:
+        messages = history + [
+            {"role": "user", "content": request.message},
+            {"role": "assistant", "content": response_text},
+        ]
+        _schedule_compaction(messages, state, lambda new_state: chat_summaries.set(key, new_state))
 
-        yield f"data: {json.dumps({'stage': 'Превышено время ожидания', 'error': True})}\n\n"
+    prompt = _build_chat_prompt(dashboard, history, request.message, request.current_step, state)
+    return prompt, after_response
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+async def _stream_chat_events(prompt: str, on_complete=None):
+    """SSE-события чата: token — кусок текста ответа, done — полный ответ + suggested_actions
+
+    on_complete(response_text) вызывается один раз после успешного ответа.
+    """
+    extractor = JsonFieldStream("response")
+    try:
+        async for delta in stream_groq(prompt):
+            text = extractor.feed(delta)
+            if text:
+                yield _sse({"type": "token", "text": text})
+
+        try:
+            result = loads_loose(extractor.raw)
+        except json.JSONDecodeError:
+            result = {}
+        response_text = result.get("response") or "Извините, не могу ответить на этот вопрос."
+        if not extractor.done:
+            # Модель ответила не по формату — отдаём текст целиком одним куском
+            yield _sse({"type": "token", "text": response_text})
+
+        if on_complete:
+            await on_complete(response_text)
+        yield _sse({
+            "type": "done",
+            "response": response_text,
+            "suggested_actions": result.get("suggested_actions", []),
+        })
+    except Exception as e:
+        logger.error(f"Ошибка потокового чата: {e}")
+        yield _sse({"type": "error", "detail": str(e)})
 
 
 @app.post("/api/chat", response_model=ChatResponse)
@@ -683,43 +877,49 @@ async def chat_with_assistant(
     """
     try:
         logger.info(f"Чат: пользователь задаёт вопрос: {request.message[:100]}...")
-        
-        # Формируем историю переписки
-        conversation_history_str = ""
-        if request.conversation_history:
-            for msg in request.conversation_history[-10:]:  # Последние 10 сообщений
-                role = "Пользователь" if msg.role == "user" else "Ассистент"
-                conversation_history_str += f"{role}: {msg.content}\n"
-        
-        if not conversation_history_str:
-            conversation_history_str = "Нет предыдущих сообщений"
-        
-        # Формируем промпт
-        chat_prompt = PROMPT_CHAT_ASSISTANT.format(
-            agent_name=request.dashboard_context.agent_profile.name,
-            agent_role=request.dashboard_context.agent_profile.role,
-            description=request.dashboard_context.description,
-            tech_stack=", ".join(request.dashboard_context.tech_stack),
-            current_step=request.current_step or "не указан",
-            conversation_history=conversation_history_str,
-            message=request.message
-        )
-        
-        result = call_groq(chat_prompt)
+        await asyncio.to_thread(user_db.record_chat)
+
+        chat_prompt, after_response = await _prepare_assistant_chat(request, current_user.username)
+
+        result = await call_groq(chat_prompt)
         
         response_data = {
             "response": result.get("response", "Извините, не могу ответить на этот вопрос."),
             "suggested_actions": result.get("suggested_actions", [])
         }
+        after_response(response_data["response"])
         
         logger.info("Чат: ответ сформирован")
         return response_data
         
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка чата: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/chat/stream")
+async def chat_with_assistant_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Чат-помощник с потоковым ответом (SSE): token-события, затем done с suggested_actions"""
+    _ensure_llm_available()
+    logger.info(f"Чат (стрим): пользователь задаёт вопрос: {request.message[:100]}...")
+    await asyncio.to_thread(user_db.record_chat)
+    chat_prompt, after_response = await _prepare_assistant_chat(request, current_user.username)
+
+    async def _on_complete(response_text: str) -> None:
+        after_response(response_text)
+
+    return StreamingResponse(
+        _stream_chat_events(chat_prompt, on_complete=_on_complete),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 # ── Agent Storage ──────────────────────────────────────────────────────────────
 
 class SaveAgentRequest(BaseModel):
@@ -741,23 +941,12 @@ async def save_agent(
     current_user: User = Depends(get_current_user),
 ):
     """Сохраняет сгенерированного агента в БД"""
-    # Проверка лимита на количество агентов
-    usage = user_db.get_usage_info(current_user.username)
-    if not usage["can_save_agent"]:
-        raise HTTPException(
-            status_code=402,
-            detail={
-                "code": "AGENT_LIMIT_REACHED",
-                "message": f"Вы достигли лимита на {usage['agents_limit']} агентов. Удалите старые или обновите тариф.",
-                "plan": usage["plan"],
-                "agents_count": usage["agents_count"],
-                "agents_limit": usage["agents_limit"],
-            }
-        )
-    
     import uuid
     agent_id = str(uuid.uuid4())
-    user_db.save_agent(
+    # Проверка лимита на количество агентов — условным инкрементом вместе с сохранением
+    max_agents = PLAN_LIMITS.get(current_user.plan, PLAN_LIMITS["free"])["max_agents"]
+    saved = await asyncio.to_thread(
+        user_db.save_agent,
         agent_id=agent_id,
         username=current_user.username,
         name=request.agent_data.agent_profile.name,
@@ -765,7 +954,20 @@ async def save_agent(
         avatar=request.agent_data.agent_profile.avatar,
         idea=request.idea,
         full_response=request.agent_data.model_dump(),
+        max_agents=max_agents,
     )
+    usage = await asyncio.to_thread(user_db.get_usage_info, current_user.username, current_user.plan)
+    if saved is None:
+        raise HTTPException(
+            status_code=402,
+            detail={
+                "code": "AGENT_LIMIT_REACHED",
+                "message": f"Вы достигли лимита на {usage['agents_limit']} агентов. Удалите старые или обновите тариф.",
+                "plan": usage["plan"],
+                "agents_count": usage["agents_count"],
+                "agents_limit": usage["agents_limit"],
+            }
+        )
     logger.info(f"Агент сохранён: {agent_id} для {current_user.username}")
     return {"id": agent_id, "usage": usage}
 
@@ -773,13 +975,13 @@ async def save_agent(
 @app.get("/api/agents")
 async def list_agents(current_user: User = Depends(get_current_user)):
     """Список агентов текущего пользователя"""
-    return user_db.get_user_agents(current_user.username)
+    return await asyncio.to_thread(user_db.get_user_agents, current_user.username)
 
 
 @app.get("/api/agents/{agent_id}")
 async def get_agent(agent_id: str, current_user: User = Depends(get_current_user)):
     """Получение конкретного агента"""
-    agent = user_db.get_agent(agent_id, current_user.username)
+    agent = await asyncio.to_thread(user_db.get_agent, agent_id, current_user.username)
     if not agent:
         raise HTTPException(status_code=404, detail="Агент не найден")
     return agent
@@ -788,12 +990,40 @@ async def get_agent(agent_id: str, current_user: User = Depends(get_current_user
 @app.delete("/api/agents/{agent_id}")
 async def delete_agent(agent_id: str, current_user: User = Depends(get_current_user)):
     """Удаление агента"""
-    success = user_db.delete_agent(agent_id, current_user.username)
+    success = await asyncio.to_thread(user_db.delete_agent, agent_id, current_user.username)
     if not success:
         raise HTTPException(status_code=404, detail="Агент не найден")
     return {"success": True}
 
 
+def _agent_chat_history(agent: Dict[str, Any], request: AgentChatRequest) -> List[Dict[str, str]]:
+    """Берём историю из запроса или из БД"""
+    if request.conversation_history:
+        return _history_dicts(request.conversation_history)
+    return [{"role": m["role"], "content": m["content"]} for m in agent["chat_history"]]
+
+
+def _save_agent_chat(
+    agent_id: str, username: str, history: List[Dict[str, str]], message: str, response_text: str,
+) -> List[Dict[str, str]]:
+    """Сохраняем обновлённую историю в БД"""
+    new_history = history + [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": response_text},
+    ]
+    user_db.update_chat_history(agent_id, username, new_history)
+    return new_history
+
+
+def _compact_agent_chat(agent: Dict[str, Any], username: str, new_history: List[Dict[str, str]]) -> None:
+    """Ранние сообщения сжимаются в конспект агента (хранится рядом с историей)"""
+    _schedule_compaction(
+        new_history,
+        agent.get("chat_summary"),
+        lambda state: user_db.update_chat_summary(agent["id"], username, state),
+    )
+
+
 @app.post("/api/agents/{agent_id}/chat", response_model=ChatResponse)
 async def chat_with_agent(
     agent_id: str,
@@ -801,50 +1031,65 @@ async def chat_with_agent(
     current_user: User = Depends(get_current_user),
 ):
     """Чат с конкретным агентом — история хранится в БД"""
-    agent = user_db.get_agent(agent_id, current_user.username)
+    agent = await asyncio.to_thread(user_db.get_agent, agent_id, current_user.username)
     if not agent:
         raise HTTPException(status_code=404, detail="Агент не найден")
+    await asyncio.to_thread(user_db.record_chat)
 
-    dashboard_data = agent["full_response"]
+    try:
+        history = _agent_chat_history(agent, request)
+        chat_prompt = _build_chat_prompt(
+            agent["full_response"], history, request.message, request.current_step, agent.get("chat_summary"),
+        )
 
-    # Берём историю из запроса или из БД
-    if request.conversation_history:
-        history = request.conversation_history
-    else:
-        history = [
-            DialogMessage(role=m["role"], content=m["content"])
-            for m in agent["chat_history"]
-        ]
+        result = await call_groq(chat_prompt)
 
-    conversation_history_str = ""
-    for msg in history[-10:]:
-        role = "Пользователь" if msg.role == "user" else "Ассистент"
-        conversation_history_str += f"{role}: {msg.content}\n"
-    if not conversation_history_str:
-        conversation_history_str = "Нет предыдущих сообщений"
-
-    chat_prompt = PROMPT_CHAT_ASSISTANT.format(
-        agent_name=dashboard_data["agent_profile"]["name"],
-        agent_role=dashboard_data["agent_profile"]["role"],
-        description=dashboard_data["description"],
-        tech_stack=", ".join(dashboard_data["tech_stack"]),
-        current_step=request.current_step or "не указан",
-        conversation_history=conversation_history_str,
-        message=request.message,
-    )
+        new_history = await asyncio.to_thread(
+            _save_agent_chat, agent_id, current_user.username, history, request.message, result.get("response", ""),
+        )
+        _compact_agent_chat(agent, current_user.username, new_history)
 
-    result = call_groq(chat_prompt)
+        return {
+            "response": result.get("response", "Извините, не могу ответить на этот вопрос."),
+            "suggested_actions": result.get("suggested_actions", []),
+        }
 
-    # Сохраняем обновлённую историю в БД
-    new_history = [{"role": m.role, "content": m.content} for m in history]
-    new_history.append({"role": "user", "content": request.message})
-    new_history.append({"role": "assistant", "content": result.get("response", "")})
-    user_db.update_chat_history(agent_id, current_user.username, new_history)
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка чата с агентом {agent_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-    return {
-        "response": result.get("response", "Извините, не могу ответить на этот вопрос."),
-        "suggested_actions": result.get("suggested_actions", []),
-    }
+
+@app.post("/api/agents/{agent_id}/chat/stream")
+async def chat_with_agent_stream(
+    agent_id: str,
+    request: AgentChatRequest,
+    current_user: User = Depends(get_current_user),
+):
+    """Чат с агентом с потоковым ответом (SSE) — история пишется в БД один раз, в конце"""
+    _ensure_llm_available()
+    agent = await asyncio.to_thread(user_db.get_agent, agent_id, current_user.username)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Агент не найден")
+    await asyncio.to_thread(user_db.record_chat)
+
+    history = _agent_chat_history(agent, request)
+    chat_prompt = _build_chat_prompt(
+        agent["full_response"], history, request.message, request.current_step, agent.get("chat_summary"),
+    )
+
+    async def _persist(response_text: str) -> None:
+        new_history = await asyncio.to_thread(
+            _save_agent_chat, agent_id, current_user.username, history, request.message, response_text,
+        )
+        _compact_agent_chat(agent, current_user.username, new_history)
+
+    return StreamingResponse(
+        _stream_chat_events(chat_prompt, on_complete=_persist),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
 
 
 # ── Admin endpoints ────────────────────────────────────────────────────────────
@@ -857,14 +1102,176 @@ def _require_admin(current_user: User = Depends(get_current_user)) -> User:
 
 @app.get("/api/admin/stats")
 async def admin_stats(admin: User = Depends(_require_admin)):
-    """Общая статистика платформы"""
-    return user_db.get_admin_stats()
+    """Общая статистика платформы (из дневных агрегатов daily_stats)"""
+    return await asyncio.to_thread(user_db.get_admin_stats)
+
+
+STATS_SERIES_MAX_DAYS = 731
+
+
+@app.get("/api/admin/stats/series")
+async def admin_stats_series(
+    metrics: Optional[str] = None,
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    bucket: str = "day",
+    admin: User = Depends(_require_admin),
+):
+    """Динамика метрик по дням или неделям: ?metrics=generations,chats&from=2026-01-01&to=2026-01-31&bucket=week.
+    По умолчанию — все метрики за последние 30 дней"""
+    names = [m.strip() for m in metrics.split(",") if m.strip()] if metrics else list(DAILY_METRICS)
+    unknown = [m for m in names if m not in DAILY_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные метрики: {', '.join(unknown)}")
+    if bucket not in ("day", "week"):
+        raise HTTPException(status_code=400, detail="bucket: day | week")
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end or (end - start).days >= STATS_SERIES_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Период: from <= to, не больше {STATS_SERIES_MAX_DAYS} дней")
+    series = await asyncio.to_thread(user_db.get_stats_series, names, start, end, bucket)
+    return {"from": start.isoformat(), "to": end.isoformat(), "bucket": bucket, "series": series}
+
+
+@app.get("/api/admin/llm-cache")
+async def admin_llm_cache(admin: User = Depends(_require_admin)):
+    """Статистика кэша ответов LLM и single-flight (общая для всех воркеров)"""
+    stats = await asyncio.to_thread(llm_cache.stats)
+    # Запросы, которые не ушли в Groq благодаря single-flight
+    stats["saved_calls"] = stats.get("coalesced_local", 0) + stats.get("coalesced_remote", 0)
+    return {"enabled": LLM_CACHE_ENABLED, **stats}
+
+
+@app.delete("/api/admin/llm-cache")
+async def admin_llm_cache_clear(admin: User = Depends(_require_admin)):
+    """Очистить кэш ответов LLM"""
+    removed = await asyncio.to_thread(llm_cache.clear)
+    logger.info(f"Admin {admin.username} очистил кэш LLM ({removed} записей)")
+    return {"success": True, "removed": removed}
+
+
+@app.get("/api/admin/llm-rate-limit")
+async def admin_llm_rate_limit(admin: User = Depends(_require_admin)):
+    """Состояние общего лимитера запросов к Groq"""
+    return await asyncio.to_thread(rate_limiter.stats)
+
+
+@app.get("/api/admin/llm-breaker")
+async def admin_llm_breaker(admin: User = Depends(_require_admin)):
+    """Состояние circuit breaker: текущий воркер + последние переходы во всех воркерах"""
+    return {
+        "current": circuit_breaker.stats(),
+        "workers": await asyncio.to_thread(circuit_breaker.all_workers),
+    }
+
+
+@app.get("/api/admin/auth-cache")
+async def admin_auth_cache(admin: User = Depends(_require_admin)):
+    """Кэш токенов get_current_user: попадания/промахи по всем воркерам и по текущему процессу"""
+    return await asyncio.to_thread(auth_cache.stats)
+
+
+@app.get("/api/admin/password-hashing")
+async def admin_password_hashing(admin: User = Depends(_require_admin)):
+    """Пул bcrypt текущего воркера: очередь, отказы, пересчитанные хеши"""
+    return password_hasher.stats()
+
+
+@app.get("/api/admin/json-repair")
+async def admin_json_repair(admin: User = Depends(_require_admin)):
+    """Разбор ответов LLM по этапам: доля починенных локально и итог повторных вызовов «продолжи/исправь»"""
+    return await asyncio.to_thread(repair_stats.stats)
+
+
+@app.get("/api/admin/scheduler")
+async def admin_scheduler(admin: User = Depends(_require_admin)):
+    """Очередь генераций (запущено, в очереди, отказы) и хранилище прогресса"""
+    return {
+        **await asyncio.to_thread(scheduler.stats),
+        "progress_store": await asyncio.to_thread(progress_store.stats),
+    }
+
+
+@app.get("/api/admin/generation-cache")
+async def admin_generation_cache(admin: User = Depends(_require_admin)):
+    """Статистика кэша готовых генераций"""
+    return await asyncio.to_thread(generation_cache.stats)
+
+
+@app.delete("/api/admin/generation-cache")
+async def admin_generation_cache_clear(
+    username: Optional[str] = None,
+    scope: Optional[str] = None,
+    admin: User = Depends(_require_admin),
+):
+    """Сбросить кэш генераций: весь, только глобальный (?scope=global) или пользователя (?username=...)"""
+    try:
+        removed = await asyncio.to_thread(generation_cache.invalidate, username, scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Admin {admin.username} сбросил кэш генераций ({removed} записей)")
+    return {"success": True, "removed": removed}
+
+
+ADMIN_USERS_SORTS = {"created_at", "username", "generations", "agents"}
+ADMIN_USERS_MAX_LIMIT = 200
+
+
+def _encode_cursor(cursor: Optional[Dict[str, Any]]) -> Optional[str]:
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not cursor:
+        return None
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(decoded, dict) or "value" not in decoded or "username" not in decoded:
+            raise ValueError
+        return decoded
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
 
 
 @app.get("/api/admin/users")
-async def admin_users(admin: User = Depends(_require_admin)):
-    """Список всех пользователей"""
-    return user_db.get_all_users()
+async def admin_users(
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "desc",
+    plan: Optional[str] = None,
+    disabled: Optional[bool] = None,
+    search: Optional[str] = None,
+    admin: User = Depends(_require_admin),
+):
+    """Страница пользователей: сортировка (created_at | username | generations | agents),
+    фильтры по тарифу, блокировке и поиску по username/email. Всего по фильтру — X-Total-Count,
+    следующая страница — ?cursor= из X-Next-Cursor (пусто — страниц больше нет)"""
+    if sort not in ADMIN_USERS_SORTS:
+        raise HTTPException(status_code=400, detail=f"Сортировка: {', '.join(sorted(ADMIN_USERS_SORTS))}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order: asc | desc")
+    try:
+        users, next_cursor, total = await asyncio.to_thread(
+            user_db.get_users_page,
+            max(1, min(limit, ADMIN_USERS_MAX_LIMIT)),
+            _decode_cursor(cursor),
+            sort,
+            order == "desc",
+            plan,
+            disabled,
+            search.strip() if search else None,
+        )
+    except (ValueError, TypeError):
+        # Курсор от другой сортировки (значение не того типа)
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = _encode_cursor(next_cursor)
+    return users
 
 
 class AdminUpgradeRequest(BaseModel):
@@ -881,7 +1288,7 @@ async def admin_upgrade(
     allowed = {"free", "starter", "pro", "admin"}
     if request.plan not in allowed:
         raise HTTPException(status_code=400, detail="Недопустимый тариф")
-    user_db.upgrade_plan(request.username, request.plan)
+    await asyncio.to_thread(user_db.upgrade_plan, request.username, request.plan)
     logger.info(f"Admin {admin.username} → пользователь {request.username} перешёл на {request.plan}")
     return {"success": True}
 
@@ -899,7 +1306,7 @@ async def admin_disable(
     """Заблокировать/разблокировать пользователя"""
     if request.username == admin.username:
         raise HTTPException(status_code=400, detail="Нельзя заблокировать себя")
-    user_db.set_user_disabled(request.username, request.disabled)
+    await asyncio.to_thread(user_db.set_user_disabled, request.username, request.disabled)
     return {"success": True}
 
 
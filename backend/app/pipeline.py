@@ -0,0 +1,406 @@
+"""
+Пайплайн генерации агента
+Общий для API (выполнение внутри воркера) и отдельного пула app.worker: модели ответа,
+этапы и их fallback, сборка AgentResponse. Каждый завершённый этап сохраняется,
+поэтому после сбоя задача продолжается с места остановки
+"""
+import re
+import hashlib
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from app.llm import call_groq, call_groq_text, recache
+from app.json_repair import repair_json, repair_stats, JSONRepairError
+from app.prompts import (
+    PROMPT_ANALYST,
+    PROMPT_ARCHITECT,
+    PROMPT_VISUALIZER,
+    PROMPT_PM,
+    PROMPT_FAST,
+    PROMPT_JSON_FIX,
+    PROMPT_JSON_CONTINUE,
+)
+from app.result_cache import generation_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ImplementationStep(BaseModel):
+    day: int
+    task: str
+    duration: str
+
+
+class KeyMetric(BaseModel):
+    label: str       # "Ориентировочная стоимость"
+    value: str       # "300,000 - 800,000"
+    unit: str        # "₽" или "часов" или "шт"
+
+class ResourceGroup(BaseModel):
+    category: str       # "Запчасти", "Инструменты", "Специалисты"
+    items: List[str]    # Список конкретных позиций
+
+class ProjectMetrics(BaseModel):
+    project_type: str               # "technical", "business", "research", "other"
+    key_metrics: List[KeyMetric]    # Контекстные KPI
+    resources_needed: List[ResourceGroup]  # Что понадобится
+
+class AgentProfile(BaseModel):
+    name: str
+    role: str
+    avatar: str
+
+
+class AgentResponse(BaseModel):
+    agent_profile: AgentProfile
+    description: str
+    mermaid_code: str
+    system_prompt: str
+    tech_stack: List[str]
+    implementation_plan: List[ImplementationStep]
+    project_metrics: ProjectMetrics
+    risk_status: str
+
+
+
+# Версия пайплайна для кэша генераций — меняется вместе с промптами
+PIPELINE_VERSION = hashlib.sha256(
+    "".join([PROMPT_ANALYST, PROMPT_ARCHITECT, PROMPT_VISUALIZER, PROMPT_PM]).encode("utf-8")
+).hexdigest()[:16]
+FAST_PIPELINE_VERSION = hashlib.sha256(PROMPT_FAST.encode("utf-8")).hexdigest()[:16]
+
+# Режимы генерации: full — цепочка из 4 вызовов, fast — весь ответ одним вызовом (проще результат)
+GENERATION_MODE_FULL = "full"
+GENERATION_MODE_FAST = "fast"
+
+
+# Этапы пайплайна: аналитик — последовательно, остальные — параллельно
+PIPELINE_STAGES = ("analyst", "architect", "visualizer", "pm")
+STAGE_LABELS = {
+    "analyst": "Декомпозиция бизнес-задачи...",
+    "architect": "Проектирование архитектуры...",
+    "visualizer": "Отрисовка схемы...",
+    "pm": "Расчёт метрик и плана...",
+}
+
+
+# Разделы AgentResponse, которые закрывает каждый этап — отдаются в SSE сразу по готовности
+def _analyst_section(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {"description": r.get("task", "Автоматизация задачи")}
+
+
+def _architect_section(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "agent_profile": {
+            "name": r.get("name", "AI Assistant"),
+            "role": r.get("role", "Помощник"),
+            "avatar": r.get("avatar", "🤖"),
+        },
+        "system_prompt": r.get("system_prompt", ""),
+        "tech_stack": r.get("tech_stack", []),
+    }
+
+
+def _visualizer_section(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {"mermaid_code": r.get("mermaid_code", "")}
+
+
+def _pm_section(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "implementation_plan": [
+            {"day": s.get("day", 0), "task": s.get("task", ""), "duration": s.get("duration", "")}
+            for s in r.get("implementation_plan", [])
+        ],
+        "project_metrics": {
+            "project_type": r.get("project_type", "other"),
+            "key_metrics": r.get("key_metrics", []),
+            "resources_needed": r.get("resources_needed", []),
+        },
+        "risk_status": r.get("risk_status", "normal"),
+    }
+
+
+STAGE_SECTIONS = {
+    "analyst": _analyst_section,
+    "architect": _architect_section,
+    "visualizer": _visualizer_section,
+    "pm": _pm_section,
+}
+
+# Fallback результаты этапов на случай недоступности Groq
+STAGE_FALLBACKS = {
+    "analyst": {"task": "Автоматизация задачи", "inputs": [], "outputs": [], "integrations": []},
+    "architect": {"name": "AI Assistant", "role": "Помощник", "avatar": "🤖", "system_prompt": "Вы полезный ассистент.", "tech_stack": []},
+    "visualizer": {"mermaid_code": "graph LR; A[\"Задача\"] --> B[\"Решение\"];"},
+    "pm": {"project_type": "other", "key_metrics": [], "resources_needed": [], "implementation_plan": [{"day": 1, "task": "Начать работу", "duration": "1 день"}], "risk_status": "normal"},
+}
+
+# Ключи ответа fast-режима, без которых раздел считается отсутствующим
+STAGE_REQUIRED_KEYS = {
+    "analyst": ("task",),
+    "architect": ("name", "role", "system_prompt"),
+    "visualizer": ("mermaid_code",),
+    "pm": ("project_type", "implementation_plan"),
+}
+
+_FIELD_ADAPTERS = {name: TypeAdapter(field.annotation) for name, field in AgentResponse.model_fields.items()}
+
+
+def _validate_section(stage: str, result: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Раздел этапа, проверенный моделями AgentResponse: (раздел, None) или (None, ошибка)"""
+    missing = [key for key in STAGE_REQUIRED_KEYS[stage] if not result.get(key)]
+    if missing:
+        return None, f"нет обязательных полей: {', '.join(missing)}"
+    try:
+        section = STAGE_SECTIONS[stage](result)
+        return {
+            field: _FIELD_ADAPTERS[field].dump_python(_FIELD_ADAPTERS[field].validate_python(value))
+            for field, value in section.items()
+        }, None
+    except (ValidationError, AttributeError, TypeError) as e:
+        return None, str(e)
+
+
+def _fast_section(stage: str, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Раздел этапа из ответа fast-режима; None — нужен fallback"""
+    section, error = _validate_section(stage, result)
+    if error:
+        logger.warning(f"Fast-режим: раздел {stage} не прошёл валидацию: {error}")
+    return section
+
+
+def _join_continuation(content: str, tail: str) -> Dict[str, Any]:
+    """Обрезанный ответ + продолжение; если модель начала объект заново — берём только его"""
+    candidates = [content + tail]
+    if re.match(r"\s*(```(json)?)?\s*\{", tail):
+        candidates.insert(0, tail)
+    for candidate in candidates:
+        try:
+            return repair_json(candidate)[0]
+        except JSONRepairError:
+            continue
+    raise JSONRepairError("Продолжение не склеилось с началом ответа", content + tail)
+
+
+async def call_stage(
+    stage: str, prompt: str, validate: Callable[[Dict[str, Any]], Optional[str]], partial_ok: bool = False,
+) -> Dict[str, Any]:
+    """Вызов этапа: битый JSON чинится локально (call_groq), результат проверяется схемой этапа.
+    Новый вызов LLM — только если это не помогло, и один: «продолжи» для обрезанного ответа,
+    «исправь» для остальных. При неудаче — исключение (этап уйдёт в fallback), а с partial_ok —
+    первый ответ как есть, если он хотя бы разобрался (fast-режим заменит только негодные разделы)"""
+    try:
+        return await call_groq(prompt, stage=stage, validate=validate)
+    except JSONRepairError as e:
+        error, content, truncated, first = e.msg, e.doc, e.truncated, e.partial
+
+    logger.warning(f"Этап {stage}: {'ответ обрезан' if truncated else error[:200]} — повторный вызов LLM")
+    try:
+        if truncated:
+            tail = await call_groq_text(PROMPT_JSON_CONTINUE.format(content=content, prompt=prompt))
+            result = _join_continuation(content, tail)
+        else:
+            result = await call_groq(PROMPT_JSON_FIX.format(error=error[:500], content=content, prompt=prompt))
+        error = validate(result)
+        if error is not None:
+            raise ValueError(f"ответ после исправления не прошёл проверку: {error[:200]}")
+    except Exception:
+        repair_stats.record(stage, "followup_failed")
+        if partial_ok and first is not None:
+            return first
+        raise
+    repair_stats.record(stage, "followup_ok")
+    # Следующий такой же запрос сразу получит исправленный ответ
+    await recache(prompt, result)
+    return result
+
+
+
+FINISHED = ("done", "fallback")
+
+
+def _step(stages: Dict[str, str]) -> int:
+    return sum(1 for st in stages.values() if st in FINISHED)
+
+
+def _current_label(stages: Dict[str, str]) -> str:
+    running = [STAGE_LABELS[name] for name, st in stages.items() if st == "running"]
+    return " ".join(running) if running else "Сборка результата..."
+
+
+def assemble(partials: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Сборка ответа из разделов в порядке полей AgentResponse"""
+    merged = {k: v for section in partials.values() for k, v in section.items()}
+    return {field: merged[field] for field in AgentResponse.model_fields}
+
+
+async def run_pipeline(
+    job: Dict[str, Any],
+    publish: Callable[[Dict[str, Any]], Awaitable[None]],
+    save_stage: Callable[[Dict[str, str], Dict[str, Any], Dict[str, Any]], Awaitable[None]],
+    finish: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+) -> Dict[str, Any]:
+    """Выполняет задачу генерации: аналитик, затем архитектор, визуализатор и PM параллельно.
+    В fast-режиме все разделы приходят одним вызовом, недостающие заменяются fallback.
+
+    Этапы, уже завершённые в прошлой попытке (job["stages"]), не повторяются.
+    publish(progress) — снимок прогресса для SSE, save_stage(stages, stage_results, partials) —
+    сохранение после каждого этапа, finish(result) — фиксация результата в задаче до того,
+    как он уйдёт подписчикам (отмена после этого уже ничего не меняет). Если задан fingerprint,
+    результат без fallback-этапов кладётся в кэш генераций. Возвращает итоговый AgentResponse (dict).
+    """
+    session_id, mode = job["id"], job.get("mode") or GENERATION_MODE_FULL
+    idea_text, full_context = job["idea_text"], job.get("full_context") or ""
+    saved = job.get("stages") or {}
+    stages = {name: saved[name] if saved.get(name) in FINISHED else "pending" for name in PIPELINE_STAGES}
+    stage_results: Dict[str, Any] = dict(job.get("stage_results") or {})
+    partials: Dict[str, Dict[str, Any]] = {
+        name: section for name, section in (job.get("partials") or {}).items() if stages.get(name) in FINISHED
+    }
+    save_lock = asyncio.Lock()
+
+    async def _set(stage: str, *, done: bool = False, result: Optional[Dict[str, Any]] = None) -> None:
+        await publish({
+            "stage": stage,
+            "step": _step(stages),
+            "total": len(stages),
+            "stages": dict(stages),
+            "partials": dict(partials),
+            "mode": mode,
+            "completed": done, **({"result": result} if result else {}),
+        })
+
+    async def _save() -> None:
+        # Снимок берётся под блокировкой — параллельные этапы не перезапишут друг друга старыми данными
+        async with save_lock:
+            await save_stage(dict(stages), dict(stage_results), dict(partials))
+
+    async def _stage(name: str, prompt: Callable[[], str]) -> Dict[str, Any]:
+        """Один этап: при ошибке — только его fallback, соседние этапы не отменяются"""
+        if stages[name] in FINISHED:
+            return stage_results.get(name) or STAGE_FALLBACKS[name]
+        fallback = STAGE_FALLBACKS[name]
+        stages[name] = "running"
+        await _set(_current_label(stages))
+        logger.info(f"Этап {name}: старт ({session_id})")
+        try:
+            result = await call_stage(name, prompt(), lambda r: _validate_section(name, r)[1])
+        except Exception as e:
+            logger.error(f"Этап {name} ({session_id}) упал, используем fallback: {e}")
+            result = fallback
+        stages[name] = "fallback" if result is fallback else "done"
+        stage_results[name] = result
+        partials[name] = STAGE_SECTIONS[name](result)
+        await _save()
+        await _set(_current_label(stages))
+        return result
+
+    async def _chain() -> None:
+        # Шаг 1: Аналитик — от него зависят все остальные этапы
+        analyst_result = await _stage(
+            "analyst", lambda: PROMPT_ANALYST.format(idea=idea_text, context=full_context),
+        )
+        task = analyst_result.get("task", "Автоматизация")
+
+        # Шаги 2–4: Архитектор, Визуализатор и PM — параллельно
+        await asyncio.gather(
+            _stage("architect", lambda: PROMPT_ARCHITECT.format(
+                task=task,
+                integrations=", ".join(analyst_result.get("integrations", [])),
+            )),
+            _stage("visualizer", lambda: PROMPT_VISUALIZER.format(
+                task=task,
+                inputs=", ".join(analyst_result.get("inputs", [])),
+                outputs=", ".join(analyst_result.get("outputs", [])),
+            )),
+            _stage("pm", lambda: PROMPT_PM.format(task=task)),
+        )
+
+    async def _fast() -> None:
+        """Один вызов на весь ответ, каждый раздел проверяется и при необходимости заменяется fallback"""
+        if all(st in FINISHED for st in stages.values()):
+            return
+        for name in PIPELINE_STAGES:
+            stages[name] = "running"
+        await _set("Генерация агента (быстрый режим)...")
+        try:
+            result = await call_stage(
+                "fast", PROMPT_FAST.format(idea=idea_text, context=full_context),
+                lambda r: "; ".join(
+                    f"{name}: {error}" for name in PIPELINE_STAGES
+                    if (error := _validate_section(name, r)[1])
+                ) or None,
+                partial_ok=True,
+            )
+        except Exception as e:
+            logger.error(f"Fast-генерация {session_id} упала, используем fallback: {e}")
+            result = {}
+        for name in PIPELINE_STAGES:
+            section = _fast_section(name, result)
+            stages[name] = "done" if section is not None else "fallback"
+            partials[name] = section if section is not None else STAGE_SECTIONS[name](STAGE_FALLBACKS[name])
+        await _save()
+        await _set(_current_label(stages))
+
+    if mode == GENERATION_MODE_FAST:
+        await _fast()
+    else:
+        await _chain()
+
+    response_data = assemble(partials)
+    logger.info(f"Генерация {session_id} завершена ({mode}).")
+    if finish is not None:
+        await finish(response_data)
+    await _set("Готово!", done=True, result=response_data)
+    await cache_result(job, stages, response_data)
+    return response_data
+
+
+async def cache_result(job: Dict[str, Any], stages: Dict[str, str], result: Dict[str, Any]) -> None:
+    """Результат без fallback-этапов — в кэш генераций (если у задачи есть fingerprint)"""
+    fingerprint, username = job.get("fingerprint"), job.get("username")
+    if fingerprint and username and all(st == "done" for st in stages.values()):
+        try:
+            await asyncio.to_thread(generation_cache.set, fingerprint, username, result)
+        except Exception as e:
+            logger.warning(f"Кэш генераций недоступен (запись): {e}")
+
+
+# Финальное событие отменённой генерации
+CANCELLED_PROGRESS = {"stage": "Генерация отменена", "cancelled": True, "error": True, "completed": True}
+
+
+def job_progress(job: Dict[str, Any], queue_position: Optional[int] = None) -> Dict[str, Any]:
+    """Прогресс из сохранённой задачи — для SSE, когда пайплайн выполняется в другом процессе"""
+    state = job["state"]
+    if state == "failed":
+        return {"stage": job.get("error") or "Ошибка генерации", "error": True, "completed": True}
+    if state == "cancelled":
+        return dict(CANCELLED_PROGRESS)
+
+    saved = job.get("stages") or {}
+    stages = {name: saved.get(name, "pending") for name in PIPELINE_STAGES}
+    progress = {
+        "step": _step(stages),
+        "total": len(stages),
+        "partials": {name: s for name, s in (job.get("partials") or {}).items() if stages.get(name) in FINISHED},
+        "mode": job.get("mode") or GENERATION_MODE_FULL,
+        "completed": state == "complete",
+    }
+    if state == "complete":
+        return {**progress, "stage": "Готово!", "stages": stages, "result": job.get("result")}
+    if state == "queued" and not any(st in FINISHED for st in stages.values()):
+        label = f"В очереди: {queue_position}-е место..." if queue_position else "Инициализация..."
+        return {**progress, "stage": label, "stages": stages, "queue_position": queue_position}
+
+    # Выполняется: незавершённые этапы, которым уже можно стартовать, считаем запущенными
+    if job.get("mode") == GENERATION_MODE_FAST:
+        ready = [name for name in PIPELINE_STAGES if stages[name] not in FINISHED]
+    elif stages["analyst"] not in FINISHED:
+        ready = ["analyst"]
+    else:
+        ready = [name for name in PIPELINE_STAGES if stages[name] not in FINISHED]
+    for name in ready:
+        stages[name] = "running"
+    return {**progress, "stage": _current_label(stages), "stages": stages}
@@ -0,0 +1,617 @@
+"""
+Хранилище прогресса генераций (снимок прогресса + итоговый результат) с уведомлениями
+memory — словарь внутри процесса (один воркер, разработка);
+sqlite — таблица в локальном SQLite, общая для всех воркеров gunicorn и процессов app.worker
+на одной машине: SSE-запрос может попасть в любой воркер, sticky-маршрутизация не нужна.
+
+Каждая публикация увеличивает версию снимка; wait() ждёт версию новее известной.
+Последние PROGRESS_HISTORY снимков сессии хранятся — по ним SSE продолжает поток с Last-Event-ID.
+В sqlite-режиме один фоновый опрос на процесс (по глобальному номеру изменения)
+будит всех локальных подписчиков — число SSE-клиентов на нагрузку БД не влияет.
+
+Оба бэкенда ограничены PROGRESS_MAX_ENTRIES сессиями и PROGRESS_MAX_BYTES байтами: при
+переполнении давно не читавшиеся завершённые результаты (LRU) выгружаются в таблицу
+progress_spill основной БД, выполняющиеся генерации не вытесняются. Просроченные снимки
+и лишние записи снимает один фоновый уборщик на процесс (start/stop в lifespan)
+"""
+import os
+import json
+import time
+import asyncio
+import heapq
+import sqlite3
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from app.local_store import ensure_schema
+from app.database import user_db
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_STORE = os.getenv("PROGRESS_STORE", "sqlite").lower()           # memory | sqlite
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", "600"))                      # сек с последнего обновления
+PROGRESS_POLL_INTERVAL = float(os.getenv("PROGRESS_POLL_INTERVAL", "0.1"))  # опрос чужих публикаций (sqlite)
+PROGRESS_HISTORY = int(os.getenv("PROGRESS_HISTORY", "16"))               # снимков на сессию для возобновления
+PROGRESS_MAX_ENTRIES = int(os.getenv("PROGRESS_MAX_ENTRIES", "5000"))     # сессий в хранилище
+PROGRESS_MAX_BYTES = int(os.getenv("PROGRESS_MAX_BYTES", str(64 * 1024 * 1024)))
+SWEEP_INTERVAL = float(os.getenv("PROGRESS_SWEEP_INTERVAL", "10"))        # сек между проходами уборщика
+SPILL_LOOKUP_WINDOW = 24 * 3600.0   # сек, в течение которых промах ищется среди выгруженных результатов
+
+Snapshot = Tuple[int, Dict[str, Any]]   # (версия, прогресс)
+SpillFn = Callable[[str, int, Dict[str, Any]], None]
+LoadFn = Callable[[str], Optional[Snapshot]]
+
+
+class ProgressStore:
+    """Интерфейс хранилища: publish / get / wait; подписчики ждут через asyncio.Event"""
+
+    name = "base"
+
+    def __init__(self, ttl: int = PROGRESS_TTL, spill: Optional[SpillFn] = None, load: Optional[LoadFn] = None):
+        self.ttl = ttl
+        self._spill = spill
+        self._load = load
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}   # сколько подписчиков ждёт сессию в этом процессе
+        self._reaper: Optional[asyncio.Task] = None
+        self._counters: Dict[str, int] = {"expired": 0, "evicted": 0, "spilled": 0, "spill_errors": 0, "spill_hits": 0}
+
+    async def publish(self, session_id: str, progress: Dict[str, Any]) -> int:
+        """Сохраняет новый снимок прогресса и будит подписчиков; возвращает его версию"""
+        raise NotImplementedError
+
+    async def get(self, session_id: str, version: Optional[int] = None) -> Optional[Snapshot]:
+        """Последний снимок или снимок указанной версии (если он ещё в истории)"""
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def sweep(self) -> None:
+        """Снимает просроченные снимки и вытесняет лишние (вызывает фоновый уборщик)"""
+
+    async def start(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Не удалось очистить хранилище прогресса: {e}")
+
+    def _spill_all(self, evicted: List[Tuple[str, int, Dict[str, Any]]]) -> List[str]:
+        """Выгружает итоговые результаты в БД (в потоке); возвращает выгруженные сессии"""
+        spilled = []
+        for session_id, version, progress in evicted:
+            if "result" not in progress:
+                continue
+            try:
+                self._spill(session_id, version, progress)
+                self._counters["spilled"] += 1
+                spilled.append(session_id)
+            except Exception as e:
+                self._counters["spill_errors"] += 1
+                logger.warning(f"Не удалось выгрузить результат {session_id} в БД: {e}")
+        return spilled
+
+    async def _get_spilled(self, session_id: str, version: Optional[int]) -> Optional[Snapshot]:
+        if self._load is None:
+            return None
+        try:
+            snapshot = await asyncio.to_thread(self._load, session_id)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать выгруженный результат {session_id}: {e}")
+            return None
+        if snapshot is None or (version is not None and snapshot[0] != version):
+            return None
+        self._counters["spill_hits"] += 1
+        return snapshot
+
+    def _notify(self, session_id: str) -> None:
+        event = self._events.pop(session_id, None)
+        if event is not None:
+            event.set()
+
+    def _release(self, session_id: str) -> None:
+        self._waiters[session_id] -= 1
+        if not self._waiters[session_id]:
+            del self._waiters[session_id]
+            self._events.pop(session_id, None)
+
+    async def _subscribe(self, session_id: str) -> None:
+        """Хук для бэкендов, которым нужно следить за чужими публикациями"""
+
+    async def wait(self, session_id: str, after_version: int = 0, timeout: float = 15.0) -> Optional[Snapshot]:
+        """Снимок с версией больше after_version или None, если за timeout ничего не изменилось"""
+        deadline = time.monotonic() + timeout
+        self._waiters[session_id] = self._waiters.get(session_id, 0) + 1
+        try:
+            await self._subscribe(session_id)
+            while True:
+                # Событие берётся до чтения — публикация между чтением и ожиданием не потеряется
+                event = self._events.setdefault(session_id, asyncio.Event())
+                snapshot = await self.get(session_id)
+                if snapshot is not None and snapshot[0] > after_version:
+                    return snapshot
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+        finally:
+            self._release(session_id)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "ttl_seconds": self.ttl,
+            "subscribed_sessions": len(self._waiters),
+            "reaper_running": self._reaper is not None and not self._reaper.done(),
+        }
+
+
+def _finished(progress: Dict[str, Any]) -> bool:
+    return bool(progress.get("completed") or progress.get("error"))
+
+
+class _Entry:
+    __slots__ = ("version", "progress", "expires_at", "size", "history")
+
+    def __init__(self, version: int, progress: Dict[str, Any], expires_at: float, history: Deque[Tuple[int, Dict[str, Any], int]]):
+        self.version = version
+        self.progress = progress
+        self.expires_at = expires_at
+        self.history = history   # (версия, прогресс, размер) — для возобновления SSE
+        self.size = sum(item[2] for item in history)
+
+
+class MemoryProgressStore(ProgressStore):
+    """Снимки в памяти процесса — подходит только для одного воркера
+
+    Объём ограничен числом сессий и байтами (оценка по размеру JSON). Просроченные записи
+    уборщик снимает с очереди с приоритетом по времени истечения, при переполнении вытесняются
+    давно не читавшиеся завершённые результаты (LRU). В БД за ними ходим только для сессий,
+    которые этот процесс сам выгрузил, — промах по неизвестной сессии остаётся в памяти.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        ttl: int = PROGRESS_TTL,
+        max_entries: int = PROGRESS_MAX_ENTRIES,
+        max_bytes: int = PROGRESS_MAX_BYTES,
+        spill: Optional[SpillFn] = None,
+        load: Optional[LoadFn] = None,
+    ):
+        super().__init__(ttl, spill, load)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()   # LRU: последние прочитанные — в конце
+        self._expiry: List[Tuple[float, str]] = []                  # heap (истекает, сессия)
+        self._spilled: "OrderedDict[str, float]" = OrderedDict()    # выгруженные сессии → время выгрузки
+        self._bytes = 0
+
+    def _drop(self, session_id: str) -> Optional[_Entry]:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _reap(self, now: float) -> None:
+        """Снимает просроченные записи с вершины heap; устаревшие элементы heap пропускаются"""
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self._expiry)
+            entry = self._entries.get(session_id)
+            if entry is not None and entry.expires_at == expires_at:
+                self._drop(session_id)
+                self._counters["expired"] += 1
+        # Каждая публикация добавляет элемент — пересобираем heap, когда устаревших слишком много
+        if len(self._expiry) > 4 * len(self._entries) + 64:
+            self._expiry = [(entry.expires_at, sid) for sid, entry in self._entries.items()]
+            heapq.heapify(self._expiry)
+        while self._spilled and next(iter(self._spilled.values())) < now - SPILL_LOOKUP_WINDOW:
+            self._spilled.popitem(last=False)
+
+    def _evict(self, keep: str) -> List[Tuple[str, int, Dict[str, Any]]]:
+        """Вытесняет давно не читавшиеся завершённые результаты, пока не уложимся в лимиты"""
+        evicted = []
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            victim = next(
+                (sid for sid, entry in self._entries.items() if sid != keep and _finished(entry.progress)),
+                None,
+            )
+            if victim is None:
+                break
+            entry = self._drop(victim)
+            evicted.append((victim, entry.version, entry.progress))
+            self._counters["evicted"] += 1
+        return evicted
+
+    async def _spill_evicted(self, evicted: List[Tuple[str, int, Dict[str, Any]]]) -> None:
+        if not evicted or self._spill is None:
+            return
+        spilled = await asyncio.to_thread(self._spill_all, evicted)
+        now = time.time()
+        for session_id in spilled:
+            self._spilled[session_id] = now
+            self._spilled.move_to_end(session_id)
+        # Индекс выгруженных — только идентификаторы, но тоже ограничен
+        while len(self._spilled) > self.max_entries:
+            self._spilled.popitem(last=False)
+
+    async def publish(self, session_id: str, progress: Dict[str, Any]) -> int:
+        now = time.time()
+        size = len(json.dumps(progress, ensure_ascii=False).encode("utf-8"))
+        entry = self._drop(session_id)
+        version = entry.version + 1 if entry else 1
+        history = entry.history if entry else deque(maxlen=PROGRESS_HISTORY)
+        if _finished(progress):
+            # Для возобновления после финала достаточно финального снимка
+            history.clear()
+        history.append((version, progress, size))
+        entry = _Entry(version, progress, now + self.ttl, history)
+        self._entries[session_id] = entry
+        self._bytes += entry.size
+        heapq.heappush(self._expiry, (entry.expires_at, session_id))
+
+        evicted = self._evict(keep=session_id)
+        self._notify(session_id)
+        await self._spill_evicted(evicted)
+        return version
+
+    async def get(self, session_id: str, version: Optional[int] = None) -> Optional[Snapshot]:
+        entry = self._entries.get(session_id)
+        if entry is not None and entry.expires_at <= time.time():
+            # Уборщик ещё не дошёл — просроченный снимок не отдаём
+            entry = None
+        if entry is None:
+            if session_id not in self._spilled:
+                return None
+            return await self._get_spilled(session_id, version)
+        self._entries.move_to_end(session_id)
+        if version is None:
+            return entry.version, entry.progress
+        return next(((v, progress) for v, progress, _ in entry.history if v == version), None)
+
+    async def delete(self, session_id: str) -> None:
+        self._drop(session_id)
+        self._spilled.pop(session_id, None)
+
+    async def sweep(self) -> None:
+        self._reap(time.time())
+        await self._spill_evicted(self._evict(keep=""))
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "sessions": len(self._entries),
+            "size_bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "spilled_sessions": len(self._spilled),
+            **self._counters,
+        }
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS generation_progress (
+        session_id TEXT PRIMARY KEY,
+        version    INTEGER NOT NULL,
+        seq        INTEGER NOT NULL,
+        data       TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_generation_progress_seq ON generation_progress(seq)",
+    "CREATE INDEX IF NOT EXISTS idx_generation_progress_expires ON generation_progress(expires_at)",
+    """CREATE TABLE IF NOT EXISTS generation_progress_history (
+        session_id TEXT NOT NULL,
+        version    INTEGER NOT NULL,
+        data       TEXT NOT NULL,
+        PRIMARY KEY (session_id, version)
+    )""",
+    # Глобальный номер изменения — по нему каждый процесс находит чужие публикации одним запросом
+    """CREATE TABLE IF NOT EXISTS generation_progress_seq (
+        id    INTEGER PRIMARY KEY CHECK (id = 1),
+        value INTEGER NOT NULL
+    )""",
+    "INSERT OR IGNORE INTO generation_progress_seq (id, value) VALUES (1, 0)",
+    # Сессии, чьи результаты вытеснены в progress_spill: за остальными промахами в БД не ходим
+    """CREATE TABLE IF NOT EXISTS generation_progress_evicted (
+        session_id TEXT PRIMARY KEY,
+        evicted_at REAL NOT NULL
+    )""",
+]
+
+# Колонки для лимитов и LRU, добавленные к уже существующей таблице
+_COLUMNS = {
+    "size": "INTEGER NOT NULL DEFAULT 0",          # байт в снимке и истории сессии
+    "finished": "INTEGER NOT NULL DEFAULT 0",
+    "last_access": "REAL NOT NULL DEFAULT 0",
+}
+
+
+class SQLiteProgressStore(ProgressStore):
+    """Снимки в локальном SQLite — общие для всех процессов на машине"""
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        ttl: int = PROGRESS_TTL,
+        poll_interval: float = PROGRESS_POLL_INTERVAL,
+        max_entries: int = PROGRESS_MAX_ENTRIES,
+        max_bytes: int = PROGRESS_MAX_BYTES,
+        spill: Optional[SpillFn] = None,
+        load: Optional[LoadFn] = None,
+    ):
+        super().__init__(ttl, spill, load)
+        self.poll_interval = poll_interval
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._migrated = False
+        self._watcher: Optional[asyncio.Task] = None
+        self._counters.update({"published": 0, "remote_notifications": 0})
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = ensure_schema("progress_store", _SCHEMA)
+        if not self._migrated:
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(generation_progress)")}
+            for column, ddl in _COLUMNS.items():
+                if column in existing:
+                    continue
+                try:
+                    conn.execute(f"ALTER TABLE generation_progress ADD COLUMN {column} {ddl}")
+                except sqlite3.OperationalError as e:
+                    # Колонку только что добавил другой процесс
+                    if "duplicate column" not in str(e):
+                        raise
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_generation_progress_access "
+                "ON generation_progress(finished, last_access)"
+            )
+            self._migrated = True
+        return conn
+
+    def _publish(self, session_id: str, payload: str, finished: bool) -> int:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE generation_progress_seq SET value = value + 1 WHERE id = 1")
+            seq = conn.execute("SELECT value FROM generation_progress_seq WHERE id = 1").fetchone()[0]
+            conn.execute(
+                "INSERT INTO generation_progress (session_id, version, seq, data, expires_at, finished, last_access) "
+                "VALUES (?, 1, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET version = version + 1, seq = excluded.seq, "
+                "data = excluded.data, expires_at = excluded.expires_at, finished = excluded.finished, "
+                "last_access = excluded.last_access",
+                (session_id, seq, payload, now + self.ttl, int(finished), now),
+            )
+            version = conn.execute(
+                "SELECT version FROM generation_progress WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO generation_progress_history (session_id, version, data) VALUES (?, ?, ?)",
+                (session_id, version, payload),
+            )
+            # После финала для возобновления достаточно финального снимка
+            conn.execute(
+                "DELETE FROM generation_progress_history WHERE session_id = ? AND version <= ?",
+                (session_id, version - 1 if finished else version - PROGRESS_HISTORY),
+            )
+            conn.execute(
+                "UPDATE generation_progress SET size = (SELECT COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0) "
+                "FROM generation_progress_history WHERE session_id = ?) WHERE session_id = ?",
+                (session_id, session_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def _get(self, session_id: str, version: Optional[int]) -> Tuple[Optional[Snapshot], bool]:
+        """(снимок или None, выгружен ли результат сессии в БД)"""
+        conn = self._conn()
+        now = time.time()
+        if version is None:
+            row = conn.execute(
+                "SELECT version, data FROM generation_progress WHERE session_id = ? AND expires_at >= ?",
+                (session_id, now),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT h.version, h.data FROM generation_progress_history h "
+                "JOIN generation_progress p ON p.session_id = h.session_id "
+                "WHERE h.session_id = ? AND h.version = ? AND p.expires_at >= ?",
+                (session_id, version, now),
+            ).fetchone()
+        if row:
+            # Не чаще раза в секунду — частые опросы одной сессии не превращаются в поток записей
+            conn.execute(
+                "UPDATE generation_progress SET last_access = ? WHERE session_id = ? AND last_access < ?",
+                (now, session_id, now - 1),
+            )
+            return (row[0], json.loads(row[1])), False
+        evicted = conn.execute(
+            "SELECT 1 FROM generation_progress_evicted WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return None, evicted is not None
+
+    def _current_seq(self) -> int:
+        return self._conn().execute("SELECT value FROM generation_progress_seq WHERE id = 1").fetchone()[0]
+
+    def _changed_since(self, seq: int) -> list:
+        return self._conn().execute(
+            "SELECT session_id, seq FROM generation_progress WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+    async def publish(self, session_id: str, progress: Dict[str, Any]) -> int:
+        payload = json.dumps(progress, ensure_ascii=False)
+        version = await asyncio.to_thread(self._publish, session_id, payload, _finished(progress))
+        self._counters["published"] += 1
+        self._notify(session_id)
+        return version
+
+    async def get(self, session_id: str, version: Optional[int] = None) -> Optional[Snapshot]:
+        snapshot, evicted = await asyncio.to_thread(self._get, session_id, version)
+        if snapshot is None and evicted:
+            return await self._get_spilled(session_id, version)
+        return snapshot
+
+    def _delete(self, session_id: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM generation_progress WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM generation_progress_history WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM generation_progress_evicted WHERE session_id = ?", (session_id,))
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._delete, session_id)
+
+    def _select_victims(self) -> List[Tuple[str, int, Dict[str, Any]]]:
+        """Снимает просроченные снимки; при переполнении выбирает давно не читавшиеся завершённые"""
+        conn = self._conn()
+        now = time.time()
+        expired = conn.execute("DELETE FROM generation_progress WHERE expires_at < ?", (now,)).rowcount
+        self._counters["expired"] += expired
+        conn.execute(
+            "DELETE FROM generation_progress_history WHERE session_id NOT IN "
+            "(SELECT session_id FROM generation_progress)"
+        )
+        conn.execute("DELETE FROM generation_progress_evicted WHERE evicted_at < ?", (now - SPILL_LOOKUP_WINDOW,))
+
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_progress"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return []
+        # Вытесняем с запасом 10%, чтобы не чистить на каждом проходе
+        excess_entries = count - int(self.max_entries * 0.9)
+        excess_bytes = total - int(self.max_bytes * 0.9)
+        victims = []
+        for session_id, size in conn.execute(
+            "SELECT session_id, size FROM generation_progress WHERE finished = 1 ORDER BY last_access"
+        ).fetchall():
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            victims.append(session_id)
+            excess_entries -= 1
+            excess_bytes -= size
+        result = []
+        for session_id in victims:
+            row = conn.execute(
+                "SELECT version, data FROM generation_progress WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row:
+                result.append((session_id, row[0], json.loads(row[1])))
+        return result
+
+    def _drop_victims(self, victims: List[Tuple[str, int, Dict[str, Any]]], spilled: List[str]) -> None:
+        """Удаляет вытесненные сессии, если с момента выбора в них ничего не публиковали"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for session_id, version, _ in victims:
+                dropped = conn.execute(
+                    "DELETE FROM generation_progress WHERE session_id = ? AND version = ?", (session_id, version)
+                ).rowcount
+                if dropped:
+                    conn.execute("DELETE FROM generation_progress_history WHERE session_id = ?", (session_id,))
+                    self._counters["evicted"] += 1
+            conn.executemany(
+                "INSERT OR REPLACE INTO generation_progress_evicted (session_id, evicted_at) VALUES (?, ?)",
+                [(session_id, now) for session_id in spilled],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _sweep(self) -> None:
+        victims = self._select_victims()
+        if not victims:
+            return
+        # Сначала выгрузка, потом удаление — читатель не застанет результат ни там, ни там
+        spilled = self._spill_all(victims) if self._spill is not None else []
+        self._drop_victims(victims, spilled)
+
+    async def sweep(self) -> None:
+        await asyncio.to_thread(self._sweep)
+
+    async def _subscribe(self, session_id: str) -> None:
+        if self._watcher is None or self._watcher.done():
+            seq = await asyncio.to_thread(self._current_seq)
+            self._watcher = asyncio.create_task(self._watch(seq))
+
+    async def _watch(self, seq: int) -> None:
+        """Один опрос на процесс: будит подписчиков, чьи сессии обновил другой процесс"""
+        while self._waiters:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                changed = await asyncio.to_thread(self._changed_since, seq)
+            except Exception as e:
+                logger.warning(f"Хранилище прогресса недоступно: {e}")
+                continue
+            for session_id, changed_seq in changed:
+                seq = max(seq, changed_seq)
+                if session_id in self._waiters:
+                    self._counters["remote_notifications"] += 1
+                    self._notify(session_id)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        sessions, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_progress WHERE expires_at >= ?",
+            (time.time(),),
+        ).fetchone()
+        history = conn.execute("SELECT COUNT(*) FROM generation_progress_history").fetchone()[0]
+        spilled = conn.execute("SELECT COUNT(*) FROM generation_progress_evicted").fetchone()[0]
+        return {
+            **super().stats(),
+            "sessions": sessions,
+            "size_bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "history_snapshots": history,
+            "spilled_sessions": spilled,
+            **self._counters,
+        }
+
+
+def _memory_store() -> ProgressStore:
+    # Вытесненные результаты — в таблицу progress_spill основной БД
+    return MemoryProgressStore(spill=user_db.spill_progress, load=user_db.load_spilled_progress)
+
+
+def _sqlite_store() -> ProgressStore:
+    return SQLiteProgressStore(spill=user_db.spill_progress, load=user_db.load_spilled_progress)
+
+
+STORES: Dict[str, Callable[[], ProgressStore]] = {
+    "memory": _memory_store,
+    "sqlite": _sqlite_store,
+}
+
+
+def create_progress_store(name: Optional[str] = None) -> ProgressStore:
+    name = (name or PROGRESS_STORE).lower()
+    if name not in STORES:
+        raise ValueError(f"Неизвестный PROGRESS_STORE: {name} (доступны: {', '.join(STORES)})")
+    return STORES[name]()
+
+
+# Глобальный экземпляр (один на процесс)
+progress_store = create_progress_store()
@@ -0,0 +1,256 @@
+"""
+Ограничитель запросов к Groq (token bucket), общий для всех воркеров gunicorn
+Два ведра — запросы в минуту (RPM) и токены в минуту (TPM) — лежат в локальном SQLite.
+Состояние подстраивается под заголовки ответа (retry-after, x-ratelimit-*),
+ожидающие вызовы обслуживаются по очереди (FIFO) — и внутри воркера, и между воркерами
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from typing import Optional, Mapping
+from app.local_store import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("GROQ_RATE_LIMIT_ENABLED", "1") == "1"
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))        # лимиты аккаунта Groq (free tier)
+GROQ_TPM = int(os.getenv("GROQ_TPM", "12000"))
+
+QUEUE_HEARTBEAT_TIMEOUT = 15.0   # сек: билет воркера, который перестал опрашивать очередь, удаляется
+DEFAULT_RETRY_AFTER = 5.0        # сек: если 429 пришёл без retry-after
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS rate_limit_state (
+        id            INTEGER PRIMARY KEY CHECK (id = 1),
+        requests      REAL NOT NULL,
+        tokens        REAL NOT NULL,
+        updated_at    REAL NOT NULL,
+        blocked_until REAL NOT NULL DEFAULT 0,
+        throttled     INTEGER NOT NULL DEFAULT 0,
+        limited       INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS rate_limit_queue (
+        ticket    INTEGER PRIMARY KEY AUTOINCREMENT,
+        heartbeat REAL NOT NULL
+    )""",
+]
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Длительность из заголовков Groq: "7.66s", "2m59.56s", "120ms" → секунды"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    try:
+        return float(headers.get("retry-after-ms")) / 1000
+    except (TypeError, ValueError):
+        return parse_duration(headers.get("retry-after"))
+
+
+class RateLimiter:
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._local_lock: Optional[asyncio.Lock] = None
+
+    # ── Синхронная часть (SQLite, вызывается в потоке) ─────────────────────────
+
+    def _conn(self):
+        return ensure_schema("rate_limiter", _SCHEMA)
+
+    def _load(self, conn, now: float):
+        row = conn.execute(
+            "SELECT requests, tokens, updated_at, blocked_until FROM rate_limit_state WHERE id = 1"
+        ).fetchone()
+        if not row:
+            conn.execute(
+                "INSERT INTO rate_limit_state (id, requests, tokens, updated_at) VALUES (1, ?, ?, ?)",
+                (self.rpm, self.tpm, now),
+            )
+            return float(self.rpm), float(self.tpm), 0.0
+        requests, tokens, updated_at, blocked_until = row
+        # Пополнение вёдер за прошедшее время
+        elapsed = max(0.0, now - updated_at)
+        requests = min(self.rpm, requests + elapsed * self.rpm / 60)
+        tokens = min(self.tpm, tokens + elapsed * self.tpm / 60)
+        return requests, tokens, blocked_until
+
+    def _enqueue(self) -> int:
+        conn = self._conn()
+        return conn.execute(
+            "INSERT INTO rate_limit_queue (heartbeat) VALUES (?)", (time.time(),)
+        ).lastrowid
+
+    def _dequeue(self, ticket: int) -> None:
+        self._conn().execute("DELETE FROM rate_limit_queue WHERE ticket = ?", (ticket,))
+
+    def _try_acquire(self, ticket: int, tokens: int, first: bool) -> float:
+        """0 — квота выдана; иначе — сколько секунд подождать до следующей попытки"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM rate_limit_queue WHERE heartbeat < ?", (now - QUEUE_HEARTBEAT_TIMEOUT,))
+            conn.execute("UPDATE rate_limit_queue SET heartbeat = ? WHERE ticket = ?", (now, ticket))
+            head = conn.execute("SELECT MIN(ticket) FROM rate_limit_queue").fetchone()[0]
+            requests, tokens_left, blocked_until = self._load(conn, now)
+
+            if head is not None and head != ticket:
+                wait = 0.05  # впереди в очереди другой воркер
+            elif now < blocked_until:
+                wait = blocked_until - now
+            else:
+                wait = 0.0
+                if requests < 1:
+                    wait = (1 - requests) * 60 / self.rpm
+                if tokens_left < tokens:
+                    wait = max(wait, (tokens - tokens_left) * 60 / self.tpm)
+                if wait == 0.0:
+                    requests -= 1
+                    tokens_left -= tokens
+                    conn.execute("DELETE FROM rate_limit_queue WHERE ticket = ?", (ticket,))
+                elif first:
+                    conn.execute("UPDATE rate_limit_state SET throttled = throttled + 1 WHERE id = 1")
+
+            conn.execute(
+                "UPDATE rate_limit_state SET requests = ?, tokens = ?, updated_at = ? WHERE id = 1",
+                (requests, tokens_left, now),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _apply_headers(self, headers: Mapping[str, str], limited: bool) -> None:
+        now = time.time()
+        block = 0.0
+        if limited:
+            block = (
+                parse_retry_after(headers)
+                or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                or DEFAULT_RETRY_AFTER
+            )
+            # Разброс, чтобы воркеры не вернулись к API одновременно
+            block += random.uniform(0, 0.5)
+        if _header_int(headers, "x-ratelimit-remaining-requests") == 0:
+            block = max(block, parse_duration(headers.get("x-ratelimit-reset-requests")) or DEFAULT_RETRY_AFTER)
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requests, tokens, blocked_until = self._load(conn, now)
+            if remaining_tokens is not None:
+                tokens = min(tokens, remaining_tokens)   # сервер знает лучше
+            if limited:
+                tokens = min(tokens, 0.0)
+            conn.execute(
+                "UPDATE rate_limit_state SET requests = ?, tokens = ?, updated_at = ?, "
+                "blocked_until = ?, limited = limited + ? WHERE id = 1",
+                (requests, tokens, now, max(blocked_until, now + block), 1 if limited else 0),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _settle(self, reserved: int, actual: int) -> None:
+        """Возвращает в ведро разницу между резервом и фактическим расходом токенов"""
+        conn = self._conn()
+        conn.execute(
+            "UPDATE rate_limit_state SET tokens = MIN(?, tokens + ?) WHERE id = 1",
+            (self.tpm, reserved - actual),
+        )
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT requests, tokens, updated_at, blocked_until, throttled, limited FROM rate_limit_state WHERE id = 1"
+        ).fetchone()
+        queue = conn.execute("SELECT COUNT(*) FROM rate_limit_queue").fetchone()[0]
+        requests, tokens, updated_at, blocked_until, throttled, limited = row or (self.rpm, self.tpm, now, 0, 0, 0)
+        elapsed = max(0.0, now - updated_at)
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests_available": round(min(self.rpm, requests + elapsed * self.rpm / 60), 2),
+            "tokens_available": round(min(self.tpm, tokens + elapsed * self.tpm / 60)),
+            "blocked_for_seconds": round(max(0.0, blocked_until - now), 2),
+            "queue_length": queue,
+            "throttled": throttled,
+            "rate_limited_responses": limited,
+        }
+
+    # ── Асинхронный интерфейс ──────────────────────────────────────────────────
+
+    async def acquire(self, tokens: int) -> int:
+        """Ждёт своей очереди и квоты на 1 запрос + tokens токенов; возвращает резерв"""
+        if not RATE_LIMIT_ENABLED:
+            return 0
+        tokens = min(tokens, self.tpm)   # запрос больше ведра иначе не пройдёт никогда
+        if self._local_lock is None:
+            self._local_lock = asyncio.Lock()
+
+        # asyncio.Lock будит ожидающих по порядку — внутри воркера очередь честная,
+        # между воркерами порядок задают билеты в rate_limit_queue
+        async with self._local_lock:
+            ticket = await asyncio.to_thread(self._enqueue)
+            try:
+                first = True
+                while True:
+                    wait = await asyncio.to_thread(self._try_acquire, ticket, tokens, first)
+                    if wait <= 0:
+                        return tokens
+                    first = False
+                    await asyncio.sleep(min(wait, 1.0))
+            except BaseException:
+                # Отмена ожидания: билет убирается в потоке, а не синхронной записью в SQLite на цикле событий
+                await asyncio.shield(asyncio.to_thread(self._dequeue, ticket))
+                raise
+
+    async def observe(self, headers: Optional[Mapping[str, str]], limited: bool = False) -> None:
+        """Учитывает заголовки ответа Groq (в том числе 429)"""
+        if not RATE_LIMIT_ENABLED or headers is None:
+            return
+        try:
+            await asyncio.to_thread(self._apply_headers, headers, limited)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить состояние лимитера: {e}")
+
+    async def settle(self, reserved: int, actual: Optional[int]) -> None:
+        if not RATE_LIMIT_ENABLED or not reserved or actual is None:
+            return
+        try:
+            await asyncio.to_thread(self._settle, reserved, actual)
+        except Exception as e:
+            logger.warning(f"Не удалось скорректировать расход токенов: {e}")
+
+
+# Глобальный экземпляр лимитера
+rate_limiter = RateLimiter(GROQ_RPM, GROQ_TPM)
@@ -0,0 +1,106 @@
+"""
+Кэш готовых генераций (AgentResponse)
+Ключ — хэш нормализованного контекста идеи (регистр, пробелы, пунктуация не важны).
+Два уровня: личный (повторная отправка той же идеи пользователем) и глобальный
+"""
+import os
+import re
+import hashlib
+import unicodedata
+from typing import Optional, Dict, Any, Tuple
+from app.local_store import DiskCache
+
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "1") == "1"
+GENERATION_CACHE_GLOBAL = os.getenv("GENERATION_CACHE_GLOBAL", "1") == "1"
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))   # секунд
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "2000"))
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+SCOPE_USER = "user"
+SCOPE_GLOBAL = "global"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, без пунктуации, пробелы схлопнуты"""
+    text = unicodedata.normalize("NFKC", text).lower().replace("ё", "е")
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_fingerprint(idea_text: str, full_context: str, version: str) -> str:
+    """Хэш нормализованного контекста + версии пайплайна (промпты поменялись — кэш не подходит)"""
+    raw = "\x1f".join([version, normalize_text(idea_text), normalize_text(full_context)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    def __init__(self):
+        self.store = DiskCache(
+            "generation_cache",
+            ttl=GENERATION_CACHE_TTL,
+            max_entries=GENERATION_CACHE_MAX_ENTRIES,
+            max_bytes=GENERATION_CACHE_MAX_BYTES,
+        )
+
+    @staticmethod
+    def _user_key(fingerprint: str, username: str) -> str:
+        return f"{SCOPE_USER}:{username}:{fingerprint}"
+
+    @staticmethod
+    def _user_tag(username: str) -> str:
+        # С префиксом: пользователь с именем "global" не должен совпасть с тегом глобального кэша
+        return f"{SCOPE_USER}:{username}"
+
+    @staticmethod
+    def _global_key(fingerprint: str) -> str:
+        return f"{SCOPE_GLOBAL}:{fingerprint}"
+
+    def get(self, fingerprint: str, username: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Возвращает (результат, scope) — сначала личный кэш пользователя, затем глобальный"""
+        result = self.store.get(self._user_key(fingerprint, username), count=False)
+        if result is not None:
+            self.store.bump("hits")
+            self.store.bump("hits_user")
+            return result, SCOPE_USER
+        if GENERATION_CACHE_GLOBAL:
+            result = self.store.get(self._global_key(fingerprint), count=False)
+            if result is not None:
+                self.store.bump("hits")
+                self.store.bump("hits_global")
+                return result, SCOPE_GLOBAL
+        self.store.bump("misses")
+        return None, None
+
+    def set(self, fingerprint: str, username: str, result: Dict[str, Any]) -> None:
+        self.store.set(self._user_key(fingerprint, username), result, tag=self._user_tag(username))
+        if GENERATION_CACHE_GLOBAL:
+            self.store.set(self._global_key(fingerprint), result, tag=SCOPE_GLOBAL)
+
+    def invalidate(self, username: Optional[str] = None, scope: Optional[str] = None) -> int:
+        """Сброс кэша: весь (без параметров), только глобальный (scope=global) или записи
+        пользователя (username, scope=user или без scope). ValueError — неизвестный scope
+        или scope, не совпадающий с username: опечатка не должна сбрасывать весь кэш"""
+        if scope not in (None, SCOPE_GLOBAL, SCOPE_USER):
+            raise ValueError(f"Неизвестный scope: {scope!r} (допустимо: {SCOPE_GLOBAL}, {SCOPE_USER})")
+        if scope == SCOPE_GLOBAL:
+            if username:
+                raise ValueError("scope=global сбрасывает глобальный кэш и не принимает username")
+            return self.store.clear(tag=SCOPE_GLOBAL)
+        if username:
+            return self.store.clear(tag=self._user_tag(username))
+        if scope == SCOPE_USER:
+            raise ValueError("scope=user требует username")
+        return self.store.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": GENERATION_CACHE_ENABLED,
+            "global_scope": GENERATION_CACHE_GLOBAL,
+            **self.store.stats(),
+        }
+
+
+# Глобальный экземпляр кэша генераций
+generation_cache = GenerationCache()
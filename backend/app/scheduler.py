@@ -0,0 +1,133 @@
+"""
+Планировщик генераций: постановка задач в таблицу generation_jobs с приоритетом по тарифу
+pro/admin обслуживаются раньше starter, starter — раньше free; внутри тарифа — по порядку.
+Выполняют задачи воркеры (app/worker.py), API только ставит их в очередь.
+Если очередь перед пользователем длиннее порога, новая генерация не принимается (503)
+Спекулятивные задачи (из /api/clarify) идут после всех тарифов и отменяются, если их не забрали
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from app.database import user_db
+
+logger = logging.getLogger(__name__)
+
+GENERATION_MAX_CONCURRENT = int(os.getenv("GENERATION_MAX_CONCURRENT", "8"))   # на один процесс-исполнитель
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "50"))
+# Сколько секунд спекулятивная генерация ждёт подтверждения через /api/generate
+GENERATION_SPECULATIVE_TTL = float(os.getenv("GENERATION_SPECULATIVE_TTL", "30"))
+
+PLAN_PRIORITY = {"admin": 0, "pro": 0, "starter": 1, "free": 2}
+DEFAULT_PRIORITY = 2
+SPECULATIVE_PRIORITY = max(PLAN_PRIORITY.values()) + 1   # только на свободные слоты
+DEFAULT_DURATION = 20.0   # сек, оценка длительности пайплайна до первых замеров
+
+
+class QueueFullError(Exception):
+    """Очередь генераций переполнена — повторить через retry_after секунд"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Сервис перегружен, повторите генерацию через {int(retry_after) + 1} с")
+
+
+class GenerationScheduler:
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._on_submit: List[Callable[[], None]] = []
+        self._counters = {"submitted": 0, "rejected": 0, "cancelled": 0, "speculative": 0, "speculative_claimed": 0}
+
+    def on_submit(self, callback: Callable[[], None]) -> None:
+        """callback() после постановки или отмены задачи — локальный исполнитель
+        заберёт/остановит её без ожидания опроса"""
+        self._on_submit.append(callback)
+
+    @staticmethod
+    def priority(plan: Optional[str]) -> int:
+        return PLAN_PRIORITY.get(plan or "free", DEFAULT_PRIORITY)
+
+    def retry_after(self, priority: int, ahead: Optional[int] = None) -> float:
+        stats = user_db.get_job_stats()
+        if ahead is None:
+            ahead = user_db.count_queued_jobs(priority)
+        waves = (ahead + stats["running"]) / max(1, self.max_concurrent)
+        return max(1.0, waves * (stats["avg_duration_seconds"] or DEFAULT_DURATION))
+
+    def check_admission(self, plan: Optional[str]) -> None:
+        """QueueFullError, если очередь перед этим тарифом уже глубже порога"""
+        priority = self.priority(plan)
+        ahead = user_db.count_queued_jobs(priority)
+        if ahead >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise QueueFullError(self.retry_after(priority, ahead))
+
+    def submit(
+        self,
+        session_id: str,
+        username: str,
+        plan: Optional[str],
+        mode: str,
+        idea_text: str,
+        full_context: str,
+        fingerprint: Optional[str] = None,
+        cancel_on_disconnect: bool = False,
+        speculative: bool = False,
+    ) -> int:
+        """Ставит задачу в очередь; возвращает позицию (0 — уже выполняется).
+        speculative — задача без списания генерации и с низшим приоритетом: её нужно забрать
+        через claim() в течение GENERATION_SPECULATIVE_TTL, иначе исполнитель её отменит"""
+        speculative_until = None
+        if speculative:
+            speculative_until = datetime.utcnow() + timedelta(seconds=GENERATION_SPECULATIVE_TTL)
+        user_db.create_job(
+            session_id, username, SPECULATIVE_PRIORITY if speculative else self.priority(plan),
+            mode, idea_text, full_context, fingerprint,
+            cancel_on_disconnect=cancel_on_disconnect, speculative_until=speculative_until,
+        )
+        self._counters["speculative" if speculative else "submitted"] += 1
+        self._wake()
+        return self.position(session_id) or 0
+
+    def claim(
+        self, session_id: str, plan: Optional[str], fingerprint: Optional[str], cancel_on_disconnect: bool,
+    ) -> bool:
+        """Спекулятивная задача становится обычной с приоритетом тарифа; False — её уже нет"""
+        if not user_db.claim_speculative_job(session_id, self.priority(plan), fingerprint, cancel_on_disconnect):
+            return False
+        self._counters["speculative_claimed"] += 1
+        self._wake()
+        return True
+
+    def cancel(self, session_id: str) -> Optional[str]:
+        """Отмена генерации: cancelled — снята из очереди, cancelling — её остановит исполнитель.
+        Для уже завершённой задачи возвращает её состояние, для неизвестной — None"""
+        state = user_db.request_job_cancel(session_id)
+        if state in ("cancelled", "cancelling"):
+            self._counters["cancelled"] += 1
+            self._wake()
+        return state
+
+    def _wake(self) -> None:
+        for callback in self._on_submit:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Не удалось разбудить исполнителя: {e}")
+
+    def position(self, session_id: str) -> Optional[int]:
+        """N — место в очереди, None — задача уже выполняется, завершена или неизвестна"""
+        return user_db.get_job_queue_position(session_id)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            **user_db.get_job_stats(),
+            **self._counters,
+        }
+
+
+# Глобальный экземпляр (один на воркер)
+scheduler = GenerationScheduler(GENERATION_MAX_CONCURRENT, GENERATION_MAX_QUEUE)
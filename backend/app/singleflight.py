@@ -0,0 +1,106 @@
+"""
+Single-flight для одинаковых запросов к LLM
+Параллельные вызовы с одним ключом ждут один запрос и получают общий результат:
+внутри воркера — через общую задачу asyncio, между воркерами — через таблицу блокировок
+в локальном SQLite (результат передаётся через общий кэш ответов)
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.local_store import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv("LLM_SINGLEFLIGHT_LOCK_TTL", "180"))   # сек, после — блокировку перехватывают
+SINGLEFLIGHT_POLL = 0.2
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS llm_inflight (
+        key        TEXT PRIMARY KEY,
+        owner      TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )""",
+]
+
+
+class SingleFlight:
+    def __init__(self, on_saved: Optional[Callable[[str], None]] = None):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._owner = str(os.getpid())
+        self._on_saved = on_saved   # счётчик сэкономленных вызовов (local | remote)
+
+    # ── Блокировки между воркерами ─────────────────────────────────────────────
+
+    def _conn(self):
+        return ensure_schema("singleflight", _SCHEMA)
+
+    def _try_lock(self, key: str) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM llm_inflight WHERE key = ? AND expires_at < ?", (key, now))
+        return conn.execute(
+            "INSERT OR IGNORE INTO llm_inflight (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, self._owner, now + SINGLEFLIGHT_LOCK_TTL),
+        ).rowcount == 1
+
+    def _is_locked(self, key: str) -> bool:
+        return self._conn().execute(
+            "SELECT 1 FROM llm_inflight WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone() is not None
+
+    def _unlock(self, key: str) -> None:
+        self._conn().execute("DELETE FROM llm_inflight WHERE key = ? AND owner = ?", (key, self._owner))
+
+    def _saved(self, kind: str) -> None:
+        if self._on_saved:
+            try:
+                self._on_saved(kind)
+            except Exception as e:
+                logger.warning(f"Не удалось учесть сэкономленный вызов: {e}")
+
+    # ── Основной интерфейс ─────────────────────────────────────────────────────
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        shared_get: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """Выполняет fn() один раз на ключ; shared_get — чтение результата, сохранённого другим воркером
+
+        Сам запрос живёт в отдельной задаче: отмена одного из ожидающих не отменяет его для остальных.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            logger.info("Одинаковый запрос к LLM уже выполняется — ждём его результат")
+            await asyncio.to_thread(self._saved, "local")
+            return await asyncio.shield(task)
+
+        task = asyncio.create_task(self._run(key, fn, shared_get))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        # Исключение забирается здесь, даже если все ожидающие уже отменены
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _run(self, key, fn, shared_get):
+        if shared_get is None:
+            return await fn()
+        while True:
+            if await asyncio.to_thread(self._try_lock, key):
+                try:
+                    return await fn()
+                finally:
+                    await asyncio.to_thread(self._unlock, key)
+
+            # Тот же запрос уже выполняет другой воркер — ждём, пока он положит ответ в общий кэш
+            logger.info("Одинаковый запрос к LLM выполняется в другом воркере — ждём")
+            while await asyncio.to_thread(self._is_locked, key):
+                await asyncio.sleep(SINGLEFLIGHT_POLL)
+            result = await shared_get()
+            if result is not None:
+                await asyncio.to_thread(self._saved, "remote")
+                return result
+            # Владелец не справился — пробуем взять блокировку и выполнить запрос сами
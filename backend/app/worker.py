@@ -0,0 +1,311 @@
+"""
+Исполнитель задач генерации из таблицы generation_jobs
+JobRunner забирает задачи с арендой (lease) и продлевает её, пока пайплайн работает.
+Если процесс упал, аренда истекает и задачу забирает другой исполнитель — этапы,
+сохранённые в задаче, не повторяются.
+
+Отдельный пул (API остаётся лёгким, LLM-нагрузка масштабируется независимо):
+    python -m app.worker --processes 2 --concurrency 8
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from dotenv import load_dotenv
+
+# Отдельный процесс читает .env сам — до импорта модулей, которые берут настройки при загрузке
+load_dotenv()
+
+from app.database import user_db
+from app.pipeline import run_pipeline, cache_result, job_progress, FINISHED, CANCELLED_PROGRESS
+from app.llm import close_client
+from app.progress_store import progress_store
+
+logger = logging.getLogger(__name__)
+
+# inline — исполнитель внутри каждого API-воркера, worker — только отдельный пул app.worker
+GENERATION_EXECUTOR = os.getenv("GENERATION_EXECUTOR", "inline").lower()
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+# Сколько секунд задача с cancel_on_disconnect живёт без SSE-подписчика
+GENERATION_DISCONNECT_GRACE = float(os.getenv("GENERATION_DISCONNECT_GRACE", "30"))
+PURGE_INTERVAL = 3600   # сек между очистками старых задач
+
+
+class LeaseLostError(Exception):
+    """Аренду задачи перехватил другой исполнитель — результат этой попытки не сохраняем"""
+
+
+
+def _speculation_expired(job: Dict[str, Any]) -> bool:
+    """Спекулятивную задачу не забрали вовремя — выполнять её больше не для кого"""
+    until = job.get("speculative_until")
+    return until is not None and datetime.fromisoformat(until) < datetime.utcnow()
+
+
+class JobRunner:
+    def __init__(
+        self,
+        concurrency: int,
+        publish: Optional[Callable[[str, Dict[str, Any]], Awaitable[Any]]] = progress_store.publish,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.concurrency = concurrency
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._publish = publish
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancelling: Set[str] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self) -> None:
+        self._wake = asyncio.Event()
+        self._event_loop = asyncio.get_running_loop()
+        self._loop_task = asyncio.create_task(self._loop())
+        logger.info(f"Исполнитель генераций {self.owner}: до {self.concurrency} задач одновременно")
+
+    def wake(self) -> None:
+        """Новая задача в очереди — забрать сразу, не дожидаясь следующего опроса.
+        Вызывается и из потоков (scheduler.submit через asyncio.to_thread)"""
+        if self._wake is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._event_loop:
+            self._wake.set()
+        else:
+            self._event_loop.call_soon_threadsafe(self._wake.set)
+
+    async def publish(self, job_id: str, progress: Dict[str, Any]) -> None:
+        if self._publish is None:
+            return
+        try:
+            await self._publish(job_id, progress)
+        except Exception as e:
+            logger.warning(f"Не удалось опубликовать прогресс {job_id}: {e}")
+
+    async def _loop(self) -> None:
+        last_purge = 0.0
+        while not self._stopping:
+            try:
+                while len(self._tasks) < self.concurrency:
+                    job = await asyncio.to_thread(user_db.claim_job, self.owner, self.lease_seconds)
+                    if job is None:
+                        break
+                    self._tasks[job["id"]] = asyncio.create_task(self._execute(job))
+
+                if self._tasks:
+                    await self._cancel_requested()
+
+                now = asyncio.get_running_loop().time()
+                if now - last_purge > PURGE_INTERVAL:
+                    last_purge = now
+                    purged = await asyncio.to_thread(user_db.purge_finished_jobs, JOB_RETENTION_DAYS)
+                    if purged:
+                        logger.info(f"Удалено старых задач генерации: {purged}")
+            except Exception as e:
+                logger.error(f"Очередь генераций недоступна: {e}")
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _cancel_requested(self) -> None:
+        """Останавливает задачи, отменённые пользователем или оставшиеся без подписчиков"""
+        job_ids = await asyncio.to_thread(user_db.get_jobs_to_cancel, self.owner, GENERATION_DISCONNECT_GRACE)
+        for job_id in job_ids:
+            task = self._tasks.get(job_id)
+            if task is not None and job_id not in self._cancelling:
+                logger.info(f"Задача {job_id}: отмена, оставшиеся этапы не выполняются")
+                self._cancelling.add(job_id)
+                task.cancel()
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task) -> None:
+        """Продлевает аренду; если её перехватили — останавливает свою копию пайплайна"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await asyncio.to_thread(user_db.renew_job_lease, job_id, self.owner, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Не удалось продлить аренду {job_id}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Аренда задачи {job_id} потеряна, останавливаем выполнение")
+                task.cancel()
+                return
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, asyncio.current_task()))
+
+        async def save_stage(stages, stage_results, partials) -> None:
+            saved = await asyncio.to_thread(
+                user_db.save_job_stage, job_id, self.owner, stages, stage_results, partials,
+            )
+            if not saved:
+                raise LeaseLostError(job_id)
+
+        async def finish(result) -> None:
+            # Задача завершается в БД до публикации результата: отмена в этом окне
+            # не вернёт генерацию пользователю, который уже получил ответ
+            if not await asyncio.to_thread(user_db.finish_job, job_id, self.owner, result):
+                raise LeaseLostError(job_id)
+
+        try:
+            if job["cancel_requested"] or _speculation_expired(job):
+                self._cancelling.add(job_id)
+                raise asyncio.CancelledError()
+            if job["attempts"] > JOB_MAX_ATTEMPTS:
+                raise Exception(f"Генерация прервалась {job['attempts'] - 1} раз подряд")
+            if job["attempts"] > 1:
+                done = [name for name, st in job["stages"].items() if st in FINISHED]
+                logger.info(f"Задача {job_id}: продолжение (попытка {job['attempts']}), готово: {done}")
+            result = await run_pipeline(job, lambda progress: self.publish(job_id, progress), save_stage, finish)
+            if job["speculative_until"]:
+                # Спекулятивную задачу могли подтвердить на ходу — fingerprint появился только в БД
+                claimed = await asyncio.to_thread(user_db.get_job, job_id)
+                if claimed and claimed["speculative_until"] is None:
+                    await cache_result(claimed, claimed["stages"], result)
+        except LeaseLostError:
+            logger.warning(f"Задача {job_id} выполняется другим исполнителем")
+        except asyncio.CancelledError:
+            if job_id in self._cancelling:
+                await self._finish_cancelled(job_id)
+            # Остановка процесса — задачу вернёт в очередь stop(); потеря аренды — её уже забрали
+            elif self._stopping:
+                raise
+        except Exception as e:
+            logger.error(f"Ошибка пайплайна {job_id}: {e}")
+            try:
+                await asyncio.to_thread(user_db.fail_job, job_id, self.owner, str(e))
+            except Exception as db_error:
+                logger.error(f"Не удалось сохранить ошибку задачи {job_id}: {db_error}")
+            await self.publish(job_id, {"stage": str(e), "error": True, "completed": True})
+        finally:
+            heartbeat.cancel()
+            self._tasks.pop(job_id, None)
+            self._cancelling.discard(job_id)
+            self.wake()
+
+    async def _finish_cancelled(self, job_id: str) -> None:
+        try:
+            cancelled = await asyncio.to_thread(user_db.cancel_job, job_id, self.owner)
+            if not cancelled:
+                # Задача успела завершиться — подписчики получают её настоящий итог, а не отмену
+                job = await asyncio.to_thread(user_db.get_job, job_id)
+                if job is not None:
+                    await self.publish(job_id, job_progress(job))
+                return
+        except Exception as e:
+            logger.error(f"Не удалось сохранить отмену задачи {job_id}: {e}")
+        await self.publish(job_id, CANCELLED_PROGRESS)
+
+    async def stop(self) -> None:
+        """Остановка: незавершённые задачи сразу возвращаются в очередь (готовые этапы сохранены)"""
+        self._stopping = True
+        tasks = [t for t in (self._loop_task, *self._tasks.values()) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            released = await asyncio.to_thread(user_db.release_jobs, self.owner)
+            if released:
+                logger.info(f"Возвращено в очередь задач: {released}")
+        except Exception as e:
+            logger.error(f"Не удалось вернуть задачи в очередь: {e}")
+
+    def stats(self) -> dict:
+        return {"owner": self.owner, "concurrency": self.concurrency, "running": len(self._tasks)}
+
+
+# ── Отдельный пул процессов ──────────────────────────────────────────────────
+
+async def _serve(concurrency: int) -> None:
+    import signal
+
+    runner = JobRunner(concurrency)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await progress_store.start()
+    await runner.start()
+    try:
+        await stop.wait()
+    finally:
+        await runner.stop()
+        await progress_store.stop()
+        await close_client()
+
+
+def _child(concurrency: int) -> None:
+    logging.basicConfig(level=logging.INFO, format=f"[worker {os.getpid()}] %(levelname)s %(name)s: %(message)s")
+    asyncio.run(_serve(concurrency))
+
+
+def main() -> None:
+    import time
+    import signal
+    import argparse
+    import multiprocessing
+    from app.scheduler import GENERATION_MAX_CONCURRENT
+
+    parser = argparse.ArgumentParser(description="Пул исполнителей генераций")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("GENERATION_WORKER_PROCESSES", "1")))
+    parser.add_argument("--concurrency", type=int, default=GENERATION_MAX_CONCURRENT,
+                        help="одновременных пайплайнов в одном процессе")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.processes <= 1:
+        _child(args.concurrency)
+        return
+
+    # Супервизор: перезапускает упавшие процессы, по SIGTERM останавливает их штатно
+    stopping = False
+
+    def _shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    def _spawn() -> multiprocessing.Process:
+        process = multiprocessing.Process(target=_child, args=(args.concurrency,), daemon=False)
+        process.start()
+        return process
+
+    processes = [_spawn() for _ in range(args.processes)]
+    logger.info(f"Запущено исполнителей генераций: {args.processes} × {args.concurrency}")
+    while not stopping:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"Исполнитель {process.pid} завершился (код {process.exitcode}), перезапуск")
+                processes[i] = _spawn()
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(JOB_LEASE_SECONDS)
+
+
+if __name__ == "__main__":
+    main()
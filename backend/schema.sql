@@ -14,7 +14,8 @@ CREATE TABLE IF NOT EXISTS users (
     disabled BOOLEAN DEFAULT FALSE,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     INDEX idx_username (username),
-    INDEX idx_plan (plan)
+    INDEX idx_plan (plan),
+    INDEX idx_created (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Agents table
@@ -27,6 +28,7 @@ CREATE TABLE IF NOT EXISTS agents (
     idea TEXT,
     full_response TEXT,
     chat_history TEXT DEFAULT '[]',
+    chat_summary TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     INDEX idx_user (user_username),
     INDEX idx_created (created_at),
@@ -45,6 +47,63 @@ CREATE TABLE IF NOT EXISTS usage_events (
     FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Usage counters table (лимиты тарифов за O(1): генерации за месяц, сохранённые агенты)
+CREATE TABLE IF NOT EXISTS usage_counters (
+    username VARCHAR(255) PRIMARY KEY,
+    month CHAR(7) NOT NULL,
+    generations INT NOT NULL DEFAULT 0,
+    agents INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Daily stats table (дневные агрегаты для админки: генерации, чаты, регистрации, агенты, тарифы)
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day DATE NOT NULL,
+    metric VARCHAR(64) NOT NULL,
+    value INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, metric),
+    INDEX idx_metric_day (metric, day)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Generation jobs table (очередь генераций, выполняется воркерами app.worker)
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id VARCHAR(255) PRIMARY KEY,
+    username VARCHAR(255) NOT NULL,
+    priority INT DEFAULT 2,
+    mode VARCHAR(20) DEFAULT 'full',
+    state VARCHAR(20) DEFAULT 'queued',
+    idea_text TEXT,
+    full_context TEXT,
+    fingerprint VARCHAR(255),
+    stages TEXT,
+    stage_results MEDIUMTEXT,
+    partials MEDIUMTEXT,
+    result MEDIUMTEXT,
+    error TEXT,
+    attempts INT DEFAULT 0,
+    cancel_requested BOOLEAN DEFAULT FALSE,
+    cancel_on_disconnect BOOLEAN DEFAULT FALSE,
+    subscriber_seen_at DATETIME,
+    speculative_until DATETIME,
+    lease_owner VARCHAR(255),
+    lease_expires_at DATETIME,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME,
+    finished_at DATETIME,
+    INDEX idx_username (username),
+    INDEX idx_state_priority (state, priority, created_at),
+    INDEX idx_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Progress spill table (итоговые снимки прогресса, вытесненные из памяти)
+CREATE TABLE IF NOT EXISTS progress_spill (
+    session_id VARCHAR(255) PRIMARY KEY,
+    version INT NOT NULL,
+    data MEDIUMTEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Create default admin user (password: admin123)
 INSERT IGNORE INTO users (username, hashed_password, plan, email) 
 VALUES (
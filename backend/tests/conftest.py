@@ -0,0 +1,73 @@
+"""
+Общие настройки тестов
+Модули app читают окружение при импорте, поэтому БД и локальное хранилище переводятся
+во временный каталог до первого импорта app. Глобальные экземпляры общие на всю сессию —
+тесты изолируются уникальными именами пользователей, сессий и таблиц
+"""
+import os
+import uuid
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="ai_architect_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP}/app.db"
+os.environ["LOCAL_STORE_PATH"] = f"{_TMP}/local.db"
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["GROQ_API_KEY"] = "test"
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+import pytest  # noqa: E402
+
+
+class Clock:
+    """Подменяет модуль time в тестируемом модуле: time() и monotonic() двигаются вручную"""
+
+    def __init__(self, start: float = 1_000_000.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def unique():
+    """Уникальное имя (пользователь, сессия, таблица) — тесты не мешают друг другу"""
+    return lambda prefix="t": f"{prefix}_{uuid.uuid4().hex[:10]}"
+
+
+@pytest.fixture
+def make_user(unique):
+    """Создаёт пользователя с нужным тарифом и возвращает его имя"""
+    from app.database import user_db
+
+    def make(plan: str = "free") -> str:
+        username = unique("user")
+        user_db.create_user(username, "not-a-real-hash", f"{username}@example.com")
+        if plan != "free":
+            user_db.upgrade_plan(username, plan)
+        return username
+
+    return make
+
+
+@pytest.fixture
+def empty_queue():
+    """Очередь generation_jobs без задач других тестов (claim_job берёт любую задачу)"""
+    from app.database import SessionLocal, GenerationJobModel
+
+    db = SessionLocal()
+    try:
+        db.query(GenerationJobModel).delete()
+        db.commit()
+    finally:
+        db.close()
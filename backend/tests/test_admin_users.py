@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import pytest
+
+from app.database import user_db, SessionLocal, UserModel, UsageCounterModel, _current_month
+
+SORTS = {
+    "created_at": "created_at",
+    "username": "username",
+    "generations": "generations_this_month",
+    "agents": "agents_count",
+}
+
+
+@pytest.fixture
+def users(unique):
+    """Пользователи с общим префиксом: повторы значений, NULL created_at, старый месяц, нет строки счётчиков"""
+    prefix = unique("page")
+    created = [None, datetime(2026, 1, 1), datetime(2026, 1, 1), None, datetime(2026, 3, 5), datetime(2025, 7, 9)]
+    names = [f"{prefix}_{i:02d}" for i in range(11)]
+    for username in names:
+        user_db.create_user(username, "not-a-real-hash", f"{username}@example.com")
+    db = SessionLocal()
+    try:
+        for i, username in enumerate(names):
+            db.query(UserModel).filter(UserModel.username == username).update({
+                UserModel.created_at: created[i % len(created)],
+                UserModel.plan: "pro" if i % 3 == 0 else "free",
+            })
+            counters = db.query(UsageCounterModel).filter(UsageCounterModel.username == username)
+            if i == 7:
+                counters.delete()
+            else:
+                counters.update({
+                    UsageCounterModel.generations: i % 4,
+                    UsageCounterModel.agents: i % 3,
+                    UsageCounterModel.month: "2000-01" if i == 5 else _current_month(),
+                })
+        db.commit()
+    finally:
+        db.close()
+    return prefix, names
+
+
+def _all_pages(prefix: str, sort: str, descending: bool, limit: int = 3):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor, total = user_db.get_users_page(
+            limit=limit, cursor=cursor, sort=sort, descending=descending, search=prefix,
+        )
+        rows += page
+        pages += 1
+        assert pages < 20, "курсор не продвигается"
+        if cursor is None:
+            return rows, total
+
+
+def _expected(rows, sort: str, descending: bool):
+    field = SORTS[sort]
+
+    def key(row):
+        # NULL меньше любого значения — как в SQLite и MySQL
+        value = row[field]
+        return (value is not None, value if value is not None else "", row["username"])
+
+    return [row["username"] for row in sorted(rows, key=key, reverse=descending)]
+
+
+@pytest.mark.parametrize("descending", [True, False])
+@pytest.mark.parametrize("sort", list(SORTS))
+def test_keyset_pages_cover_every_user_once_in_order(users, sort, descending):
+    prefix, names = users
+    rows, total = _all_pages(prefix, sort, descending)
+
+    usernames = [row["username"] for row in rows]
+    assert total == len(names)
+    assert sorted(usernames) == names   # без пропусков и повторов
+    assert usernames == _expected(rows, sort, descending)
+
+
+def test_counters_from_another_month_or_missing_read_as_zero(users):
+    prefix, names = users
+    rows = {row["username"]: row for row in _all_pages(prefix, "username", False)[0]}
+    assert rows[names[5]]["generations_this_month"] == 0
+    assert rows[names[7]]["generations_this_month"] == 0
+    assert rows[names[7]]["agents_count"] == 0
+    assert rows[names[6]]["generations_this_month"] == 2
+    assert rows[names[0]]["created_at"] is None
+
+
+def test_plan_filter_and_total(users):
+    prefix, names = users
+    page, cursor, total = user_db.get_users_page(limit=2, plan="pro", search=prefix)
+    assert total == 4
+    assert len(page) == 2 and cursor is not None
+    assert all(row["plan"] == "pro" for row in page)
+
+
+def test_search_treats_like_wildcards_literally(unique):
+    prefix = unique("like")
+    for suffix in ("100%_done", "100xxdone", "back\\slash"):
+        user_db.create_user(f"{prefix}_{suffix}", "not-a-real-hash")
+
+    def found(search):
+        return sorted(row["username"] for row in user_db.get_users_page(search=f"{prefix}_{search}")[0])
+
+    assert found("100%_") == [f"{prefix}_100%_done"]
+    assert found("100x") == [f"{prefix}_100xxdone"]
+    assert found("back\\s") == [f"{prefix}_back\\slash"]
+    # Поиск без учёта регистра
+    assert len(user_db.get_users_page(search=prefix.upper())[0]) == 3
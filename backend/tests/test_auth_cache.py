@@ -0,0 +1,142 @@
+import time
+
+import pytest
+
+from app import auth_cache as ac
+from app.auth_cache import AuthCache, auth_cache
+from app.database import user_db
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(ac, "time", clock)
+    monkeypatch.setattr(ac, "AUTH_CACHE_ENABLED", True)
+    monkeypatch.setattr(ac, "AUTH_CACHE_SYNC_INTERVAL", 1.0)
+
+
+def _user(username: str, plan: str = "free") -> dict:
+    return {"username": username, "plan": plan, "disabled": False}
+
+
+def _wait_sync(cache: AuthCache) -> None:
+    """Ждёт фоновую синхронизацию с журналом (часы модуля подменены, здесь — настоящее время)"""
+    deadline = time.monotonic() + 2
+    while cache._syncing and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def _worker(clock, ttl: float = 60, max_entries: int = 100) -> AuthCache:
+    """Кэш ещё одного воркера; первое чтение запоминает позицию в журнале"""
+    cache = AuthCache(ttl=ttl, max_entries=max_entries)
+    cache.get("warm-up")
+    _wait_sync(cache)
+    return cache
+
+
+def test_nothing_is_cached_before_the_journal_position_is_known(unique):
+    cache = AuthCache(ttl=60)
+    cache.set("token", _user(unique("user")))
+    assert cache.get("token") is None
+
+
+def test_hit_returns_cached_user(clock, unique):
+    cache = _worker(clock)
+    username = unique("user")
+    cache.set("token", _user(username, "pro"))
+    assert cache.get("token") == {"username": username, "plan": "pro", "disabled": False}
+    assert cache.get("other-token") is None
+
+
+def test_entry_lives_ttl_but_not_longer_than_the_token(clock, unique):
+    cache = _worker(clock)
+    cache.set("long", _user(unique("user")))
+    cache.set("short", _user(unique("user")), token_expires_at=clock.time() + 5)
+
+    clock.advance(6)
+    assert cache.get("short") is None
+    assert cache.get("long") is not None
+    clock.advance(60)
+    assert cache.get("long") is None
+    assert cache._counters["expired"] == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock, unique):
+    cache = _worker(clock, max_entries=2)
+    cache.set("a", _user(unique("user")))
+    cache.set("b", _user(unique("user")))
+    cache.get("a")
+    cache.set("c", _user(unique("user")))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache._counters["evicted"] == 1
+
+
+def test_invalidation_reaches_other_workers_through_the_journal(clock, unique):
+    first, second = _worker(clock), _worker(clock)
+    username, bystander = unique("user"), unique("user")
+    first.set("token-1", _user(username))
+    second.set("token-2", _user(username))
+    second.set("token-3", _user(bystander))
+
+    first.invalidate(username)
+    assert first.get("token-1") is None
+    # Другой воркер читает журнал не чаще AUTH_CACHE_SYNC_INTERVAL и в фоне
+    clock.advance(0.5)
+    assert second.get("token-2") is not None
+    clock.advance(0.5)
+    second.get("token-3")
+    _wait_sync(second)
+    assert second.get("token-2") is None
+    assert second.get("token-3") is not None
+
+
+def test_get_does_not_wait_for_the_journal(clock, unique, monkeypatch):
+    cache = _worker(clock)
+    cache.set("token", _user(unique("user")))
+    monkeypatch.setattr(cache, "_sync", lambda: time.sleep(0.5))   # SQLite занят другим воркером
+    clock.advance(1)
+
+    started = time.monotonic()
+    assert cache.get("token") is not None
+    assert time.monotonic() - started < 0.1
+    _wait_sync(cache)
+
+
+def test_new_worker_ignores_old_invalidations(clock, unique):
+    username = unique("user")
+    AuthCache().invalidate(username)
+
+    late = _worker(clock)
+    late.set("token", _user(username))
+    clock.advance(1)
+    late.get("token")
+    _wait_sync(late)
+    assert late.get("token") is not None
+
+
+def test_plan_change_invalidates_the_global_cache(make_user):
+    username = make_user()
+    auth_cache.get("warm-up")
+    _wait_sync(auth_cache)
+    auth_cache.set("token", _user(username))
+    assert auth_cache.get("token") is not None
+    user_db.upgrade_plan(username, "pro")
+    assert auth_cache.get("token") is None
+
+
+def test_counters_are_shared_between_workers(clock, unique):
+    first, second = _worker(clock), _worker(clock)
+    before = first.stats()
+    first.set("token", _user(unique("user")))
+    first.get("token")
+    second.get("missing")
+    clock.advance(1)
+    second.get("missing")   # фоновая синхронизация отправляет дельты в общую таблицу
+    _wait_sync(second)
+
+    after = first.stats()
+    assert after["hits"] - before["hits"] == 1
+    assert after["misses"] - before["misses"] == 2
+    assert after["process"]["hits"] == 1
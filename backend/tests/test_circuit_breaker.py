@@ -0,0 +1,114 @@
+import httpx
+import pytest
+from groq import APIConnectionError, InternalServerError, RateLimitError
+
+from app import circuit_breaker as cb
+from app.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+_REQUEST = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+
+
+def _status_error(cls, status: int):
+    return cls(f"HTTP {status}", response=httpx.Response(status, request=_REQUEST), body=None)
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    monkeypatch.setattr(cb, "time", clock)
+    monkeypatch.setattr(cb, "BREAKER_ENABLED", True)
+    monkeypatch.setattr(cb, "BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(cb, "BREAKER_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(cb, "BREAKER_WINDOW", 60.0)
+    monkeypatch.setattr(cb, "BREAKER_OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(cb, "BREAKER_SLOW_CALL", 10.0)
+    monkeypatch.setattr(cb, "BREAKER_HALF_OPEN_CALLS", 1)
+    return CircuitBreaker()
+
+
+def _fail(breaker: CircuitBreaker, error=None) -> None:
+    assert breaker.allow()
+    breaker.record_error(error or APIConnectionError(request=_REQUEST))
+
+
+def _succeed(breaker: CircuitBreaker, latency: float = 0.1) -> None:
+    assert breaker.allow()
+    breaker.record_success(latency)
+
+
+def test_opens_when_failure_rate_reached(breaker):
+    _succeed(breaker)
+    _succeed(breaker)
+    _fail(breaker)
+    assert breaker.state == CLOSED
+    _fail(breaker)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(30.0)
+
+
+def test_needs_minimum_calls_before_opening(breaker):
+    _fail(breaker)
+    _fail(breaker)
+    _fail(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_client_errors_and_429_are_neutral(breaker):
+    for _ in range(5):
+        _fail(breaker, _status_error(RateLimitError, 429))
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 0
+
+
+def test_server_errors_and_broken_streams_are_failures(breaker):
+    _fail(breaker, _status_error(InternalServerError, 503))
+    _fail(breaker, httpx.ReadError("connection reset mid-stream"))
+    _fail(breaker)
+    _fail(breaker)
+    assert breaker.state == OPEN
+
+
+def test_slow_calls_count_as_failures(breaker):
+    for _ in range(4):
+        _succeed(breaker, latency=15.0)
+    assert breaker.state == OPEN
+
+
+def test_old_failures_leave_the_window(breaker, clock):
+    _fail(breaker)
+    _fail(breaker)
+    _fail(breaker)
+    clock.advance(61)
+    _succeed(breaker)
+    _fail(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_one_probe_and_closes_on_success(breaker, clock):
+    for _ in range(4):
+        _fail(breaker)
+    clock.advance(30)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()   # второй пробный запрос не пропускаем
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens(breaker, clock):
+    for _ in range(4):
+        _fail(breaker)
+    clock.advance(30)
+    _fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == pytest.approx(30.0)
+
+
+def test_neutral_probe_outcome_releases_the_slot(breaker, clock):
+    for _ in range(4):
+        _fail(breaker)
+    clock.advance(30)
+    _fail(breaker, _status_error(RateLimitError, 429))
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from app.database import user_db, SessionLocal, UsageEventModel
+from app.pipeline import CANCELLED_PROGRESS
+from app.worker import JobRunner
+
+pytestmark = pytest.mark.usefixtures("empty_queue")
+
+
+def _charged_job(unique, username: str) -> str:
+    """Задача с оплаченной генерацией (id события = id задачи, как в /api/generate)"""
+    job_id = unique("job")
+    assert user_db.reserve_generation(username, 3, event_id=job_id)
+    user_db.create_job(job_id, username, 2, "full", "идея", "")
+    return job_id
+
+
+def _used(username: str) -> int:
+    return user_db.get_usage_info(username)["generations_used"]
+
+
+def _event_type(job_id: str) -> str:
+    db = SessionLocal()
+    try:
+        return db.query(UsageEventModel.event_type).filter(UsageEventModel.id == job_id).scalar()
+    finally:
+        db.close()
+
+
+def test_cancel_queued_job_refunds_generation(unique, make_user):
+    username = make_user()
+    job_id = _charged_job(unique, username)
+    assert _used(username) == 1
+
+    assert user_db.request_job_cancel(job_id) == "cancelled"
+    assert user_db.get_job(job_id)["state"] == "cancelled"
+    assert _event_type(job_id) == "generation_cancelled"
+    assert _used(username) == 0
+    assert user_db.claim_job("worker", 60) is None
+
+
+def test_cancel_running_job_goes_through_the_worker(unique, make_user):
+    username = make_user()
+    job_id = _charged_job(unique, username)
+    user_db.claim_job("worker", 60)
+
+    assert user_db.request_job_cancel(job_id) == "cancelling"
+    assert user_db.get_jobs_to_cancel("worker", 30) == [job_id]
+    assert user_db.get_jobs_to_cancel("other", 30) == []
+    assert user_db.cancel_job(job_id, "worker")
+    assert user_db.get_job(job_id)["state"] == "cancelled"
+    assert _used(username) == 0
+
+
+def test_cancel_after_a_finished_stage_is_recorded_as_partial(unique, make_user):
+    username = make_user()
+    job_id = _charged_job(unique, username)
+    user_db.claim_job("worker", 60)
+    user_db.save_job_stage(job_id, "worker", {"analyst": "done", "architect": "running"}, {}, {})
+
+    user_db.request_job_cancel(job_id)
+    assert user_db.cancel_job(job_id, "worker")
+    assert _event_type(job_id) == "generation_partial"
+    assert _used(username) == 0
+    assert user_db.get_monthly_generations(username) == 0
+
+
+def test_cancel_after_finish_keeps_the_result(unique, make_user):
+    username = make_user()
+    job_id = _charged_job(unique, username)
+    user_db.claim_job("worker", 60)
+    assert user_db.finish_job(job_id, "worker", {"description": "готово"})
+
+    assert user_db.request_job_cancel(job_id) == "complete"
+    assert not user_db.cancel_job(job_id, "worker")
+    assert user_db.get_job(job_id)["state"] == "complete"
+    assert _used(username) == 1
+
+
+def test_late_cancel_republishes_the_finished_result(unique, make_user):
+    """Отмена, пришедшая после завершения, не затирает результат у подписчиков событием отмены"""
+    username = make_user()
+    job_id = _charged_job(unique, username)
+    published = []
+
+    async def publish(session_id, progress):
+        published.append(progress)
+
+    runner = JobRunner(1, publish=publish)
+    user_db.claim_job(runner.owner, 60)
+    user_db.finish_job(job_id, runner.owner, {"description": "готово"})
+
+    asyncio.run(runner._finish_cancelled(job_id))
+    assert published[-1]["completed"]
+    assert published[-1]["result"] == {"description": "готово"}
+    assert not published[-1].get("cancelled")
+    assert _used(username) == 1
+
+
+def test_cancel_of_running_job_publishes_cancellation(unique, make_user):
+    username = make_user()
+    job_id = _charged_job(unique, username)
+    published = []
+
+    async def publish(session_id, progress):
+        published.append(progress)
+
+    runner = JobRunner(1, publish=publish)
+    user_db.claim_job(runner.owner, 60)
+
+    asyncio.run(runner._finish_cancelled(job_id))
+    assert published == [CANCELLED_PROGRESS]
+    assert _used(username) == 0
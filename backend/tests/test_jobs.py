@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.database import user_db
+
+pytestmark = pytest.mark.usefixtures("empty_queue")
+
+
+def _job(unique, priority: int = 2) -> str:
+    job_id = unique("job")
+    user_db.create_job(job_id, "someone", priority, "full", "идея", "")
+    return job_id
+
+
+def test_each_job_is_claimed_by_one_worker(unique):
+    job_ids = {_job(unique) for _ in range(6)}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = list(pool.map(lambda i: user_db.claim_job(f"worker-{i}", 60), range(8)))
+
+    got = [job["id"] for job in claimed if job is not None]
+    assert sorted(got) == sorted(job_ids)
+    assert claimed.count(None) == 2
+
+
+def test_claims_follow_plan_priority(unique):
+    free = _job(unique, priority=2)
+    pro = _job(unique, priority=0)
+    assert user_db.claim_job("worker", 60)["id"] == pro
+    assert user_db.claim_job("worker", 60)["id"] == free
+
+
+def test_claim_sets_lease_and_counts_attempt(unique):
+    job_id = _job(unique)
+    job = user_db.claim_job("worker", 60)
+    assert job["id"] == job_id
+    assert job["state"] == "running"
+    assert job["attempts"] == 1
+    assert user_db.claim_job("other", 60) is None
+
+
+def test_expired_lease_is_taken_over_and_old_owner_is_fenced(unique):
+    job_id = _job(unique)
+    user_db.claim_job("crashed", -1)   # аренда уже истекла — воркер упал
+
+    job = user_db.claim_job("rescuer", 60)
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    # Старый владелец больше ничего не может записать в задачу
+    assert not user_db.renew_job_lease(job_id, "crashed", 60)
+    assert not user_db.save_job_stage(job_id, "crashed", {"analyst": "done"}, {}, {})
+    assert not user_db.finish_job(job_id, "crashed", {"x": 1})
+    assert user_db.finish_job(job_id, "rescuer", {"x": 2})
+    assert user_db.get_job(job_id)["result"] == {"x": 2}
+
+
+def test_renewed_lease_is_not_taken_over(unique):
+    job_id = _job(unique)
+    user_db.claim_job("worker", -1)
+    assert user_db.renew_job_lease(job_id, "worker", 60)
+    assert user_db.claim_job("other", 60) is None
+
+
+def test_saved_stages_survive_a_takeover(unique):
+    job_id = _job(unique)
+    user_db.claim_job("crashed", 60)
+    assert user_db.save_job_stage(job_id, "crashed", {"analyst": "done"}, {"analyst": {"a": 1}}, {})
+    user_db.release_jobs("crashed")
+
+    job = user_db.claim_job("next", 60)
+    assert job["stages"] == {"analyst": "done"}
+    assert job["stage_results"] == {"analyst": {"a": 1}}
+
+
+def test_release_requeues_without_counting_an_attempt(unique):
+    job_id = _job(unique)
+    user_db.claim_job("stopping", 60)
+    assert user_db.release_jobs("stopping") == 1
+
+    job = user_db.get_job(job_id)
+    assert job["state"] == "queued"
+    assert job["attempts"] == 0
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from app import json_repair as jr
+from app.json_repair import JSONRepairError, RepairStats, repair_json
+
+
+def test_valid_json_needs_no_fixes():
+    assert repair_json('{"a": [1, 2], "b": null}') == ({"a": [1, 2], "b": None}, [])
+
+
+def test_code_fence_and_surrounding_text():
+    result, fixes = repair_json('Вот ответ:\n```json\n{"name": "agent"}\n```\nГотово.')
+    assert result == {"name": "agent"}
+    assert fixes == ["surrounding_text"]
+
+
+def test_trailing_text_after_root_object_is_ignored():
+    result, fixes = repair_json('{"x": "a"} trailing {"y":1}')
+    assert result == {"x": "a"}
+    assert "surrounding_text" in fixes
+
+
+def test_trailing_commas_comments_and_python_literals():
+    result, fixes = repair_json('{\n  "a": True, // флаг\n  "b": [None, False,],\n}')
+    assert result == {"a": True, "b": [None, False]}
+    assert set(fixes) == {"comment", "python_literal", "trailing_comma"}
+
+
+def test_unescaped_quotes_inside_mermaid_code_stay_in_the_string():
+    content = '{"mermaid_code": "graph TD\n  A --> C{"Решение?"} --> D"}'
+    result, fixes = repair_json(content)
+    assert result == {"mermaid_code": 'graph TD\n  A --> C{"Решение?"} --> D'}
+    assert {"quote", "control_char"} <= set(fixes)
+
+
+def test_invalid_escapes_become_literal_backslashes():
+    result, fixes = repair_json('{"pattern": "\\d+\\s\\(x\\)", "ok": "\\n\\u0041"}')
+    assert result == {"pattern": "\\d+\\s\\(x\\)", "ok": "\nA"}
+    assert fixes == ["escape"]
+
+
+def test_missing_comma_between_lines():
+    result, fixes = repair_json('{"steps": [\n  "один"\n  "два"\n]}')
+    assert result == {"steps": ["один", "два"]}
+    assert "missing_comma" in fixes
+
+
+def test_truncated_response_is_closed_and_last_item_dropped():
+    result, fixes = repair_json('{"plan": ["a", "b"], "stack": {"db": "post')
+    assert result == {"plan": ["a", "b"], "stack": {"db": "post"}}
+    assert "truncated" in fixes
+
+    result, _ = repair_json('{"plan": ["a", "b"], "budget":')
+    assert result == {"plan": ["a", "b"]}
+
+
+@pytest.mark.parametrize("content", ["нет объекта", "[1, 2, 3]", '{"a": }'])
+def test_unrepairable_input_raises(content):
+    with pytest.raises(JSONRepairError):
+        repair_json(content)
+
+
+def test_response_cut_right_after_the_first_key_is_flagged_truncated():
+    # Пустой объект не пройдёт проверку схемы — по флагу этап просит модель продолжить
+    assert repair_json('{"a": ') == ({}, ["truncated"])
+
+
+def _stored(stats: RepairStats) -> dict:
+    rows = stats._conn().execute("SELECT stage, outcome, count FROM json_repair_stats")
+    return {(stage, outcome): count for stage, outcome, count in rows}
+
+
+def test_stats_are_buffered_until_flush(monkeypatch):
+    monkeypatch.setattr(jr, "STATS_FLUSH_INTERVAL", 3600)
+    stats = RepairStats()
+    stats.clear()
+    for _ in range(3):
+        stats.record("analyst", "repaired")
+    stats.record("analyst", "unrepairable")
+    stats.record(None, "parsed")   # вне этапов не считаем
+    assert _stored(stats) == {}
+
+    stats.flush()
+    assert _stored(stats) == {("analyst", "repaired"): 3, ("analyst", "unrepairable"): 1}
+
+
+def test_stats_flush_in_background_after_interval(monkeypatch):
+    monkeypatch.setattr(jr, "STATS_FLUSH_INTERVAL", 0)
+    stats = RepairStats()
+    stats.clear()
+    stats.record("architect", "parsed")
+
+    deadline = time.monotonic() + 2
+    while not _stored(stats) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _stored(stats) == {("architect", "parsed"): 1}
+
+
+def test_stats_report_rates():
+    stats = RepairStats()
+    stats.clear()
+    for outcome in ("repaired", "repaired", "repaired", "invalid", "followup_ok", "followup_failed"):
+        stats.record("planner", outcome)
+
+    planner = stats.stats()["planner"]
+    assert planner["repaired"] == 3
+    assert planner["repair_rate"] == 0.75
+    assert planner["followup_rate"] == 0.5
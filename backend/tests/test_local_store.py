@@ -0,0 +1,77 @@
+from app import local_store
+from app.local_store import DiskCache
+
+
+def _cache(unique, monkeypatch, clock, **limits):
+    monkeypatch.setattr(local_store, "time", clock)
+    params = {"ttl": 60, "max_entries": 100, "max_bytes": 1_000_000, **limits}
+    return DiskCache(unique("cache"), **params)
+
+
+def test_set_get_roundtrip(unique, monkeypatch, clock):
+    cache = _cache(unique, monkeypatch, clock)
+    cache.set("k", {"answer": 42, "text": "привет"})
+    assert cache.get("k") == {"answer": 42, "text": "привет"}
+    assert cache.get("missing") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_entry_expires_after_ttl(unique, monkeypatch, clock):
+    cache = _cache(unique, monkeypatch, clock, ttl=10)
+    cache.set("k", "v")
+    clock.advance(9)
+    assert cache.get("k") == "v"
+    clock.advance(2)
+    assert cache.get("k") is None
+    stats = cache.stats()
+    assert stats["expired"] == 1
+    assert stats["entries"] == 0
+
+
+def test_reads_do_not_extend_ttl(unique, monkeypatch, clock):
+    cache = _cache(unique, monkeypatch, clock, ttl=10)
+    cache.set("k", "v")
+    for _ in range(3):
+        clock.advance(4)
+        cache.get("k")
+    assert cache.get("k") is None
+
+
+def test_evicts_least_recently_used_over_entry_limit(unique, monkeypatch, clock):
+    cache = _cache(unique, monkeypatch, clock, max_entries=10)
+    for i in range(10):
+        cache.set(f"k{i}", i)
+        clock.advance(1)
+    cache.get("k0")   # k0 снова свежий — вытесняются k1, k2
+    clock.advance(1)
+    cache.set("k10", 10)
+
+    stats = cache.stats()
+    assert stats["entries"] == 9   # запас 10%: не чистим на каждой записи
+    assert stats["evicted"] == 2
+    assert cache.get("k0", count=False) == 0
+    assert cache.get("k1", count=False) is None
+    assert cache.get("k2", count=False) is None
+    assert cache.get("k10", count=False) == 10
+
+
+def test_evicts_over_byte_limit(unique, monkeypatch, clock):
+    cache = _cache(unique, monkeypatch, clock, max_bytes=1000)
+    for i in range(5):
+        cache.set(f"k{i}", "x" * 300)
+        clock.advance(1)
+    assert cache.stats()["size_bytes"] <= 1000
+    assert cache.get("k4", count=False) is not None
+    assert cache.get("k0", count=False) is None
+
+
+def test_clear_by_tag(unique, monkeypatch, clock):
+    cache = _cache(unique, monkeypatch, clock)
+    cache.set("a", 1, tag="user:alice")
+    cache.set("b", 2, tag="user:bob")
+    cache.set("c", 3)
+    assert cache.clear(tag="user:alice") == 1
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.clear() == 2
@@ -0,0 +1,73 @@
+import json
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main as app_main
+from app.progress_store import progress_store
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Поток живой генерации закрывается через секунду, а не через 10 минут
+    monkeypatch.setattr(app_main, "SSE_MAX_DURATION", 1)
+    monkeypatch.setattr(app_main, "SSE_SUBSCRIBER_TOUCH", 0.2)
+    return TestClient(app_main.app)
+
+
+def _events(body: str):
+    """(id, данные) событий прогресса; stage_result и служебные строки пропускаем"""
+    events = []
+    for block in body.split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "data" in lines and "event" not in lines:
+            events.append((lines.get("id"), json.loads(lines["data"])))
+    return events
+
+
+def _publish(session_id: str, *snapshots) -> None:
+    async def main():
+        for snapshot in snapshots:
+            await progress_store.publish(session_id, snapshot)
+
+    asyncio.run(main())
+
+
+def test_last_event_id_newer_than_store_gets_final_snapshot(client, unique):
+    """Хранилище перезапущено и нумерует заново — клиент с id из прошлой жизни получает итог, а не висит"""
+    session_id = unique("session")
+    _publish(session_id, {"progress": 40}, {"progress": 100, "completed": True, "result": {"a": 1}})
+
+    response = client.get(f"/api/generate/{session_id}/progress", headers={"Last-Event-ID": "9"})
+    assert response.status_code == 200
+    assert _events(response.text) == [("2", {"progress": 100, "completed": True, "result": {"a": 1}})]
+
+
+def test_last_event_id_of_final_snapshot_stops_reconnects(client, unique):
+    session_id = unique("session")
+    _publish(session_id, {"progress": 40}, {"progress": 100, "completed": True, "result": {"a": 1}})
+
+    response = client.get(f"/api/generate/{session_id}/progress", headers={"Last-Event-ID": "2"})
+    assert response.status_code == 204
+
+
+def test_resume_sends_only_missed_snapshots(client, unique):
+    session_id = unique("session")
+    _publish(
+        session_id,
+        {"progress": 10},
+        {"progress": 40},
+        {"progress": 100, "completed": True, "result": {"a": 1}},
+    )
+
+    response = client.get(f"/api/generate/{session_id}/progress", headers={"Last-Event-ID": "1"})
+    assert [event_id for event_id, _ in _events(response.text)] == ["3"]
+
+
+def test_unknown_last_event_id_on_running_generation_resends_current_snapshot(client, unique):
+    session_id = unique("session")
+    _publish(session_id, {"progress": 40, "stage": "Проектирование..."})
+
+    response = client.get(f"/api/generate/{session_id}/progress", headers={"Last-Event-ID": "7"})
+    assert _events(response.text) == [("1", {"progress": 40, "stage": "Проектирование..."})]
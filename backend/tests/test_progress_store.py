@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from app import progress_store as ps
+from app.progress_store import MemoryProgressStore, SQLiteProgressStore
+
+
+class Spill:
+    """Таблица progress_spill в памяти: считает обращения к ней"""
+
+    def __init__(self):
+        self.rows = {}
+        self.loads = []
+
+    def spill(self, session_id, version, progress):
+        self.rows[session_id] = (version, progress)
+
+    def load(self, session_id):
+        self.loads.append(session_id)
+        return self.rows.get(session_id)
+
+
+@pytest.fixture
+def spill():
+    return Spill()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, spill, monkeypatch, clock):
+    monkeypatch.setattr(ps, "time", clock)
+    if request.param == "sqlite":
+        conn = SQLiteProgressStore()._conn()
+        for table in ("generation_progress", "generation_progress_history", "generation_progress_evicted"):
+            conn.execute(f"DELETE FROM {table}")
+    cls = MemoryProgressStore if request.param == "memory" else SQLiteProgressStore
+    return lambda **kwargs: cls(spill=spill.spill, load=spill.load, **kwargs)
+
+
+def _done(n):
+    return {"completed": True, "stage": "Готово!", "result": {"n": n, "text": "x" * 200}}
+
+
+def test_versions_and_history(make_store):
+    store = make_store()
+
+    async def main():
+        for step in range(3):
+            assert await store.publish("s", {"step": step}) == step + 1
+        assert await store.get("s") == (3, {"step": 2})
+        assert await store.get("s", version=2) == (2, {"step": 1})
+        # После финала история сводится к финальному снимку
+        await store.publish("s", _done(1))
+        assert await store.get("s", version=3) is None
+        assert (await store.get("s", version=4))[1]["completed"]
+
+    asyncio.run(main())
+
+
+def test_entry_cap_evicts_least_recently_read_finished_results(make_store, spill, clock):
+    store = make_store(max_entries=3)
+
+    async def main():
+        for n in range(3):
+            await store.publish(f"s{n}", _done(n))
+            clock.advance(2)
+        await store.get("s0")   # s0 прочитан недавно — вытесняется s1
+        clock.advance(2)
+        await store.publish("s3", _done(3))
+        await store.sweep()
+        assert store.stats()["sessions"] <= 3
+        assert "s1" in spill.rows
+        assert "s0" not in spill.rows
+        # Вытесненный результат всё ещё доступен опоздавшему подписчику
+        assert await store.get("s1") == (1, _done(1))
+
+    asyncio.run(main())
+    assert store.stats()["evicted"] >= 1
+
+
+def test_byte_cap_applies(make_store, clock):
+    store = make_store(max_bytes=1000)
+
+    async def main():
+        for n in range(10):
+            await store.publish(f"s{n}", _done(n))
+            clock.advance(1)
+        await store.sweep()
+
+    asyncio.run(main())
+    assert store.stats()["size_bytes"] <= 1000
+
+
+def test_running_generations_are_never_evicted(make_store, spill):
+    store = make_store(max_entries=2)
+
+    async def main():
+        for n in range(4):
+            await store.publish(f"s{n}", {"step": 1, "stage": "Проектирование..."})
+        await store.sweep()
+        for n in range(4):
+            assert await store.get(f"s{n}") is not None
+
+    asyncio.run(main())
+    assert spill.rows == {}
+
+
+def test_miss_on_unknown_session_does_not_query_spill_table(make_store, spill):
+    store = make_store()
+    assert asyncio.run(store.get("never-published")) is None
+    assert spill.loads == []
+
+
+def test_expired_snapshot_is_hidden_and_reaped(make_store, clock):
+    store = make_store(ttl=10)
+
+    async def main():
+        await store.publish("s", {"step": 1})
+        clock.advance(11)
+        assert await store.get("s") is None   # ещё до прохода уборщика
+        await store.sweep()
+
+    asyncio.run(main())
+    stats = store.stats()
+    assert stats["sessions"] == 0
+    assert stats["expired"] == 1
+
+
+def test_background_reaper_runs_sweeps(make_store, monkeypatch):
+    monkeypatch.setattr(ps, "SWEEP_INTERVAL", 0.01)
+    store = make_store()
+    sweeps = []
+
+    async def sweep():
+        sweeps.append(1)
+
+    store.sweep = sweep
+
+    async def main():
+        await store.start()
+        await store.start()   # повторный старт не создаёт второй уборщик
+        await asyncio.sleep(0.05)
+        assert store.stats()["reaper_running"]
+        await store.stop()
+
+    asyncio.run(main())
+    assert sweeps
+    assert not store.stats()["reaper_running"]
+
+
+def test_wait_returns_newer_snapshot_or_times_out():
+    store = MemoryProgressStore()
+
+    async def main():
+        await store.publish("s", {"step": 1})
+        assert await store.wait("s", after_version=0, timeout=0.1) == (1, {"step": 1})
+        assert await store.wait("s", after_version=1, timeout=0.05) is None
+
+        waiter = asyncio.create_task(store.wait("s", after_version=1, timeout=1))
+        await asyncio.sleep(0.01)
+        await store.publish("s", {"step": 2})
+        assert await waiter == (2, {"step": 2})
+
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from app import rate_limiter as rl
+from app.rate_limiter import RateLimiter, parse_duration
+
+
+@pytest.fixture
+def limiter(monkeypatch, clock):
+    """Лимитер 60 RPM / 6000 TPM на пустом общем состоянии и ручных часах"""
+    monkeypatch.setattr(rl, "time", clock)
+    monkeypatch.setattr(rl.random, "uniform", lambda a, b: 0.0)
+    limiter = RateLimiter(rpm=60, tpm=6000)
+    conn = limiter._conn()
+    conn.execute("DELETE FROM rate_limit_state")
+    conn.execute("DELETE FROM rate_limit_queue")
+    return limiter
+
+
+def _take(limiter: RateLimiter, tokens: int = 10) -> float:
+    ticket = limiter._enqueue()
+    wait = limiter._try_acquire(ticket, tokens, first=True)
+    if wait:
+        limiter._dequeue(ticket)
+    return wait
+
+
+def test_request_bucket_empties_then_refills(limiter, clock):
+    for _ in range(60):
+        assert _take(limiter) == 0
+    assert _take(limiter) == pytest.approx(1.0)   # 60 RPM — один запрос в секунду
+    clock.advance(1)
+    assert _take(limiter) == 0
+
+
+def test_token_bucket_limits_large_requests(limiter, clock):
+    assert _take(limiter, tokens=5000) == 0
+    # Осталось 1000 токенов, нужно 3000 — пополнение 100 токенов/с
+    assert _take(limiter, tokens=3000) == pytest.approx(20.0)
+    clock.advance(20)
+    assert _take(limiter, tokens=3000) == 0
+
+
+def test_bucket_never_exceeds_capacity(limiter, clock):
+    _take(limiter)
+    clock.advance(3600)
+    assert limiter.stats()["requests_available"] == 60
+    assert limiter.stats()["tokens_available"] == 6000
+
+
+def test_waiters_are_served_in_ticket_order(limiter):
+    first = limiter._enqueue()
+    second = limiter._enqueue()
+    assert limiter._try_acquire(second, 10, first=True) == pytest.approx(0.05)   # впереди другой
+    assert limiter._try_acquire(first, 10, first=True) == 0
+    assert limiter._try_acquire(second, 10, first=False) == 0
+
+
+def test_429_blocks_all_callers_for_retry_after(limiter, clock):
+    _take(limiter)
+    limiter._apply_headers({"retry-after": "7"}, limited=True)
+    assert _take(limiter) == pytest.approx(7.0)
+    clock.advance(7)
+    assert _take(limiter) == 0
+    assert limiter.stats()["rate_limited_responses"] == 1
+
+
+def test_remaining_tokens_header_lowers_local_estimate(limiter):
+    limiter._apply_headers({"x-ratelimit-remaining-tokens": "100"}, limited=False)
+    assert limiter.stats()["tokens_available"] == 100
+
+
+def test_settle_returns_unused_reservation(limiter):
+    _take(limiter, tokens=4000)
+    limiter._settle(reserved=4000, actual=1000)
+    assert limiter.stats()["tokens_available"] == 5000
+
+
+def test_acquire_returns_reservation(limiter):
+    assert asyncio.run(limiter.acquire(500)) == 500
+    assert limiter.stats()["tokens_available"] == 5500
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("7.66s", 7.66), ("2m59.56s", 179.56), ("120ms", 0.12), ("1h", 3600.0), ("3", 3.0), (None, None), ("soon", None),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_cancelled_waiter_leaves_the_queue(limiter):
+    limiter._apply_headers({"retry-after": "60"}, limited=True)
+
+    async def main():
+        waiter = asyncio.create_task(limiter.acquire(100))
+        await asyncio.sleep(0.05)
+        assert limiter.stats()["queue_length"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert limiter.stats()["queue_length"] == 0
+
+
+def test_failed_call_returns_its_reservation(limiter, monkeypatch):
+    from app import llm
+    from app.circuit_breaker import CircuitBreaker
+
+    class FailingProvider:
+        async def create(self, **kwargs):
+            raise TimeoutError("provider timeout")
+
+    monkeypatch.setattr(llm, "rate_limiter", limiter)
+    monkeypatch.setattr(llm, "circuit_breaker", CircuitBreaker())
+    monkeypatch.setattr(llm, "get_provider", lambda: FailingProvider())
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(llm._create_completion("идея " * 300))
+    # Списан только запрос; токены резерва вернулись в ведро
+    assert limiter.stats()["tokens_available"] == 6000
+    assert limiter.stats()["requests_available"] == 59
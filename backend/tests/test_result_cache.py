@@ -0,0 +1,42 @@
+import pytest
+
+from app.result_cache import GenerationCache
+
+RESULT = {"description": "агент"}
+
+
+@pytest.fixture
+def cache():
+    cache = GenerationCache()
+    cache.invalidate()
+    return cache
+
+
+def test_user_invalidation_keeps_other_users_and_global(cache):
+    cache.set("fp", "alice", RESULT)
+    cache.set("fp", "bob", RESULT)
+
+    assert cache.invalidate("alice", "user") == 1
+    assert cache.get("fp", "alice") == (RESULT, "global")
+    assert cache.get("fp", "bob") == (RESULT, "user")
+
+
+def test_user_named_global_does_not_touch_the_global_scope(cache):
+    cache.set("fp", "global", RESULT)
+    assert cache.invalidate("global") == 1
+    assert cache.get("fp", "someone") == (RESULT, "global")
+
+
+def test_global_scope_keeps_personal_entries(cache):
+    cache.set("fp", "alice", RESULT)
+    assert cache.invalidate(scope="global") == 1
+    assert cache.get("fp", "alice") == (RESULT, "user")
+    assert cache.get("fp", "bob") == (None, None)
+
+
+@pytest.mark.parametrize("username, scope", [(None, "globl"), (None, "user"), ("alice", "global"), ("alice", "all")])
+def test_invalid_scope_clears_nothing(cache, username, scope):
+    cache.set("fp", "alice", RESULT)
+    with pytest.raises(ValueError):
+        cache.invalidate(username, scope)
+    assert cache.get("fp", "alice") == (RESULT, "user")
@@ -0,0 +1,141 @@
+import time
+import asyncio
+
+import pytest
+
+from app import singleflight as sf
+from app.singleflight import SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(sf, "SINGLEFLIGHT_POLL", 0.01)
+
+
+def test_concurrent_calls_share_one_request(unique):
+    saved = []
+    flight = SingleFlight(on_saved=saved.append)
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"answer": calls}
+
+    async def main():
+        key = unique("key")
+        return await asyncio.gather(*(flight.do(key, fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == 1
+    assert results == [{"answer": 1}] * 5
+    assert saved == ["local"] * 4
+
+
+def test_different_keys_run_separately(unique):
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        a, b = unique("a"), unique("b")
+        return await asyncio.gather(flight.do(a, lambda: fetch(a)), flight.do(b, lambda: fetch(b))), (a, b)
+
+    results, keys = asyncio.run(main())
+    assert list(results) == list(keys)
+    assert sorted(calls) == sorted(keys)
+
+
+def test_cancelled_waiter_does_not_cancel_the_request(unique):
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        key = unique("key")
+        first = asyncio.create_task(flight.do(key, fetch))
+        second = asyncio.create_task(flight.do(key, fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(main())
+    assert result == "done"
+    assert first.cancelled()
+
+
+def test_error_reaches_every_waiter_and_frees_the_key(unique):
+    flight = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    async def main():
+        key = unique("key")
+        results = await asyncio.gather(flight.do(key, failing), flight.do(key, failing), return_exceptions=True)
+        assert calls == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+        # Следующий вызов — новый запрос, а не закэшированная ошибка
+        await asyncio.gather(flight.do(key, failing), return_exceptions=True)
+
+    asyncio.run(main())
+    assert calls == 2
+
+
+def test_waits_for_another_worker_and_reads_shared_result(unique):
+    saved = []
+    flight = SingleFlight(on_saved=saved.append)
+    key = unique("key")
+    flight._conn().execute(
+        "INSERT INTO llm_inflight (key, owner, expires_at) VALUES (?, ?, ?)", (key, "other-worker", time.time() + 60),
+    )
+    shared = {}
+
+    async def fetch():
+        raise AssertionError("запрос уже выполняет другой воркер")
+
+    async def shared_get():
+        return shared.get(key)
+
+    async def other_worker_finishes():
+        await asyncio.sleep(0.05)
+        shared[key] = {"answer": "from cache"}
+        flight._conn().execute("DELETE FROM llm_inflight WHERE key = ?", (key,))
+
+    async def main():
+        finisher = asyncio.create_task(other_worker_finishes())
+        result = await flight.do(key, fetch, shared_get=shared_get)
+        await finisher
+        return result
+
+    assert asyncio.run(main()) == {"answer": "from cache"}
+    assert saved == ["remote"]
+
+
+def test_takes_over_when_other_worker_left_no_result(unique):
+    flight = SingleFlight()
+    key = unique("key")
+    # Блокировка истекла — владелец упал, не положив ответ
+    flight._conn().execute(
+        "INSERT INTO llm_inflight (key, owner, expires_at) VALUES (?, ?, ?)", (key, "dead-worker", time.time() - 1),
+    )
+
+    async def fetch():
+        return "fresh"
+
+    async def shared_get():
+        return None
+
+    assert asyncio.run(flight.do(key, fetch, shared_get=shared_get)) == "fresh"
+    assert not flight._is_locked(key)
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.database import user_db, SessionLocal, UsageCounterModel
+
+
+def _counters(username: str) -> UsageCounterModel:
+    db = SessionLocal()
+    try:
+        return db.query(UsageCounterModel).filter(UsageCounterModel.username == username).one()
+    finally:
+        db.close()
+
+
+def _set_counters(username: str, **values) -> None:
+    db = SessionLocal()
+    try:
+        db.query(UsageCounterModel).filter(UsageCounterModel.username == username).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_parallel_reservations_never_exceed_the_limit(make_user):
+    username = make_user()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        granted = list(pool.map(lambda _: user_db.reserve_generation(username, 3), range(12)))
+
+    assert granted.count(True) == 3
+    assert user_db.get_usage_info(username)["generations_used"] == 3
+    assert user_db.get_monthly_generations(username) == 3
+
+
+def test_unlimited_plan_is_not_capped(make_user):
+    username = make_user("pro")
+    assert all(user_db.reserve_generation(username, -1) for _ in range(5))
+    assert user_db.get_usage_info(username)["generations_remaining"] == -1
+
+
+def test_counter_starts_over_in_a_new_month(make_user):
+    username = make_user()
+    for _ in range(3):
+        assert user_db.reserve_generation(username, 3)
+    assert not user_db.reserve_generation(username, 3)
+
+    _set_counters(username, month="2000-01")   # последняя генерация была в прошлом месяце
+    assert user_db.get_usage_info(username)["generations_used"] == 0
+    assert user_db.reserve_generation(username, 3)
+    assert _counters(username).generations == 1
+
+
+def test_refund_returns_the_generation(make_user, unique):
+    username = make_user()
+    event_id = unique("session")
+    assert user_db.reserve_generation(username, 1, event_id=event_id)
+    assert not user_db.reserve_generation(username, 1)
+
+    assert user_db.refund_generation(event_id)
+    assert not user_db.refund_generation(event_id)   # повторный возврат ничего не меняет
+    assert user_db.get_usage_info(username)["generations_used"] == 0
+    assert user_db.reserve_generation(username, 1)
+
+
+def test_cached_generation_is_not_counted(make_user):
+    username = make_user()
+    user_db.record_generation(username, "generation_cached")
+    assert user_db.get_usage_info(username)["generations_used"] == 0
+
+
+def test_agent_limit_and_delete(make_user, unique):
+    username = make_user()
+    first = unique("agent")
+    assert user_db.save_agent(first, username, "Агент", "роль", "🤖", "идея", {}, max_agents=2)
+    assert user_db.save_agent(unique("agent"), username, "Агент", "роль", "🤖", "идея", {}, max_agents=2)
+    assert user_db.save_agent(unique("agent"), username, "Агент", "роль", "🤖", "идея", {}, max_agents=2) is None
+    assert user_db.get_user_agent_count(username) == 2
+
+    assert user_db.delete_agent(first, username)
+    assert not user_db.delete_agent(first, username)
+    info = user_db.get_usage_info(username)
+    assert info["agents_count"] == 1
+    assert user_db.save_agent(unique("agent"), username, "Агент", "роль", "🤖", "идея", {}, max_agents=2)
+
+
+def test_missing_counters_are_rebuilt_from_events(make_user, unique):
+    username = make_user()
+    user_db.reserve_generation(username, -1)
+    user_db.reserve_generation(username, -1)
+    user_db.save_agent(unique("agent"), username, "Агент", "роль", "🤖", "идея", {})
+
+    db = SessionLocal()
+    try:
+        db.query(UsageCounterModel).filter(UsageCounterModel.username == username).delete()
+        db.commit()
+    finally:
+        db.close()
+
+    info = user_db.get_usage_info(username)
+    assert (info["generations_used"], info["agents_count"]) == (2, 1)
@@ -59,9 +59,10 @@ export function ChatCopilot({ isOpen, onClose, dashboardContext, agentId, initia
     setSuggestedActions([]);
 
     try {
+      // Потоковые эндпоинты: текст ответа приходит по мере генерации (SSE)
       const url = agentId
-        ? `${API_URL}/api/agents/${agentId}/chat`
-        : `${API_URL}/api/chat`;
+        ? `${API_URL}/api/agents/${agentId}/chat/stream`
+        : `${API_URL}/api/chat/stream`;
 
       const currentStep = stepContext || currentStepContext || undefined;
 
@@ -87,15 +88,39 @@ export function ChatCopilot({ isOpen, onClose, dashboardContext, agentId, initia
         body,
       });
 
-      if (!response.ok) throw new Error('Ошибка чата');
+      if (!response.ok || !response.body) throw new Error('Ошибка чата');
 
-      const data = await response.json();
+      // Пустое сообщение ассистента, которое дописываем по мере прихода токенов
+      let answer = '';
+      setMessages((prev) => [...prev, { role: 'assistant', content: '' }]);
+      const updateAnswer = (content: string) =>
+        setMessages((prev) => [...prev.slice(0, -1), { role: 'assistant', content }]);
 
-      setMessages((prev) => [
-        ...prev,
-        { role: 'assistant', content: data.response },
-      ]);
-      setSuggestedActions(data.suggested_actions || []);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+        for (const raw of events) {
+          if (!raw.startsWith('data: ')) continue;
+          const event = JSON.parse(raw.slice(6));
+          if (event.type === 'token') {
+            answer += event.text;
+            updateAnswer(answer);
+          } else if (event.type === 'done') {
+            updateAnswer(event.response);
+            setSuggestedActions(event.suggested_actions || []);
+          } else if (event.type === 'error') {
+            throw new Error(event.detail || 'Ошибка чата');
+          }
+        }
+      }
     } catch (err) {
       console.error('Chat error:', err);
       setMessages((prev) => [
@@ -3,7 +3,7 @@ import type { DialogMessage, ClarifyResponse } from '../types.js';
 
 interface Props {
   idea: string;
-  onComplete: (messages: DialogMessage[]) => void;
+  onComplete: (messages: DialogMessage[], sessionId?: string) => void;
   onSkip: () => void;
 }
 
@@ -38,7 +38,8 @@ export function ClarificationDialog({ idea, onComplete }: Props) {
             'Content-Type': 'application/json',
             'Authorization': `Bearer ${token}`,
           },
-          body: JSON.stringify({ idea }),
+          // speculative: если вопросов не будет, бэкенд сразу запускает генерацию
+          body: JSON.stringify({ idea, speculative: true }),
         });
 
         const data: ClarifyResponse = await response.json();
@@ -58,7 +59,7 @@ export function ClarificationDialog({ idea, onComplete }: Props) {
           onComplete([
             { role: 'user', content: idea },
             { role: 'assistant', content: data.summary || idea }
-          ]);
+          ], data.session_id || undefined);
         }
       } catch (err) {
         console.error('Clarify error:', err);
@@ -1,8 +1,12 @@
+import type { AgentResponse } from '../types.js';
+
 interface LoadingScreenProps {
   stage: string;
+  onCancel?: () => void;
+  partial?: Partial<AgentResponse> | null;   // разделы, готовые до конца генерации
 }
 
-export function LoadingScreen({ stage }: LoadingScreenProps) {
+export function LoadingScreen({ stage, onCancel, partial }: LoadingScreenProps) {
   // Определяем прогресс по тексту стадии
   const getProgress = () => {
     if (stage.includes('Инициализация')) return 0;
@@ -41,11 +45,54 @@ export function LoadingScreen({ stage }: LoadingScreenProps) {
         <p className="animate-pulse text-cyan-400 font-medium">{stage}</p>
       </div>
 
+      {/* Черновик агента: разделы показываются по мере готовности этапов */}
+      {partial && (partial.agent_profile || partial.description || partial.tech_stack || partial.implementation_plan) && (
+        <div className="mt-8 w-full max-w-md mx-4 bg-white/5 border border-white/10 rounded-xl p-5 space-y-3 text-left">
+          {partial.agent_profile && (
+            <div className="flex items-center gap-3">
+              <span className="text-3xl">{partial.agent_profile.avatar}</span>
+              <div>
+                <p className="text-white font-semibold">{partial.agent_profile.name}</p>
+                <p className="text-gray-400 text-sm">{partial.agent_profile.role}</p>
+              </div>
+            </div>
+          )}
+          {partial.description && (
+            <p className="text-gray-300 text-sm line-clamp-3">{partial.description}</p>
+          )}
+          {partial.tech_stack && partial.tech_stack.length > 0 && (
+            <div className="flex flex-wrap gap-1.5">
+              {partial.tech_stack.map((tech) => (
+                <span key={tech} className="text-xs px-2 py-0.5 bg-cyan-500/10 text-cyan-300 rounded border border-cyan-500/20">
+                  {tech}
+                </span>
+              ))}
+            </div>
+          )}
+          {partial.implementation_plan && partial.implementation_plan.length > 0 && (
+            <p className="text-gray-400 text-xs">
+              План внедрения: {partial.implementation_plan.length} шагов
+            </p>
+          )}
+        </div>
+      )}
+
       <div className="mt-8 flex gap-2">
         <div className="w-2 h-2 bg-cyan-500 rounded-full animate-bounce"></div>
         <div className="w-2 h-2 bg-purple-500 rounded-full animate-bounce" style={{ animationDelay: '0.1s' }}></div>
         <div className="w-2 h-2 bg-pink-500 rounded-full animate-bounce" style={{ animationDelay: '0.2s' }}></div>
       </div>
+
+      {onCancel && (
+        <button
+          onClick={onCancel}
+          disabled={stage === 'Отмена...'}
+          className="mt-8 px-4 py-2 text-sm text-gray-400 border border-white/10 rounded-lg
+                     hover:text-white hover:bg-white/10 transition disabled:opacity-40"
+        >
+          Отменить генерацию
+        </button>
+      )}
     </div>
   );
 }
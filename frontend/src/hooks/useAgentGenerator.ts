@@ -1,13 +1,23 @@
-import { useState } from 'react';
-import type { AgentResponse, GenerationProgress, DialogMessage } from '../types.js';
+import { useRef, useState } from 'react';
+import type { AgentResponse, GenerationProgress, DialogMessage, StageResultEvent } from '../types.js';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
 /** Подписывается на SSE и резолвит Promise когда приходит финальный результат */
-function waitForResult(sessionId: string, onStage: (stage: string) => void): Promise<AgentResponse> {
+function waitForResult(
+  sessionId: string,
+  onStage: (stage: string) => void,
+  onPartial?: (data: Partial<AgentResponse>) => void,
+): Promise<AgentResponse> {
   return new Promise((resolve, reject) => {
     const eventSource = new EventSource(`${API_URL}/api/generate/${sessionId}/progress`);
 
+    // Разделы ответа приходят по мере готовности этапов — дашборд можно заполнять заранее
+    eventSource.addEventListener('stage_result', (event) => {
+      const { data }: StageResultEvent = JSON.parse((event as MessageEvent).data);
+      onPartial?.(data);
+    });
+
     eventSource.onmessage = (event) => {
       const data: GenerationProgress & { result?: AgentResponse } = JSON.parse(event.data);
 
@@ -25,9 +35,18 @@ function waitForResult(sessionId: string, onStage: (stage: string) => void): Pro
       }
     };
 
+    // Обрыв соединения: EventSource сам переподключается и присылает Last-Event-ID,
+    // сервер досылает пропущенное. Сдаёмся, только если переподключения подряд не удаются
+    let failures = 0;
+    eventSource.onopen = () => {
+      failures = 0;
+    };
     eventSource.onerror = () => {
-      eventSource.close();
-      reject(new Error('Потеряно соединение с сервером'));
+      failures += 1;
+      if (eventSource.readyState === EventSource.CLOSED || failures >= 5) {
+        eventSource.close();
+        reject(new Error('Потеряно соединение с сервером'));
+      }
     };
   });
 }
@@ -35,8 +54,11 @@ function waitForResult(sessionId: string, onStage: (stage: string) => void): Pro
 export function useAgentGenerator() {
   const [loading, setLoading] = useState(false);
   const [result, setResult] = useState<AgentResponse | null>(null);
+  const [partialResult, setPartialResult] = useState<Partial<AgentResponse> | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [loadingStage, setLoadingStage] = useState('');
+  const sessionRef = useRef<string | null>(null);
+  const cancelledRef = useRef(false);
 
   /**
    * Генерирует агента, автоматически сохраняет в БД.
@@ -45,19 +67,26 @@ export function useAgentGenerator() {
   const generateAgent = async (
     idea: string,
     dialogContext?: DialogMessage[],
+    speculativeSessionId?: string,
   ): Promise<string | null> => {
     setLoading(true);
     setError(null);
     setResult(null);
+    setPartialResult(null);
     setLoadingStage('Инициализация...');
+    sessionRef.current = null;
+    cancelledRef.current = false;
 
     const token = localStorage.getItem('token');
 
     try {
-      // idea всегда включаем — Pydantic требует его как обязательное поле
+      // idea всегда включаем — Pydantic требует его как обязательное поле.
+      // Агента сохраняет эта вкладка, поэтому при её закрытии генерацию можно остановить
       const body = dialogContext
-        ? { idea, original_idea: idea, messages: dialogContext }
-        : { idea };
+        ? { idea, original_idea: idea, messages: dialogContext, cancel_on_disconnect: true }
+        : { idea, cancel_on_disconnect: true };
+      // Генерация, запущенная спекулятивно на шаге уточнения, — забираем её вместо новой
+      const payload = speculativeSessionId ? { ...body, session_id: speculativeSessionId } : body;
 
       // 1. Запускаем генерацию — бэкенд возвращает session_id сразу
       const startRes = await fetch(`${API_URL}/api/generate`, {
@@ -66,7 +95,7 @@ export function useAgentGenerator() {
           'Content-Type': 'application/json',
           Authorization: `Bearer ${token}`,
         },
-        body: JSON.stringify(body),
+        body: JSON.stringify(payload),
       });
 
       if (!startRes.ok) {
@@ -80,10 +109,16 @@ export function useAgentGenerator() {
         throw new Error(typeof err.detail === 'string' ? err.detail : JSON.stringify(err));
       }
 
-      const { session_id } = await startRes.json();
+      const { session_id, result: cached } = await startRes.json();
+      sessionRef.current = session_id;
 
       // 2. Подписываемся на SSE — получаем прогресс в реальном времени + результат
-      const data = await waitForResult(session_id, setLoadingStage);
+      //    (если бэкенд отдал готовый результат из кэша — SSE не нужен)
+      const data: AgentResponse = cached ?? await waitForResult(
+        session_id,
+        setLoadingStage,
+        (data) => setPartialResult((prev) => ({ ...prev, ...data })),
+      );
 
       setResult(data);
 
@@ -108,21 +143,40 @@ export function useAgentGenerator() {
 
       return null;
     } catch (err) {
+      // Отмену пользователь запросил сам — это не ошибка
+      if (cancelledRef.current) return null;
       console.error('Generation error:', err);
       setError(
         err instanceof Error ? err.message : 'Не удалось сгенерировать агента. Попробуйте снова.',
       );
       return null;
     } finally {
+      sessionRef.current = null;
       setLoading(false);
       setLoadingStage('');
     }
   };
 
+  /** Отмена идущей генерации: сервер публикует финальное событие отмены, SSE закрывается */
+  const cancel = async () => {
+    const sessionId = sessionRef.current;
+    if (!sessionId) return;
+    cancelledRef.current = true;
+    setLoadingStage('Отмена...');
+    try {
+      await fetch(`${API_URL}/api/generate/${sessionId}/cancel`, {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${localStorage.getItem('token')}` },
+      });
+    } catch (err) {
+      console.error('Не удалось отменить генерацию:', err);
+    }
+  };
+
   const reset = () => {
     setResult(null);
     setError(null);
   };
 
-  return { loading, result, error, loadingStage, generateAgent, reset };
+  return { loading, result, partialResult, error, loadingStage, generateAgent, cancel, reset };
 }
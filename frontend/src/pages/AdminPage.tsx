@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
 
@@ -22,6 +22,8 @@ interface AdminUser {
   agents_count: number;
 }
 
+const PAGE_SIZE = 50;
+
 const PLAN_COLORS: Record<string, string> = {
   free:    'bg-gray-500/20 text-gray-300',
   starter: 'bg-purple-500/20 text-purple-300',
@@ -37,6 +39,12 @@ export function AdminPage() {
   const [loading, setLoading] = useState(true);
   const [actionLoading, setActionLoading] = useState<string | null>(null);
   const [search, setSearch] = useState('');
+  const [planFilter, setPlanFilter] = useState('');
+  const [sort, setSort] = useState('created_at');
+  const [totalUsers, setTotalUsers] = useState(0);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const filtersReady = useRef(false);
   // usage может загружаться асинхронно — ждём пока plan не 'free' или usage не загружен
   const { usage } = useAuth();
 
@@ -50,15 +58,29 @@ export function AdminPage() {
     loadData();
   }, [plan, usage]);
 
+  // Пользователи постранично: фильтры и сортировка на сервере, следующая страница — по курсору
+  const fetchUsers = async (cursor: string | null) => {
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE), sort, order: sort === 'username' ? 'asc' : 'desc' });
+    if (search.trim()) params.set('search', search.trim());
+    if (planFilter) params.set('plan', planFilter);
+    if (cursor) params.set('cursor', cursor);
+    const res = await fetch(`${API_URL}/api/admin/users?${params}`, {
+      headers: { Authorization: `Bearer ${token}` },
+    });
+    const page: AdminUser[] = await res.json();
+    setTotalUsers(Number(res.headers.get('X-Total-Count') || page.length));
+    setNextCursor(res.headers.get('X-Next-Cursor'));
+    setUsers((prev) => (cursor ? [...prev, ...page] : page));
+  };
+
   const loadData = async () => {
     setLoading(true);
     try {
-      const [statsRes, usersRes] = await Promise.all([
+      const [statsRes] = await Promise.all([
         fetch(`${API_URL}/api/admin/stats`, { headers: { Authorization: `Bearer ${token}` } }),
-        fetch(`${API_URL}/api/admin/users`, { headers: { Authorization: `Bearer ${token}` } }),
+        fetchUsers(null),
       ]);
       setStats(await statsRes.json());
-      setUsers(await usersRes.json());
     } catch {
       // ignore
     } finally {
@@ -66,6 +88,29 @@ export function AdminPage() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      await fetchUsers(nextCursor);
+    } catch {
+      // ignore
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Смена фильтров — первая страница заново (поиск — с задержкой, пока печатают)
+  useEffect(() => {
+    if (!filtersReady.current) {
+      filtersReady.current = true;
+      return;
+    }
+    if (plan !== 'admin') return;
+    const timer = setTimeout(() => { fetchUsers(null).catch(() => {}); }, 300);
+    return () => clearTimeout(timer);
+  }, [search, planFilter, sort]);
+
   const changePlan = async (username: string, newPlan: string) => {
     setActionLoading(username);
     try {
@@ -94,11 +139,6 @@ export function AdminPage() {
     }
   };
 
-  const filtered = users.filter((u) =>
-    u.username.toLowerCase().includes(search.toLowerCase()) ||
-    (u.email || '').toLowerCase().includes(search.toLowerCase())
-  );
-
   if (plan !== 'admin') return null;
 
   return (
@@ -142,8 +182,33 @@ export function AdminPage() {
             {/* Users Table */}
             <div className="bg-white/5 border border-white/10 rounded-2xl p-6">
               <div className="flex justify-between items-center mb-4 gap-4 flex-wrap">
-                <h2 className="text-lg font-semibold">Пользователи</h2>
+                <h2 className="text-lg font-semibold">
+                  Пользователи <span className="text-sm text-gray-500 font-normal">({totalUsers})</span>
+                </h2>
                 <div className="flex gap-3 items-center">
+                  <select
+                    value={planFilter}
+                    onChange={(e) => setPlanFilter(e.target.value)}
+                    className="px-3 py-2 bg-white/5 border border-white/10 rounded-lg text-sm text-white
+                               focus:outline-none focus:border-cyan-500"
+                  >
+                    <option value="">Все тарифы</option>
+                    <option value="free">Free</option>
+                    <option value="starter">Starter</option>
+                    <option value="pro">Pro</option>
+                    <option value="admin">Admin</option>
+                  </select>
+                  <select
+                    value={sort}
+                    onChange={(e) => setSort(e.target.value)}
+                    className="px-3 py-2 bg-white/5 border border-white/10 rounded-lg text-sm text-white
+                               focus:outline-none focus:border-cyan-500"
+                  >
+                    <option value="created_at">Новые</option>
+                    <option value="username">По имени</option>
+                    <option value="generations">По генерациям</option>
+                    <option value="agents">По агентам</option>
+                  </select>
                   <input
                     value={search}
                     onChange={(e) => setSearch(e.target.value)}
@@ -174,7 +239,7 @@ export function AdminPage() {
                     </tr>
                   </thead>
                   <tbody className="divide-y divide-white/5">
-                    {filtered.map((u) => (
+                    {users.map((u) => (
                       <tr key={u.username} className={`${u.disabled ? 'opacity-50' : ''}`}>
                         <td className="py-3 pr-4 font-medium">
                           {u.username}
@@ -220,9 +285,22 @@ export function AdminPage() {
                   </tbody>
                 </table>
 
-                {filtered.length === 0 && (
+                {users.length === 0 && (
                   <p className="text-center text-gray-500 py-8">Пользователей не найдено</p>
                 )}
+
+                {nextCursor && (
+                  <div className="text-center pt-4">
+                    <button
+                      onClick={loadMore}
+                      disabled={loadingMore}
+                      className="px-4 py-2 bg-white/10 rounded-lg text-sm hover:bg-white/20 transition
+                                 disabled:opacity-40"
+                    >
+                      {loadingMore ? 'Загрузка...' : `Показать ещё (${users.length} из ${totalUsers})`}
+                    </button>
+                  </div>
+                )}
               </div>
             </div>
           </>
@@ -16,7 +16,7 @@ export function NewAgentPage() {
   const [step, setStep] = useState<Step>('form');
   const [idea, setIdea] = useState('');
   const [showUpgrade, setShowUpgrade] = useState(false);
-  const { loading, loadingStage, error, generateAgent } = useAgentGenerator();
+  const { loading, loadingStage, partialResult, error, generateAgent, cancel } = useAgentGenerator();
 
   const handleSubmit = (userIdea: string) => {
     // Проверяем лимит до уточнения
@@ -37,9 +37,9 @@ export function NewAgentPage() {
     }
   };
 
-  const handleClarificationComplete = async (messages: DialogMessage[]) => {
+  const handleClarificationComplete = async (messages: DialogMessage[], sessionId?: string) => {
     setStep('loading');
-    afterGenerate(await generateAgent(idea, messages));
+    afterGenerate(await generateAgent(idea, messages, sessionId));
   };
 
   const handleSkipClarification = async () => {
@@ -48,7 +48,7 @@ export function NewAgentPage() {
   };
 
   if (loading || step === 'loading') {
-    return <LoadingScreen stage={loadingStage} />;
+    return <LoadingScreen stage={loadingStage} onCancel={cancel} partial={partialResult} />;
   }
 
   // Счётчик генераций
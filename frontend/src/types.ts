@@ -39,15 +39,25 @@ export interface AgentResponse {
   session_id?: string;
 }
 
+export type StageStatus = 'pending' | 'running' | 'done' | 'fallback';
+
 export interface GenerationProgress {
   stage: string;
-  step: number;
+  step: number;   // число завершённых этапов
   total: number;
+  stages?: Record<'analyst' | 'architect' | 'visualizer' | 'pm', StageStatus>;
   completed?: boolean;
   error?: boolean;
   result?: AgentResponse; // финальный результат приходит в последнем SSE-событии
 }
 
+// Раздел AgentResponse, готовый после одного этапа (SSE-событие stage_result)
+export interface StageResultEvent {
+  stage: 'analyst' | 'architect' | 'visualizer' | 'pm';
+  status: StageStatus;
+  data: Partial<AgentResponse>;
+}
+
 // Авторизация
 export interface User {
   username: string;
@@ -100,6 +110,7 @@ export interface ClarifyResponse {
   needs_clarification: boolean;
   questions: string[];
   summary: string;
+  session_id?: string | null; // генерация уже запущена — подтвердить через /api/generate
 }
 
 // Сохранённые агенты